@@ -22,6 +22,40 @@ class MusicPlayCommand(object):
     payload: int
 
 
+@dataclass
+class MusicSearchCommand(object):
+    # Look for playlists, albums and songs whose names contain these words
+    # and say what was found
+    payload: str
+
+
+@dataclass
+class MusicPlayByNameCommand(object):
+    # Play the song, album or playlist that best matches these words,
+    # switching the active playlist if needed
+    payload: str
+
+
+@dataclass
+class MusicListByNameCommand(object):
+    # Pick the playlist whose title best matches these words
+    payload: str
+
+
+@dataclass
+class MusicPlayByIdCommand(object):
+    # Play the song with this stable id, switching the active playlist if needed.
+    # A playlist id plays the first song of the playlist. Unlike the positions
+    # used by MusicPlayCommand these don't change when drives are added
+    payload: str
+
+
+@dataclass
+class MusicListByIdCommand(object):
+    # Pick the playlist with this stable id
+    payload: str
+
+
 @dataclass
 class MusicNextCommand(object):
     pass
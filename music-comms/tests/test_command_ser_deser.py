@@ -6,7 +6,7 @@ special encoder/decoder classes
 
 import jsonpickle
 
-from messages.music_control import MusicPlayCommand, MusicStopCommand
+from messages.music_control import MusicPlayCommand, MusicStopCommand, MusicPlayByNameCommand, MusicPlayByIdCommand
 
 
 def test_ser_deser_music_play():
@@ -25,3 +25,23 @@ def test_ser_deser_music_stop():
 
     got_obj = jsonpickle.decode(as_json)
     assert isinstance(got_obj, MusicStopCommand)
+
+
+def test_ser_deser_music_play_by_name():
+    payload = "yellow submarine"
+    test_command = MusicPlayByNameCommand(payload=payload)
+    as_json = jsonpickle.encode(test_command)
+
+    got_obj = jsonpickle.decode(as_json)
+    assert isinstance(got_obj, MusicPlayByNameCommand)
+    assert got_obj.payload == payload
+
+
+def test_ser_deser_music_play_by_id():
+    payload = "k3x7qf2m4a"
+    test_command = MusicPlayByIdCommand(payload=payload)
+    as_json = jsonpickle.encode(test_command)
+
+    got_obj = jsonpickle.decode(as_json)
+    assert isinstance(got_obj, MusicPlayByIdCommand)
+    assert got_obj.payload == payload
@@ -0,0 +1,83 @@
+"""
+Measures how much memory each playlist entry costs, held the way it was before, as a
+list of dataclass Items each with its own Path, and in an ItemList. The library is made
+to look like a big USB drive, a few thousand albums of a dozen songs, and an "All Music"
+playlist plus smaller playlists that name the same songs again.
+
+Run from the music-server folder:
+
+    python -m benchmarks.bench_item_memory
+"""
+import gc
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, List
+
+from musiclib.item_table import ItemTable
+from musiclib.media_lib import ItemList
+
+
+@dataclass
+class LegacyItem():
+    # The item as it was before, a dataclass with a dict holding a Path and a string
+    src: Path
+    album_name: str
+
+
+def song_paths(songs: int) -> List[str]:
+    return [f"/media/pi/MUSIC/Music/Artist {i // 12 % 300}/Album {i // 12:05d}/{i % 12:02d} Song number {i}.mp3"
+            for i in range(songs)]
+
+
+def legacy_playlists(paths: List[str], playlists: int) -> List[List[LegacyItem]]:
+    result = []
+    for p in range(playlists):
+        items = []
+        for path in paths[p::playlists] if p > 0 else paths:
+            src = Path(path)
+            items.append(LegacyItem(src=src, album_name=src.parent.stem))
+        result.append(items)
+    return result
+
+
+def compact_playlists(paths: List[str], playlists: int) -> List[ItemList]:
+    table = ItemTable()
+    result = []
+    for p in range(playlists):
+        items = ItemList(table=table)
+        for path in paths[p::playlists] if p > 0 else paths:
+            src = Path(path)
+            items.add(path, src.parent.stem)
+        result.append(items)
+    return result
+
+
+def measure(build: Callable[[], object]) -> int:
+    """
+    :return: The bytes still allocated once the playlists are built
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+    return after - before
+
+
+def main():
+    for songs in (10000, 100000, 1000000):
+        paths = song_paths(songs)
+        # An "All Music" playlist and four more that name a quarter of the songs each
+        entries = songs * 2
+        for name, build in (("dataclass", legacy_playlists), ("ItemList", compact_playlists)):
+            used = measure(lambda: build(paths, 5))
+            print(f"{songs:8d} songs {entries:8d} entries {name:10s} {used / 1024 / 1024:8.1f} MB "
+                  f"{used / entries:6.1f} bytes per entry")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Times how long the player takes from loading a song to it playing, the way MusicPlayer.start
+does it, for a song that isn't in the page cache, one that is and one the prefetcher has
+read. The songs are WAV files written to a temporary folder, or to --folder, which is best a
+folder on the USB stick being played from. The page cache is dropped for each song with
+posix_fadvise, so this needs Linux to be meaningful. The audio goes to the dummy driver.
+
+Run from the music-server folder:
+
+    python -m benchmarks.bench_prefetch
+    python -m benchmarks.bench_prefetch --folder /media/pi/MUSIC/bench
+"""
+import argparse
+import io
+import os
+import statistics
+import tempfile
+import time
+import wave
+from pathlib import Path
+from typing import Callable, List
+
+from client_player.prefetch import Prefetcher
+
+RATE = 44100
+
+
+def make_songs(folder: Path, count: int, seconds: int) -> List[Path]:
+    folder.mkdir(parents=True, exist_ok=True)
+    frames = bytes(RATE * seconds * 4)
+    songs = []
+    for i in range(count):
+        path = folder.joinpath(f"song {i:02d}.wav")
+        with wave.open(str(path), "wb") as f:
+            f.setnchannels(2)
+            f.setsampwidth(2)
+            f.setframerate(RATE)
+            f.writeframes(frames)
+        songs.append(path)
+    return songs
+
+
+def drop_from_page_cache(path: Path) -> None:
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def time_start(songs: List[Path], prepare: Callable[[Path], object]) -> List[float]:
+    """
+    :param prepare: Called before the clock starts, returns what to load, a path or the contents
+    :return: The milliseconds from load to play for each song
+    """
+    import pygame
+    times = []
+    for song in songs:
+        source = prepare(song)
+        start = time.perf_counter()
+        if isinstance(source, bytes):
+            pygame.mixer.music.load(io.BytesIO(source), "wav")
+        else:
+            pygame.mixer.music.load(source)
+        pygame.mixer.music.play()
+        times.append((time.perf_counter() - start) * 1000)
+        pygame.mixer.music.stop()
+        pygame.mixer.music.unload()
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time starting songs with and without prefetching")
+    parser.add_argument("--folder", type=Path, default=None, help="Where to write the songs, default a temporary folder")
+    parser.add_argument("--songs", type=int, default=10)
+    parser.add_argument("--seconds", type=int, default=30, help="Length of each song")
+    args = parser.parse_args()
+
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import pygame
+    pygame.mixer.pre_init(buffer=2048)
+    pygame.mixer.init()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        songs = make_songs(args.folder or Path(tmp), args.songs, args.seconds)
+        prefetcher = Prefetcher()
+
+        def cold(song: Path) -> Path:
+            drop_from_page_cache(song)
+            return song
+
+        def warm(song: Path) -> Path:
+            song.read_bytes()
+            return song
+
+        def prefetched(song: Path) -> bytes:
+            drop_from_page_cache(song)
+            prefetcher.fetch(song)
+            return prefetcher.take(song)
+
+        for name, prepare in (("cold", cold), ("page cache", warm), ("prefetched", prefetched)):
+            times = time_start(songs, prepare)
+            print(f"{name:12s} median {statistics.median(times):8.2f} ms  worst {max(times):8.2f} ms")
+        if args.folder is not None:
+            for song in songs:
+                song.unlink()
+
+
+if __name__ == "__main__":
+    main()
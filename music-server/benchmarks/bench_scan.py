@@ -0,0 +1,227 @@
+"""
+Times reading the library on synthetic volumes of 1k, 10k and 100k songs, parse_lib on a
+Windows Media volume and on a volume of text playlists with missing entries, parsing one
+big WPL playlist, making the single "All Items" playlist of a volume of MP3s and loading
+the WPL volume back from a snapshot and from the shared index. Each case runs in a fresh process so its peak RSS is
+its own.
+
+The results are written as JSON to target/benchmarks and compared with the previous run,
+so a change that makes things slower or bigger shows up.
+
+Run from the music-server folder:
+
+    python -m benchmarks.bench_scan
+    python -m benchmarks.bench_scan --sizes 1000 10000 --baseline target/benchmarks/bench_scan-20240101-120000.json
+"""
+import argparse
+import contextlib
+import dataclasses
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.synthetic_volume import SyntheticLibrary, make_library
+from musiclib.lib_snapshot import LibSnapshot
+from musiclib.media_lib import MediaLib, MediaLibParsers
+from musiclib.shared_index import SharedIndex, publish
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_OUTPUT = Path("target/benchmarks")
+
+# A case is marked as a regression if it is this much slower or bigger than the baseline
+DEFAULT_TOLERANCE = 0.25
+
+
+def parse_lib_wpl(lib: SyntheticLibrary) -> MediaLib:
+    return MediaLibParsers.parse_lib([lib.wpl_volume])
+
+
+def parse_lib_text(lib: SyntheticLibrary) -> MediaLib:
+    # The missing entries are each warned about
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return MediaLibParsers.parse_lib([lib.text_volume])
+
+
+def parse_wpl_playlist(lib: SyntheticLibrary) -> MediaLib:
+    return MediaLib(playlists=[MediaLibParsers.parse_wpl_playlist(lib.wpl_volume, lib.all_music_wpl)])
+
+
+def create_single_playlist(lib: SyntheticLibrary) -> MediaLib:
+    return MediaLibParsers.create_single_playlist(lib.music_volume, MediaLib(playlists=[]))
+
+
+def snapshot_path(lib: SyntheticLibrary) -> Path:
+    return lib.wpl_volume.parent.joinpath("snapshot.bin")
+
+
+def load_snapshot(lib: SyntheticLibrary) -> MediaLib:
+    """
+    The warm start of the WPL volume, reading the snapshot made of it beforehand
+    """
+    volumes = LibSnapshot(snapshot_path(lib)).load()
+    return MediaLib(playlists=[p for volume in volumes.values() for p in volume.playlists])
+
+
+def shared_index_path(lib: SyntheticLibrary) -> Path:
+    return lib.wpl_volume.parent.joinpath("shared.idx")
+
+
+def load_shared_index(lib: SyntheticLibrary) -> MediaLib:
+    """
+    What another process does to get the whole of the WPL volume from the shared index
+    """
+    return SharedIndex(shared_index_path(lib)).to_media_lib()
+
+
+CASES: Dict[str, Callable[[SyntheticLibrary], MediaLib]] = {
+    "parse_lib_wpl": parse_lib_wpl,
+    "parse_lib_text": parse_lib_text,
+    "parse_wpl_playlist": parse_wpl_playlist,
+    "create_single_playlist": create_single_playlist,
+    "load_snapshot": load_snapshot,
+    "load_shared_index": load_shared_index,
+}
+
+
+def memory_kb(field: str) -> Optional[int]:
+    """
+    :param field: VmRSS for the resident set size now, VmHWM for its peak
+    :return: The size in kilobytes, None if it can't be read
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> None:
+    """
+    Start the peak RSS again from the current RSS. ru_maxrss can't be used, a spawned
+    process starts as a fork of the parent and keeps the parent's peak across the exec.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def run_case(name: str, lib: SyntheticLibrary, results: Dict) -> None:
+    """
+    Run in a fresh process, the memory already in use is taken off the peak
+    """
+    reset_peak_rss()
+    before = memory_kb("VmRSS") or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    media_lib = CASES[name](lib)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    after = memory_kb("VmHWM") or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results[name] = {"seconds": elapsed, "peak_rss_kb": after, "growth_kb": after - before,
+                     "playlists": media_lib.size(), "items": sum(p.size() for p in media_lib.playlists)}
+
+
+def run_suite(sizes: List[int], repeats: int) -> Dict[str, Dict]:
+    """
+    :return: The results keyed by case and size, e.g. "parse_lib_wpl/10000"
+    """
+    ctx = multiprocessing.get_context("spawn")
+    suite: Dict[str, Dict] = {}
+    with tempfile.TemporaryDirectory() as tmp, ctx.Manager() as manager:
+        for size in sizes:
+            start = time.perf_counter()
+            lib = make_library(Path(tmp).joinpath(str(size)), size)
+            media_lib = parse_lib_wpl(lib)
+            LibSnapshot(snapshot_path(lib)).save(media_lib)
+            publish(media_lib, shared_index_path(lib))
+            print(f"Made {size} songs in {time.perf_counter() - start:.1f} s")
+            for name in CASES:
+                best: Optional[Dict] = None
+                for _ in range(repeats):
+                    results = manager.dict()
+                    # The list of songs isn't needed and would weigh on the peak RSS
+                    p = ctx.Process(target=run_case, args=(name, dataclasses.replace(lib, songs=[]), results))
+                    p.start()
+                    p.join()
+                    if name not in results:
+                        raise RuntimeError(f"{name} failed for {size} songs")
+                    r = dict(results[name])
+                    if best is None or r["seconds"] < best["seconds"]:
+                        best = r
+                suite[f"{name}/{size}"] = best
+                print(f"{name:24s} {size:7d} songs  time={best['seconds'] * 1000:9.1f} ms  "
+                      f"peak rss={best['peak_rss_kb'] / 1024:6.1f} MB  growth={best['growth_kb'] / 1024:6.1f} MB  "
+                      f"{best['playlists']} playlists {best['items']} items")
+    return suite
+
+
+def latest_result(output: Path) -> Optional[Path]:
+    runs = sorted(output.glob("bench_scan-*.json"))
+    return runs[-1] if len(runs) > 0 else None
+
+
+def compare(suite: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """
+    Print how each case changed since the baseline
+    :return: The cases that got worse by more than the tolerance
+    """
+    regressions = []
+    for key, r in suite.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        time_change = r["seconds"] / old["seconds"] - 1 if old["seconds"] > 0 else 0.0
+        rss_change = r["growth_kb"] / old["growth_kb"] - 1 if old["growth_kb"] > 0 else 0.0
+        worse = time_change > tolerance or rss_change > tolerance
+        if worse:
+            regressions.append(key)
+        print(f"{key:32s} time {time_change:+7.1%}  rss growth {rss_change:+7.1%}{'  REGRESSION' if worse else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Library scan benchmarks")
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES),
+                        help="The numbers of songs to try")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs of each case, the fastest is kept")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT, help="Where the JSON results are written")
+    parser.add_argument("--baseline", type=Path, default=None,
+                        help="Results to compare with, default is the latest in the output folder")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="How much worse a case can get before it is a regression")
+    parser.add_argument("--check", action="store_true", help="Exit with an error if anything regressed")
+    args = parser.parse_args()
+
+    baseline_path = args.baseline or latest_result(args.output)
+    suite = run_suite(args.sizes, args.repeats)
+    now = datetime.datetime.now()
+    args.output.mkdir(parents=True, exist_ok=True)
+    result_path = args.output.joinpath(f"bench_scan-{now:%Y%m%d-%H%M%S}.json")
+    with open(result_path, 'w') as f:
+        json.dump({"when": now.isoformat(timespec='seconds'), "python": platform.python_version(),
+                   "platform": platform.platform(), "cpus": os.cpu_count(), "results": suite}, f, indent=2)
+    print(f"Results written to {result_path}")
+
+    if baseline_path is not None:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        print(f"Compared with {baseline_path} from {baseline['when']}")
+        regressions = compare(suite, baseline["results"], args.tolerance)
+        if args.check and len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
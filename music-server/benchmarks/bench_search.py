@@ -0,0 +1,61 @@
+"""
+Times building the search index over a 100k song library and looking things up in it,
+with exact, prefix, misspelt and several word queries. The library is made in memory,
+no files are needed. The titles are made from only 20 words so each of them is in 15%
+of the songs, far more than in a real library, these queries are the slow case.
+
+Run from the music-server folder:
+
+    python -m benchmarks.bench_search
+"""
+import time
+from pathlib import Path
+
+from musiclib.media_lib import ItemList, MediaLib, Playlist
+from musiclib.search_index import SearchIndex
+
+WORDS = ["love", "night", "heart", "river", "dance", "summer", "blue", "fire", "rain", "dream", "golden",
+         "highway", "midnight", "shadow", "train", "window", "yesterday", "morning", "angel", "thunder"]
+
+
+def make_lib(songs: int, songs_per_playlist: int = 500) -> MediaLib:
+    playlists = []
+    for p in range(0, songs, songs_per_playlist):
+        items = ItemList()
+        for i in range(p, min(songs, p + songs_per_playlist)):
+            title = f"{WORDS[i % 20]} {WORDS[i // 20 % 20]} {WORDS[i // 400 % 20]} {i}"
+            album = f"Album {i // 12:05d}"
+            items.add(f"/media/pi/MUSIC/Artist {i // 120}/{album}/{i % 12:02d} {title}.mp3", album)
+        playlists.append(Playlist(volume=Path("/media/pi/MUSIC"), kind="Single Playlist",
+                                  title=f"Playlist {WORDS[p // songs_per_playlist % 20]} {p}", items=items))
+    return MediaLib(playlists=playlists)
+
+
+def main():
+    songs = 100000
+    media_lib = make_lib(songs)
+    start = time.perf_counter()
+    index = SearchIndex(media_lib)
+    print(f"Indexed {songs} songs, {len(index.vocab)} words in {time.perf_counter() - start:.2f} s")
+    queries = [("exact rare", "54321"), ("exact", "yesterday summer"), ("prefix", "midn thund 4"),
+               ("fuzzy", "yesterdya"), ("three words", "golden highway angel"), ("album", "album 00042")]
+    # The first fuzzy query builds the deletion table
+    start = time.perf_counter()
+    index.search("yesterdya")
+    print(f"Deletion table built in {time.perf_counter() - start:.2f} s")
+    for name, query in queries:
+        # The first time the document sets of the words are made, after that they are reused
+        start = time.perf_counter()
+        hits = index.search(query, limit=5)
+        first = time.perf_counter() - start
+        repeats = 200
+        start = time.perf_counter()
+        for _ in range(repeats):
+            index.search(query, limit=5)
+        elapsed = (time.perf_counter() - start) / repeats
+        top = hits[0].name if len(hits) > 0 else "-"
+        print(f"{name:12s} {query!r:26s} first {first * 1e6:9.1f} us  again {elapsed * 1e6:9.1f} us  top hit: {top}")
+
+
+if __name__ == "__main__":
+    main()
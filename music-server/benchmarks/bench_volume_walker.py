@@ -0,0 +1,78 @@
+"""
+Compares the single pass VolumeWalker with the rglob passes parse_lib used to make,
+counting the directory listings and stat calls each one makes on a synthetic volume.
+
+Run from the music-server folder:
+
+    python -m benchmarks.bench_volume_walker
+"""
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict
+
+from benchmarks.synthetic_volume import make_volume
+from musiclib.volume_walker import VolumeWalker
+
+
+def legacy_scan(volume: Path) -> int:
+    """
+    What parse_lib did before the walker, for a volume without WPL files
+    :return: The number of files found
+    """
+    playlists_root = volume.joinpath("Playlists")
+    if playlists_root.exists():
+        list(playlists_root.glob('*.wpl'))
+    count = len(list(volume.rglob('*.txt')))
+    if count > 0:
+        return len(list(volume.rglob('*.txt')))
+    return len([file for file in volume.rglob('*.mp3') if not file.name.startswith('.')])
+
+
+def walker_scan(volume: Path) -> int:
+    scan = VolumeWalker().scan(volume)
+    return len(scan.playlist_files) + len(scan.music_files)
+
+
+def count_io(fn: Callable[[Path], int], volume: Path) -> Dict[str, float]:
+    """
+    Run the scan with os.scandir and os.stat wrapped so the calls can be counted
+    """
+    counts = {"scandir": 0, "stat": 0}
+    real_scandir = os.scandir
+    real_stat = os.stat
+
+    def counting_scandir(*args, **kwargs):
+        counts["scandir"] += 1
+        return real_scandir(*args, **kwargs)
+
+    def counting_stat(*args, **kwargs):
+        counts["stat"] += 1
+        return real_stat(*args, **kwargs)
+
+    os.scandir = counting_scandir
+    os.stat = counting_stat
+    try:
+        start = time.perf_counter()
+        found = fn(volume)
+        elapsed = time.perf_counter() - start
+    finally:
+        os.scandir = real_scandir
+        os.stat = real_stat
+    return {"files": found, "seconds": elapsed, **counts}
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, text_playlists in (("mp3 only", 0), ("text playlists", 2)):
+            volume = make_volume(Path(tmp).joinpath(label.replace(' ', '_')), folders=400, songs_per_folder=12,
+                                 text_playlists=text_playlists, system_files=200)
+            for name, fn in (("rglob", legacy_scan), ("walker", walker_scan)):
+                result = count_io(fn, volume)
+                print(f"{label:15s} {name:7s} files={result['files']:6d} scandir={result['scandir']:5d} "
+                      f"stat={result['stat']:5d} time={result['seconds'] * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
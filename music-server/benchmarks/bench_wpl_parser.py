@@ -0,0 +1,74 @@
+"""
+Compares the streaming WPL parser with the DOM and XPath parser it replaced, on a big
+synthetic "All Music" playlist. Each parser runs in a fresh process so the peak RSS
+of one doesn't hide the other.
+
+Run from the music-server folder:
+
+    python -m benchmarks.bench_wpl_parser
+"""
+import multiprocessing
+import resource
+import tempfile
+import time
+from pathlib import Path, PureWindowsPath
+from typing import Dict, List
+
+from lxml import etree
+
+from benchmarks.synthetic_volume import make_wpl
+from musiclib.media_lib import Item, MediaLibParsers
+
+
+def dom_parse_wpl(pl_path: Path) -> int:
+    """
+    The parser as it was before, builds the whole tree and queries it
+    :return: The number of items
+    """
+    playlists_root = pl_path.parent
+    tree = etree.parse(str(pl_path))
+    tree.xpath('/smil/head/title')[0].text
+    items: List[Item] = []
+    for item in tree.xpath('/smil/body/seq/media'):
+        item_path = playlists_root.joinpath(PureWindowsPath(item.attrib['src']))
+        items.append(Item(src=item_path, album_name=item_path.parent.stem))
+    return len(items)
+
+
+def streaming_parse_wpl(pl_path: Path) -> int:
+    return MediaLibParsers.parse_wpl_playlist(pl_path.parent.parent, pl_path).size()
+
+
+PARSERS = {"dom": dom_parse_wpl, "iterparse": streaming_parse_wpl}
+
+
+def run_one(name: str, pl_path: Path, results: Dict) -> None:
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    count = PARSERS[name](pl_path)
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux
+    results[name] = {"items": count, "seconds": elapsed, "peak_rss_kb": after, "growth_kb": after - before}
+
+
+def main():
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp, ctx.Manager() as manager:
+        for entries in (1000, 10000, 100000):
+            songs = [Path("..", "Music", f"Artist {i % 300}", f"Album {i % 3000}", f"{i % 12:02d} Song {i}.mp3")
+                     for i in range(entries)]
+            pl_path = make_wpl(Path(tmp).joinpath("Playlists", f"All Music {entries}.wpl"), "All Music", songs)
+            results = manager.dict()
+            for name in PARSERS:
+                p = ctx.Process(target=run_one, args=(name, pl_path, results))
+                p.start()
+                p.join()
+            for name in PARSERS:
+                r = results[name]
+                print(f"{entries:7d} entries {name:10s} time={r['seconds'] * 1000:8.1f} ms "
+                      f"peak rss={r['peak_rss_kb'] / 1024:6.1f} MB growth={r['growth_kb'] / 1024:6.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
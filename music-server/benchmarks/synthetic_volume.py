@@ -0,0 +1,143 @@
+"""
+Makes synthetic volumes that look like the USB drives the music player reads, so the
+library code can be measured without real drives. The music files are tiny stubs, only
+the names and the folder layout matter.
+"""
+import os
+from dataclasses import dataclass
+from pathlib import Path, PureWindowsPath
+from typing import List
+
+WPL_HEAD = """<?wpl version="1.0"?>
+<smil>
+    <head>
+        <meta name="Generator" content="Microsoft Windows Media Player -- 12.0.19041.1320"/>
+        <meta name="ItemCount" content="{count}"/>
+        <title>{title}</title>
+    </head>
+    <body>
+        <seq>
+"""
+WPL_MEDIA = '            <media src="{src}" albumTitle="{album}" trackingID="{{{id:08X}-0000-0000-0000-000000000000}}"/>\n'
+WPL_TAIL = """        </seq>
+    </body>
+</smil>
+"""
+
+# Folders a Mac or Windows machine leaves on a USB drive
+SYSTEM_DIRS = ('.Trashes', 'System Volume Information', '.Spotlight-V100')
+
+
+def make_volume(root: Path, folders: int, songs_per_folder: int, text_playlists: int = 0,
+                system_files: int = 0) -> Path:
+    """
+    Create a volume with one folder per album, each holding a number of MP3 stubs
+    :param root: Where to create the volume
+    :param folders: How many album folders to create
+    :param songs_per_folder: How many MP3 stubs to put in each album folder
+    :param text_playlists: How many text playlists to write at the top of the volume
+    :param system_files: How many junk files to put in each of the system folders
+    :return: The path to the volume
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    songs = []
+    for a in range(folders):
+        album = root.joinpath(f"Artist {a % 50:02d}", f"Album {a:05d}")
+        album.mkdir(parents=True, exist_ok=True)
+        for s in range(songs_per_folder):
+            song = album.joinpath(f"{s + 1:02d} Song {s}.mp3")
+            song.write_bytes(b"ID3")
+            songs.append(song.relative_to(root))
+    for name in SYSTEM_DIRS:
+        system_dir = root.joinpath(name)
+        system_dir.mkdir(exist_ok=True)
+        for i in range(system_files):
+            system_dir.joinpath(f"junk{i}.mp3").write_bytes(b"")
+    for p in range(text_playlists):
+        lines = [str(song) for song in songs[p::max(1, text_playlists)]]
+        root.joinpath(f"Playlist {p}.txt").write_text("\n".join(lines) + "\n")
+    return root
+
+
+def make_wpl(path: Path, title: str, songs: List[Path]) -> Path:
+    """
+    Write a Windows Media playlist the way Windows Media Player does, the songs are
+    referred to with Windows style paths relative to the playlist's folder
+    :param path: Where to write the playlist
+    :param title: The title of the playlist
+    :param songs: The songs, relative to the playlist's folder
+    :return: The path to the playlist
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(WPL_HEAD.format(count=len(songs), title=title))
+        for i, song in enumerate(songs):
+            f.write(WPL_MEDIA.format(src=str(PureWindowsPath(song)), album=song.parent.name, id=i))
+        f.write(WPL_TAIL)
+    return path
+
+
+@dataclass
+class SyntheticLibrary():
+    # A volume holding only the music, it makes a single "All Items" playlist
+    music_volume: Path
+    # A Windows Media volume, WPL files in its Playlists folder name songs on the music volume
+    wpl_volume: Path
+    # A volume of text playlists naming songs on the music volume, some of which don't exist
+    text_volume: Path
+    # The WPL playlist holding every song
+    all_music_wpl: Path
+    # The songs, relative to the music volume
+    songs: List[Path]
+
+
+def make_library(root: Path, files: int, songs_per_folder: int = 12, wpl_playlists: int = 10,
+                 text_playlists: int = 10, missing_every: int = 20) -> SyntheticLibrary:
+    """
+    Create the three kinds of volume over one set of music files, so each way of reading a
+    volume can be timed on the same songs without making the files three times
+    :param root: Where to create the volumes
+    :param files: How many MP3 stubs to create
+    :param songs_per_folder: How many songs each album folder holds
+    :param wpl_playlists: How many WPL playlists to split the songs between, besides "All Music"
+    :param text_playlists: How many text playlists to split the songs between
+    :param missing_every: One entry in this many of the text playlists names a song that doesn't exist
+    :return: Where everything is
+    """
+    music_volume = root.joinpath("music")
+    songs: List[Path] = []
+    for i in range(files):
+        album = i // songs_per_folder
+        songs.append(Path("Music", f"Artist {album // 4 % 300:03d}", f"Album {album:05d}",
+                          f"{i % songs_per_folder + 1:02d} Song {i}.mp3"))
+    made = set()
+    for song in songs:
+        folder = music_volume.joinpath(song.parent)
+        if folder not in made:
+            folder.mkdir(parents=True, exist_ok=True)
+            made.add(folder)
+        # os.open is a good deal quicker than Path.write_bytes for this many files
+        fd = os.open(music_volume.joinpath(song), os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        os.write(fd, b"ID3")
+        os.close(fd)
+
+    wpl_volume = root.joinpath("wpl")
+    # The playlists are two folders down from the root, as are the songs on the music volume
+    from_playlists = Path("..", "..", music_volume.name)
+    all_music_wpl = make_wpl(wpl_volume.joinpath("Playlists", "All Music.wpl"), "All Music",
+                             [from_playlists.joinpath(song) for song in songs])
+    for p in range(wpl_playlists):
+        make_wpl(wpl_volume.joinpath("Playlists", f"Mix {p:02d}.wpl"), f"Mix {p}",
+                 [from_playlists.joinpath(song) for song in songs[p::wpl_playlists]])
+
+    text_volume = root.joinpath("text")
+    text_volume.joinpath("Lists").mkdir(parents=True, exist_ok=True)
+    for p in range(text_playlists):
+        lines = []
+        for n, song in enumerate(songs[p::text_playlists]):
+            if n % missing_every == missing_every - 1:
+                song = song.with_name(f"Missing {n}.mp3")
+            lines.append(str(from_playlists.joinpath(song)))
+        text_volume.joinpath("Lists", f"Playlist {p:02d}.txt").write_text("\n".join(lines) + "\n")
+    return SyntheticLibrary(music_volume=music_volume, wpl_volume=wpl_volume, text_volume=text_volume,
+                            all_music_wpl=all_music_wpl, songs=songs)
@@ -0,0 +1,183 @@
+"""
+Takes the player commands off the MQTT thread and runs them one at a time on a thread of
+their own, folding together the ones a later command makes pointless. Someone tapping next
+five times gets one jump of five songs instead of five songs each announced and loaded, a
+burst of volume changes sets only the last one, and a play drops the plays before it.
+
+Commands are gathered until none has arrived for a short while, or a batch has been
+gathering too long, and the commands that pile up while a slow one runs are folded the same
+way before they run.
+"""
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from messages.music_control import MusicPlayCommand, MusicStopCommand, MusicVolumeCommand, MusicPauseCommand, \
+    MusicUnpauseCommand, MusicNextCommand, MusicPrevCommand, MusicListCommand, MusicStatusReport, MusicSearchCommand, \
+    MusicPlayByNameCommand, MusicListByNameCommand, MusicPlayByIdCommand, MusicListByIdCommand
+
+# Wait this long after a command for another before running them
+DEFAULT_COALESCE_SECONDS = 0.25
+# But never hold the first command of a batch for longer than this
+MAX_BATCH_SECONDS = 1.0
+
+PLAYS = (MusicPlayCommand, MusicPlayByNameCommand, MusicPlayByIdCommand)
+LISTS = (MusicListCommand, MusicListByNameCommand, MusicListByIdCommand)
+PAUSES = (MusicPauseCommand, MusicUnpauseCommand)
+# Run once however many times they are asked for in a row
+REPEATS = (MusicStatusReport, MusicSearchCommand, MusicStopCommand)
+
+
+@dataclass
+class MusicSkipCommand(object):
+    # Move this many songs through the active playlist, what a run of next and prev commands comes to
+    steps: int
+
+
+@dataclass
+class LibraryChangeCommand(object):
+    # Changes the playlists, for the library watcher, which waits for it to have been made
+    change: Callable[[], None]
+    done: threading.Event = field(default_factory=threading.Event, compare=False)
+
+
+@dataclass
+class AnnouncementDoneCommand(object):
+    # The speech thread has finished saying the status report with this number
+    announcement: int
+
+
+@dataclass
+class TrackEndedCommand(object):
+    # The mixer posted this end event, a song finished and the queued one, if any, started
+    event: int
+
+
+@dataclass
+class CrossfadeCommand(object):
+    # The song that was playing when this was set for, by its end event, is near its end
+    event: int
+
+
+# The commands that pick a song
+MOVES = PLAYS + (MusicSkipCommand,)
+# Put on the queue to have its thread finish once the commands before it have run
+STOP = object()
+
+# The player's own commands, from its other threads, which aren't held back waiting for more
+INTERNAL = (LibraryChangeCommand, AnnouncementDoneCommand, TrackEndedCommand, CrossfadeCommand)
+
+
+def coalesce(commands: List[object]) -> List[object]:
+    """
+    Drop the commands whose effect a later command replaces, the rest keep their order
+    :param commands: Commands in the order they arrived
+    :return: The commands to run
+    """
+    batch: List[object] = []
+    for cmd in commands:
+        if isinstance(cmd, (MusicNextCommand, MusicPrevCommand)):
+            steps = 1 if isinstance(cmd, MusicNextCommand) else -1
+            if len(batch) > 0 and isinstance(batch[-1], MusicSkipCommand):
+                steps += batch.pop().steps
+            if steps != 0:
+                batch.append(MusicSkipCommand(steps=steps))
+        elif isinstance(cmd, PLAYS):
+            # Whatever was going to play, or was stopped or paused, this plays instead
+            batch = [c for c in batch if not isinstance(c, MOVES + PAUSES + (MusicStopCommand,))]
+            batch.append(cmd)
+        elif isinstance(cmd, LISTS):
+            # An earlier playlist no song was played from is never used
+            last_play = max((i for i, c in enumerate(batch) if isinstance(c, MOVES)), default=-1)
+            batch = [c for i, c in enumerate(batch) if i < last_play or not isinstance(c, LISTS)]
+            batch.append(cmd)
+        elif isinstance(cmd, MusicVolumeCommand):
+            batch = [c for c in batch if not isinstance(c, MusicVolumeCommand)]
+            batch.append(cmd)
+        elif isinstance(cmd, PAUSES):
+            batch = [c for c in batch if not isinstance(c, PAUSES)]
+            batch.append(cmd)
+        elif isinstance(cmd, REPEATS) and len(batch) > 0 and batch[-1] == cmd:
+            continue
+        else:
+            batch.append(cmd)
+    return batch
+
+
+class CommandQueue:
+    """
+    Runs the commands put on it on its own thread, coalescing bursts
+    """
+
+    def __init__(self, execute: Callable[[object], None], coalesce_seconds: float = DEFAULT_COALESCE_SECONDS):
+        """
+        :param execute: Runs one command
+        :param coalesce_seconds: How long to wait for more commands before running them, 0 to
+        run them at once and only fold together the ones that piled up
+        """
+        self.logger = logging.getLogger("comms.mqtt")
+        self.execute = execute
+        self.coalesce_seconds = coalesce_seconds
+        self.commands: "queue.Queue[object]" = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self._run, name="player-commands", daemon=True)
+        self.thread.start()
+
+    def put(self, cmd: object) -> None:
+        self.commands.put(cmd)
+
+    def wait(self) -> None:
+        """
+        Block until the commands put so far have been run
+        """
+        self.commands.join()
+
+    def stop(self) -> None:
+        """
+        Run the commands put so far, then finish the thread and wait for it
+        """
+        self.commands.put(STOP)
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self) -> None:
+        while True:
+            commands = self.next_batch()
+            stop_at = next((i for i, cmd in enumerate(commands) if cmd is STOP), None)
+            try:
+                to_run = commands[:stop_at]
+                batch = coalesce(to_run)
+                if len(batch) < len(to_run):
+                    self.logger.info("Coalesced %d commands into %s", len(to_run), str(batch))
+                for cmd in batch:
+                    try:
+                        self.execute(cmd)
+                    except Exception as e:
+                        self.logger.error("Problem executing command %s, exception %s", str(cmd), str(e))
+            finally:
+                for _ in commands:
+                    self.commands.task_done()
+            if stop_at is not None:
+                return
+
+    def next_batch(self) -> List[object]:
+        """
+        Wait for a command, then gather the ones that follow it closely
+        :return: The gathered commands, as they arrived
+        """
+        commands = [self.commands.get()]
+        deadline = time.monotonic() + MAX_BATCH_SECONDS
+        coalesce_seconds = 0 if isinstance(commands[0], INTERNAL) else self.coalesce_seconds
+        while True:
+            wait = min(coalesce_seconds, deadline - time.monotonic())
+            try:
+                commands.append(self.commands.get(timeout=wait) if wait > 0 else self.commands.get_nowait())
+            except queue.Empty:
+                break
+        return commands
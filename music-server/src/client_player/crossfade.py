@@ -0,0 +1,218 @@
+"""
+Crossfades from one song into the next. The mixer's music stream only plays one song at a
+time, so the start of the next song is decoded ahead of time into a short buffer of samples,
+which plays on a mixer channel of its own, fading in, while the song ending fades out on the
+music stream. Once that has faded the next song carries on in the music stream from as far
+as the buffer has got, the two overlapping for a moment to cover the join.
+
+Only the first bytes of the next song are read and decoded, enough for the crossfade, so a
+five second crossfade takes under a megabyte of samples and a fraction of a second of CPU to
+decode, on a thread of its own well before it is needed. Without a crossfade the player hands
+the next song to the music stream to follow on from the one playing, with no gap.
+"""
+import io
+import logging
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import pygame
+
+# No crossfade, the songs follow on with no gap
+DEFAULT_CROSSFADE_SECONDS = 0.0
+# Longer crossfades take more memory and a longer decode
+MAX_CROSSFADE_SECONDS = 12.0
+
+# How long the buffer and the music stream overlap where the song goes over from one to the other
+JOIN_SECONDS = 0.25
+
+# The mixer channel the buffer is played on, the one after the speech channel
+CROSSFADE_CHANNEL = 1
+
+# Used to guess how much of a song to read when its length isn't known, 320 kbps
+FALLBACK_BYTES_PER_SECOND = 40000
+
+
+def head_bytes(size: int, duration: Optional[float], seconds: float) -> int:
+    """
+    :param size: The size of the song file in bytes
+    :param duration: How long the song is, None if not known
+    :param seconds: How much of the start of it is wanted
+    :return: About how many bytes of the file hold that much, with some to spare for the header
+    """
+    rate = size / duration if duration else FALLBACK_BYTES_PER_SECOND
+    return int(rate * (seconds + 1) * 1.5) + 64 * 1024
+
+
+def decode_head(path: Path, seconds: float, duration: Optional[float] = None,
+                data: Optional[bytes] = None) -> Optional[np.ndarray]:
+    """
+    Decode the start of a song, the decoders stop where the bytes run out
+    :param path: The song
+    :param seconds: How much to decode
+    :param duration: How long the song is, None if not known
+    :param data: The song's contents, if already read, see Prefetcher
+    :return: The samples in the mixer's format, frames first, at most seconds long, None if the song
+    can't be read or decoded
+    """
+    rate = pygame.mixer.get_init()[0]
+    try:
+        size = len(data) if data is not None else path.stat().st_size
+        n = head_bytes(size, duration, seconds)
+        while True:
+            if data is not None:
+                head = data[:n]
+            else:
+                with open(path, 'rb') as f:
+                    head = f.read(n)
+            samples = pygame.sndarray.array(pygame.mixer.Sound(file=io.BytesIO(head)))
+            # A guess at the bit rate that was too low gives too little, try again with more
+            if len(samples) >= seconds * rate or n >= size:
+                break
+            n *= 2
+    except (OSError, pygame.error):
+        return None
+    return samples[:int(seconds * rate)]
+
+
+def shape(samples: np.ndarray, rate: int, fade_seconds: float, join_seconds: float = JOIN_SECONDS) -> np.ndarray:
+    """
+    :param samples: The start of a song
+    :return: The samples faded in over the crossfade and out over the join at the end
+    """
+    frames = len(samples)
+    envelope = np.ones(frames, dtype=np.float32)
+    fade = min(frames, int(fade_seconds * rate))
+    envelope[:fade] = np.linspace(0, 1, fade, endpoint=False)
+    join = min(frames - fade, int(join_seconds * rate))
+    if join > 0:
+        envelope[frames - join:] = np.linspace(1, 0, join)
+    if samples.ndim == 2:
+        envelope = envelope.reshape(-1, 1)
+    shaped = samples.astype(np.float32) * envelope
+    return np.ascontiguousarray(shaped.astype(samples.dtype))
+
+
+class Crossfader:
+    """
+    Decodes the start of the next song in the background and plays it over the end of the one playing
+    """
+
+    def __init__(self, fade_seconds: float):
+        """
+        :param fade_seconds: How long the songs overlap, up to MAX_CROSSFADE_SECONDS
+        """
+        self.logger = logging.getLogger("comms.mqtt")
+        self.fade_seconds = max(0.0, min(MAX_CROSSFADE_SECONDS, fade_seconds))
+        # The song decoded last and its start, ready to play
+        self.ready: Optional[Tuple[Path, pygame.mixer.Sound]] = None
+        self.lock = threading.Lock()
+        # Each request is the song wanted next, only the latest one matters
+        self.requests: "queue.Queue[Tuple[Path, Optional[float], Optional[bytes]]]" = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+        self.channel: Optional[pygame.mixer.Channel] = None
+        # When the start of the song began playing, moved on by the time it was paused for
+        self.started = 0.0
+        self.paused_at: Optional[float] = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self._run, name="crossfade-decoder", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            request = self.requests.get()
+            try:
+                while not self.requests.empty():
+                    self.requests.task_done()
+                    request = self.requests.get_nowait()
+                self.decode(*request)
+            except Exception as e:
+                self.logger.error("Problem decoding the start of a song %s", str(e))
+            finally:
+                self.requests.task_done()
+
+    def prepare(self, path: Path, duration: Optional[float] = None, data: Optional[bytes] = None) -> None:
+        """
+        Decode the start of the song to crossfade into in the background
+        :param path: The song
+        :param duration: How long it is, None if not known
+        :param data: The song's contents, if already read
+        :return: Nothing
+        """
+        self.requests.put((path, duration, data))
+
+    def wait(self) -> None:
+        """
+        Block until the songs asked for so far have been decoded
+        """
+        self.requests.join()
+
+    def decode(self, path: Path, duration: Optional[float] = None, data: Optional[bytes] = None) -> bool:
+        """
+        Decode the start of the song to crossfade into now, it replaces the one decoded before
+        :return: True if it could be decoded
+        """
+        with self.lock:
+            if self.ready is not None and self.ready[0] == path:
+                return True
+        start = time.perf_counter()
+        samples = decode_head(path, self.fade_seconds + JOIN_SECONDS, duration, data)
+        if samples is None:
+            self.logger.warning("Can't decode the start of %s to crossfade into", str(path))
+            return False
+        sound = pygame.sndarray.make_sound(shape(samples, pygame.mixer.get_init()[0], self.fade_seconds))
+        self.logger.debug("Decoded %.1f seconds of %s in %.1f ms", sound.get_length(), str(path),
+                          (time.perf_counter() - start) * 1000)
+        with self.lock:
+            self.ready = (path, sound)
+        return True
+
+    def take(self, path: Path) -> Optional[pygame.mixer.Sound]:
+        """
+        :param path: The song about to be crossfaded into
+        :return: Its start, None if it hasn't been decoded
+        """
+        with self.lock:
+            if self.ready is None or self.ready[0] != path:
+                return None
+            sound = self.ready[1]
+            self.ready = None
+            return sound
+
+    def play(self, sound: pygame.mixer.Sound, volume: float) -> None:
+        if self.channel is None:
+            self.channel = pygame.mixer.Channel(CROSSFADE_CHANNEL)
+        self.channel.set_volume(volume)
+        self.channel.play(sound)
+        self.started = time.monotonic()
+        self.paused_at = None
+
+    def elapsed(self) -> float:
+        """
+        :return: How far into the song the start being played has got, in seconds
+        """
+        return (self.paused_at if self.paused_at is not None else time.monotonic()) - self.started
+
+    def set_volume(self, volume: float) -> None:
+        if self.channel is not None:
+            self.channel.set_volume(volume)
+
+    def pause(self) -> None:
+        if self.channel is not None and self.paused_at is None:
+            self.channel.pause()
+            self.paused_at = time.monotonic()
+
+    def unpause(self) -> None:
+        if self.channel is not None and self.paused_at is not None:
+            self.channel.unpause()
+            self.started += time.monotonic() - self.paused_at
+            self.paused_at = None
+
+    def stop(self) -> None:
+        if self.channel is not None:
+            self.channel.stop()
+        self.paused_at = None
@@ -1,11 +1,48 @@
+import io
 import logging
+import threading
+import time
 from dataclasses import dataclass
+from enum import Enum
 from pathlib import Path
+from typing import Callable, Iterator, Optional
 
 import pygame
 
-from musiclib.media_lib import MediaLib, Playlist, Item
-from speech import do_text_to_speech
+from client_player.command_queue import CommandQueue, MusicSkipCommand, LibraryChangeCommand, \
+    AnnouncementDoneCommand, TrackEndedCommand, CrossfadeCommand, DEFAULT_COALESCE_SECONDS
+from client_player.crossfade import Crossfader, JOIN_SECONDS
+from client_player.prefetch import Prefetcher
+from client_player.track_events import TRACK_EVENTS
+from messages.music_control import MusicPlayCommand, MusicStopCommand, MusicVolumeCommand, MusicPauseCommand, \
+    MusicUnpauseCommand, MusicNextCommand, MusicPrevCommand, MusicListCommand, MusicStatusReport, MusicSearchCommand, \
+    MusicPlayByNameCommand, MusicListByNameCommand, MusicPlayByIdCommand, MusicListByIdCommand
+from musiclib.media_lib import LazyPlaylist, MediaLib, Playlist, Item
+from musiclib.background_index import BackgroundIndex
+from musiclib.search_index import SearchIndex, PLAYLIST
+from musiclib.stable_ids import StableIdIndex
+from speech.speech_queue import SpeechQueue, URGENT
+
+
+# The volume the music is turned down to while the status is spoken
+DUCKED_VOLUME = 0.2
+
+
+class PlayerState(Enum):
+    STOPPED = "stopped"
+    PLAYING = "playing"
+    PAUSED = "paused"
+    # Playing, turned down while the status report is spoken over the music
+    ANNOUNCING = "announcing"
+
+
+# The states the player can go to from each state, starting a song is allowed from any
+TRANSITIONS = {
+    PlayerState.STOPPED: {PlayerState.PLAYING},
+    PlayerState.PLAYING: {PlayerState.PLAYING, PlayerState.PAUSED, PlayerState.STOPPED, PlayerState.ANNOUNCING},
+    PlayerState.PAUSED: {PlayerState.PLAYING, PlayerState.STOPPED},
+    PlayerState.ANNOUNCING: {PlayerState.PLAYING, PlayerState.PAUSED, PlayerState.STOPPED, PlayerState.ANNOUNCING},
+}
 
 
 @dataclass
@@ -39,10 +76,10 @@ class PlaylistRef():
 
 @dataclass
 class MusicPlayer():
-    # The music player inside pygame might well be thread-safe
-    # but this class is not. In particular, next and prev depend
-    # on single-threadedness because they and the start method
-    # read and write mru_item_index
+    # This class is not thread-safe, it is owned by the thread of its command
+    # queue. Commands are given to it with submit, and the other threads that
+    # need to change it, the library watcher and the speech queue, put commands
+    # on the same queue, so nothing here needs a lock.
 
     # A list of paths to music files (mp3, wav, possibly others)
     media_lib: MediaLib
@@ -50,47 +87,223 @@ class MusicPlayer():
     # Holds a reference to the active playlist
     active_list: PlaylistRef
 
-    def __init__(self, media_lib: MediaLib):
+    def __init__(self, media_lib: MediaLib, prefetcher: Prefetcher = None, speech: SpeechQueue = None,
+                 coalesce_seconds: float = DEFAULT_COALESCE_SECONDS, crossfader: Crossfader = None):
+        """
+        :param media_lib: The playlists
+        :param prefetcher: Reads the songs either side of the one playing ahead of time, None to not
+        :param speech: Speaks the announcements without holding up the player, one is started if not given
+        :param coalesce_seconds: How long to wait for more commands before running them, see CommandQueue
+        :param crossfader: Crossfades from each song into the next, None to follow on with no gap
+        """
         self.media_lib = media_lib
         self.logger = logging.getLogger("comms.mqtt")
         # Just start at the first item always
         self.mru_item_index = 0
         # start with the first playlist
         self.active_list = PlaylistRef(index=0, playlist=self.media_lib.get_playlist_by_id(self.mru_item_index))
+        # Built in the background now and again when the library changes, searches use the last one built
+        self.search_index = BackgroundIndex(self.media_lib, SearchIndex, "search index")
+        self.search_index.start()
+        # The same for the stable ids printed on cards
+        self.stable_ids = BackgroundIndex(self.media_lib, StableIdIndex, "stable id index")
+        self.stable_ids.start()
+        # Built again as soon as the library changes, e.g. a lazy playlist loads its songs
+        self.media_lib.listeners.append(self.refresh_indexes)
+        # The volume the user set, 0 to 1, and the gain in dB of the song playing. The mixer
+        # plays at the two together so songs come out as loud as each other
+        self.volume = 1.0
+        self.gain = 0.0
+        self.prefetcher = prefetcher
+        self.state = PlayerState.STOPPED
+        # Counts the status reports, so only the end of the latest one turns the music back up
+        self.announcement = 0
+        # The position of the song the mixer will play when this one ends, None if there isn't one
+        self.queued_index: Optional[int] = None
+        # The song itself and the playlist it was queued from, which may have changed since
+        self.queued_item: Optional[Item] = None
+        self.queued_playlist: Optional[Playlist] = None
+        # The song in the music stream and how many seconds into it the stream was started
+        self.playing_item: Optional[Item] = None
+        self.song_start = 0.0
+        self.crossfader = crossfader
+        # How far into the song playing the crossfade into the queued song starts, None to follow on with no gap
+        self.fade_at: Optional[float] = None
+        # Puts the crossfade command on the queue when it is time
+        self.crossfade_timer: Optional[threading.Timer] = None
+        # The start of the queued song is playing and the song playing is fading out, and the queued song's gain
+        self.fading = False
+        self.fade_gain = 0.0
+        if speech is None:
+            speech = SpeechQueue()
+            speech.start()
+        self.speech = speech
 
         # Increase the buffer from the default of 512 to eliminate the underrun warning message that occurs
         # when running on the Raspberry PI
         pygame.mixer.pre_init(buffer=2048)
         pygame.mixer.init()
         self.logger.info("Loaded media library %s", media_lib.get_info())
-        do_text_to_speech(f"Music Player is ready to go. Found {len(media_lib.playlists)} playlists")
+        self.speech.say(f"Music Player is ready to go. Found {len(media_lib.playlists)} playlists")
+        # The one thread that runs the commands, bursts of them folded together
+        self.commands = CommandQueue(self.execute, coalesce_seconds=coalesce_seconds)
+        self.commands.start()
+        # The mixer posts an event when a song ends. Each song started takes turns with the two
+        # event types, so the end of a song that was replaced before its event was run is ignored
+        try:
+            self.end_events = [TRACK_EVENTS.register(self.track_ended) for _ in range(2)]
+        except pygame.error as e:
+            self.logger.warning("Songs won't move on by themselves, no pygame events %s", str(e))
+            self.end_events = []
+        self.end_event: Optional[int] = None
+
+    def close(self) -> None:
+        """
+        Stop the music, the player's thread and taking the mixer's end events, the commands
+        already submitted are run first. The player can't be used after this.
+        """
+        pygame.mixer.music.set_endevent()
+        for event in self.end_events:
+            TRACK_EVENTS.unregister(event)
+        self.media_lib.listeners.remove(self.refresh_indexes)
+        self.commands.stop()
+        self.cancel_crossfade()
+        if self.crossfader is not None:
+            self.crossfader.stop()
+        pygame.mixer.music.stop()
+        pygame.mixer.music.unload()
+        self.state = PlayerState.STOPPED
 
-    def start(self, index: int) -> None:
+    def track_ended(self, event: int) -> None:
+        """
+        Called on the event thread when the mixer finishes a song
+        :param event: The event type
+        :return: Nothing
+        """
+        self.commands.put(TrackEndedCommand(event=event))
+
+    def submit(self, cmd: object) -> None:
+        """
+        Run a command on the player's thread, any thread may call this
+        :param cmd: A command from a message
+        :return: Nothing
+        """
+        self.commands.put(cmd)
+
+    def execute(self, cmd: object) -> None:
+        """
+        Run one command on the player, called on the command queue's thread
+        :param cmd: A command from a message, or one the queue or another thread made
+        :return: Nothing
+        """
+        if isinstance(cmd, MusicPlayCommand):
+            self.start(cmd.payload)
+        elif isinstance(cmd, MusicSkipCommand):
+            self.skip(cmd.steps)
+        elif isinstance(cmd, MusicNextCommand):
+            self.next()
+        elif isinstance(cmd, MusicPrevCommand):
+            self.prev()
+        elif isinstance(cmd, MusicStopCommand):
+            self.stop()
+        elif isinstance(cmd, MusicPauseCommand):
+            self.pause()
+        elif isinstance(cmd, MusicUnpauseCommand):
+            self.unpause()
+        elif isinstance(cmd, MusicVolumeCommand):
+            self.set_volume(cmd.payload)
+        elif isinstance(cmd, MusicListCommand):
+            self.set_playlist(cmd.payload)
+        elif isinstance(cmd, MusicStatusReport):
+            self.do_status_report()
+        elif isinstance(cmd, MusicSearchCommand):
+            self.search(cmd.payload)
+        elif isinstance(cmd, MusicPlayByNameCommand):
+            self.play_by_name(cmd.payload)
+        elif isinstance(cmd, MusicListByNameCommand):
+            self.set_playlist_by_name(cmd.payload)
+        elif isinstance(cmd, MusicPlayByIdCommand):
+            self.play_by_id(cmd.payload)
+        elif isinstance(cmd, MusicListByIdCommand):
+            self.set_playlist_by_id(cmd.payload)
+        elif isinstance(cmd, LibraryChangeCommand):
+            try:
+                self.change_library(cmd.change)
+            finally:
+                cmd.done.set()
+        elif isinstance(cmd, AnnouncementDoneCommand):
+            self.end_announcement(cmd.announcement)
+        elif isinstance(cmd, TrackEndedCommand):
+            self.advance(cmd.event)
+        elif isinstance(cmd, CrossfadeCommand):
+            self.crossfade(cmd.event)
+        else:
+            self.logger.warning("Unsupported cmd type %s", type(cmd))
+
+    def move_to(self, state: PlayerState) -> bool:
+        """
+        Change state if the current state allows it
+        :param state: The state to go to
+        :return: True if the player is now in that state, False if the change makes no sense,
+        like pausing when stopped, and the caller should do nothing
+        """
+        if state not in TRANSITIONS[self.state]:
+            self.logger.info("Ignored going from %s to %s", self.state.value, state.value)
+            return False
+        if state != self.state:
+            self.logger.info("Player state %s to %s", self.state.value, state.value)
+        self.state = state
+        return True
+
+    def start(self, index: int, step: int = 1) -> None:
         """
         Stop playing and load and play something else
         :param index: Identifies the item in the playlist to play
+        :param step: Which way to go through the playlist when the song is missing, 1 or -1
         :return: Nothing
         """
         # Get the item from the active playlist
         if self.active_list.exists(index):
-            music_file_item: Item = self.active_list.get_item_by_id(index)
-            item: Path = music_file_item.src
-            if item.exists():
+            found = self.find_existing(index, step)
+            if found is not None:
+                index = found
+                music_file_item: Item = self.active_list.get_item_by_id(index)
                 # Stop playing current item, if any
+                self.cancel_crossfade()
                 pygame.mixer.music.unload()
-                item_name = item.name
-                do_text_to_speech(f"Start playing song {item_name}")
-                pygame.mixer.music.load(item)
-                pygame.mixer.music.play()
-                self.logger.info("Music loaded")
+                self.speech.say(self.song_announcement(music_file_item), topic="song")
+                # Starting a song is allowed from every state
+                self.state = PlayerState.PLAYING
+                self.play_song(music_file_item)
                 self.mru_item_index = index
+                self.queue_item((index + 1) % self.active_list.size())
+                self.prefetch_around(index)
             else:
-                self.logger.warning("Specified item %s not found, skip it", str(item))
+                msg = "None of the songs in this playlist were found"
+                self.speech.say(msg, priority=URGENT)
+                self.logger.warning(msg)
         else:
             msg = f"No playlist for this index {index}"
-            do_text_to_speech(msg)
+            self.speech.say(msg, priority=URGENT)
             self.logger.warning(msg)
 
+    def find_existing(self, index: int, step: int = 1) -> Optional[int]:
+        """
+        Playlists read without checking their songs, see --defer-validation, keep the songs that are
+        missing, they are skipped over when they come up
+        :param index: The position of a song in the active playlist
+        :param step: Which way to look, 1 or -1, wrapping around either end of the playlist
+        :return: The position of the first song from there on whose file is there, None if there is none
+        """
+        size = self.active_list.size()
+        for i in range(size):
+            found = (index + i * step) % size
+            src = self.active_list.get_item_by_id(found).src
+            if src.exists():
+                return found
+            self.logger.warning("Song %s not found, skip it", str(src))
+        return None
+
     def set_playlist(self, index: int) -> None:
         """
         Keep playing the current song if any, but switch the playlist to the new
@@ -103,12 +316,426 @@ class MusicPlayer():
             self.logger.info("Set the active playlist %d", index)
             self.active_list = PlaylistRef(index=index, playlist=self.media_lib.get_playlist_by_id(index))
             self.mru_item_index = 0
-            do_text_to_speech(f"Play list has been set to {self.active_list.get_title()}")
+            if self.state != PlayerState.STOPPED:
+                # The new list carries on from its start when the song playing ends
+                self.queue_item(0)
+            self.prefetch_around(0)
+            self.speech.say(self.playlist_announcement(self.active_list.playlist), topic="playlist")
         else:
             msg = f"No playlist for this index {index}"
-            do_text_to_speech(msg)
+            self.speech.say(msg, priority=URGENT)
             self.logger.warning(msg)
 
+    def play_song(self, music_file_item: Item, start: float = 0.0, fade_ms: int = 0) -> None:
+        """
+        Load a song into the music stream and play it, from the prefetched copy if there is one
+        :param music_file_item: The song
+        :param start: How many seconds into the song to start
+        :param fade_ms: How long to fade it in over
+        :return: Nothing
+        """
+        item: Path = music_file_item.src
+        begin = time.perf_counter()
+        data = self.prefetcher.take(item) if self.prefetcher is not None else None
+        if data is not None:
+            # The decoder goes by the name to know the format
+            pygame.mixer.music.load(io.BytesIO(data), item.suffix.lstrip('.'))
+        else:
+            pygame.mixer.music.load(item)
+        # Songs whose loudness hasn't been measured yet play as they are
+        self.gain = music_file_item.gain if music_file_item.gain is not None else 0.0
+        self.apply_volume()
+        self.watch_for_end()
+        pygame.mixer.music.play(start=start, fade_ms=fade_ms)
+        self.playing_item = music_file_item
+        self.song_start = start
+        self.logger.info("Music loaded and started in %.1f ms%s", (time.perf_counter() - begin) * 1000,
+                         " from the prefetched copy" if data is not None else "")
+
+    def watch_for_end(self) -> None:
+        """
+        Have the mixer post the other end event type from now on, call before playing a song
+        """
+        if len(self.end_events) > 0:
+            self.end_event = self.end_events[1] if self.end_event == self.end_events[0] else self.end_events[0]
+            pygame.mixer.music.set_endevent(self.end_event)
+
+    def queue_item(self, index: int) -> None:
+        """
+        Hand a song to the mixer to play as soon as the one playing ends, it replaces any queued
+        before. With a crossfader the start of the song is decoded to crossfade into instead,
+        if the length of the song playing is known.
+        :param index: The position of the song in the active playlist
+        :return: Nothing
+        """
+        if self.fading:
+            # The queued song has already begun
+            return
+        self.queued_index = None
+        self.fade_at = None
+        self.cancel_crossfade()
+        if len(self.end_events) == 0 or not self.active_list.exists(index):
+            return
+        index = self.find_existing(index)
+        if index is None:
+            return
+        music_file_item = self.active_list.get_item_by_id(index)
+        item = music_file_item.src
+        data = self.prefetcher.take(item) if self.prefetcher is not None else None
+        duration = self.playing_item.get_duration() if self.playing_item is not None else None
+        if self.crossfader is not None and duration and duration > 2 * self.crossfader.fade_seconds:
+            self.crossfader.prepare(item, music_file_item.get_duration(), data)
+            self.fade_at = duration - self.crossfader.fade_seconds
+            self.set_queued(index, music_file_item)
+            self.schedule_crossfade()
+            return
+        try:
+            if data is not None:
+                pygame.mixer.music.queue(io.BytesIO(data), item.suffix.lstrip('.'))
+            else:
+                pygame.mixer.music.queue(str(item))
+            self.set_queued(index, music_file_item)
+        except pygame.error as e:
+            self.logger.warning("Can't queue %s to play next %s", str(item), str(e))
+
+    def set_queued(self, index: int, music_file_item: Item) -> None:
+        self.queued_index = index
+        self.queued_item = music_file_item
+        self.queued_playlist = self.active_list.playlist
+
+    def advance(self, event: int) -> None:
+        """
+        Catch up with the mixer when a song has ended, it has already started the queued song
+        :param event: The type of the end event the mixer posted
+        :return: Nothing
+        """
+        if event != self.end_event or self.state not in (PlayerState.PLAYING, PlayerState.ANNOUNCING):
+            self.logger.debug("Ignored the end of a song that was replaced")
+            return
+        if self.queued_index is None:
+            self.logger.info("Reached the end of the songs")
+            self.move_to(PlayerState.STOPPED)
+            return
+        index = self.queued_index
+        # Not looked up again, the playlist may have changed while the song started crossfading
+        music_file_item = self.queued_item
+        if self.fading:
+            # The song playing has faded out, the queued song carries on in the music stream from
+            # as far as its start has played, fading in as the start fades out
+            self.fading = False
+            self.play_song(music_file_item, start=self.crossfader.elapsed(), fade_ms=int(JOIN_SECONDS * 1000))
+        elif self.fade_at is not None:
+            self.logger.info("Song %d wasn't ready to crossfade into", index)
+            self.start(index)
+            return
+        else:
+            self.logger.info("Moved on to song %d", index)
+            self.speech.say(self.song_announcement(music_file_item), topic="song")
+            self.gain = music_file_item.gain if music_file_item.gain is not None else 0.0
+            self.apply_volume()
+            self.playing_item = music_file_item
+            self.song_start = 0.0
+        size = self.active_list.size()
+        if size == 0:
+            self.queued_index = None
+            return
+        if self.queued_playlist is self.active_list.playlist:
+            self.mru_item_index = min(index, size - 1)
+            self.queue_item((self.mru_item_index + 1) % size)
+        else:
+            # Another playlist was picked during the crossfade, it carries on from where it was set to
+            self.queue_item(self.mru_item_index % size)
+        self.prefetch_around(self.mru_item_index)
+
+    def schedule_crossfade(self) -> None:
+        """
+        Set a timer to put the crossfade command on the queue when the song playing gets to where
+        the crossfade starts, call when the song starts or carries on after a pause
+        """
+        if self.crossfade_timer is not None:
+            self.crossfade_timer.cancel()
+            self.crossfade_timer = None
+        if self.fade_at is None or self.fading or self.state not in (PlayerState.PLAYING, PlayerState.ANNOUNCING):
+            return
+        position = self.song_start + max(0, pygame.mixer.music.get_pos()) / 1000
+        self.crossfade_timer = threading.Timer(max(0.0, self.fade_at - position), self.commands.put,
+                                               args=(CrossfadeCommand(event=self.end_event),))
+        self.crossfade_timer.daemon = True
+        self.crossfade_timer.start()
+
+    def crossfade(self, event: int) -> None:
+        """
+        Play the start of the queued song over the end of the one playing, fading that out
+        :param event: The end event of the song that was playing when the crossfade was set
+        :return: Nothing
+        """
+        if event != self.end_event or self.fading or self.fade_at is None or self.queued_index is None \
+                or self.state not in (PlayerState.PLAYING, PlayerState.ANNOUNCING):
+            return
+        music_file_item = self.queued_item
+        sound = self.crossfader.take(music_file_item.src)
+        if sound is None:
+            self.logger.info("The start of %s isn't decoded, it starts when this song ends", str(music_file_item.src))
+            return
+        self.speech.say(self.song_announcement(music_file_item), topic="song")
+        self.fading = True
+        self.fade_gain = music_file_item.gain if music_file_item.gain is not None else 0.0
+        self.crossfader.play(sound, self.mixer_volume(self.fade_gain))
+        # The end event this posts when it has faded out starts the rest of the queued song
+        pygame.mixer.music.fadeout(int(self.crossfader.fade_seconds * 1000))
+
+    def cancel_crossfade(self) -> None:
+        """
+        Stop the start of the queued song if it is playing, and the timer for the crossfade
+        """
+        if self.crossfade_timer is not None:
+            self.crossfade_timer.cancel()
+            self.crossfade_timer = None
+        if self.fading:
+            self.crossfader.stop()
+            self.fading = False
+
+    def prefetch_around(self, index: int) -> None:
+        """
+        Read the songs next and prev would play into memory in the background, next first
+        :param index: The position of the song playing in the active playlist
+        :return: Nothing
+        """
+        size = self.active_list.size()
+        if self.prefetcher is None or size == 0:
+            return
+        positions = [(index + 1) % size, (index - 1) % size]
+        self.prefetcher.prefetch([self.active_list.get_item_by_id(i).src for i in dict.fromkeys(positions)])
+
+    def refresh_indexes(self) -> None:
+        """
+        Called on whichever thread changed the library, the searches use the indexes from
+        before the change until the new ones are built
+        """
+        self.search_index.refresh()
+        self.stable_ids.refresh()
+
+    def get_search_index(self) -> SearchIndex:
+        return self.search_index.get()
+
+    def find_again(self, playlist_id: int, playlist: Playlist) -> Optional[int]:
+        """
+        :param playlist_id: Where a playlist was when an index that may be older than the library was built
+        :param playlist: The playlist
+        :return: The id of the playlist now, None if it has gone
+        """
+        if self.media_lib.exists(playlist_id) and self.media_lib.get_playlist_by_id(playlist_id) is playlist:
+            return playlist_id
+        return self.media_lib.index_of(playlist)
+
+    def search(self, query: str) -> None:
+        """
+        Say the best few playlists, albums and songs whose names match the query
+        :param query: The words to look for
+        :return: Nothing
+        """
+        hits = self.get_search_index().search(query, limit=3)
+        if len(hits) == 0:
+            msg = f"Nothing found for {query}"
+        else:
+            msg = "Found " + ", ".join(f"{hit.kind} {hit.name}" for hit in hits)
+        self.logger.info(msg)
+        self.speech.say(msg, topic="search")
+
+    def play_by_name(self, query: str) -> None:
+        """
+        Play the song that best matches the query, or the first song of the best matching
+        album or playlist. The active playlist is switched to the one holding it.
+        :param query: The words to look for
+        :return: Nothing
+        """
+        hits = self.get_search_index().search(query, limit=1)
+        playlist_id = self.find_again(hits[0].playlist_id, hits[0].playlist) if len(hits) > 0 else None
+        if playlist_id is None:
+            msg = f"Nothing found for {query}"
+            self.speech.say(msg, priority=URGENT)
+            self.logger.warning(msg)
+            return
+        hit = hits[0]
+        self.logger.info("Play by name %s found %s %s", query, hit.kind, hit.name)
+        playlist = self.media_lib.get_playlist_by_id(playlist_id)
+        self.active_list = PlaylistRef(index=playlist_id, playlist=playlist)
+        # The playlist may have been edited since the index was built
+        self.start(max(0, min(hit.item_index, playlist.size() - 1)))
+
+    def set_playlist_by_name(self, query: str) -> None:
+        """
+        Make the playlist whose title best matches the query the active one
+        :param query: The words to look for
+        :return: Nothing
+        """
+        hits = self.get_search_index().search(query, kinds=(PLAYLIST,), limit=1)
+        playlist_id = self.find_again(hits[0].playlist_id, hits[0].playlist) if len(hits) > 0 else None
+        if playlist_id is None:
+            msg = f"No playlist found for {query}"
+            self.speech.say(msg, priority=URGENT)
+            self.logger.warning(msg)
+        else:
+            self.set_playlist(playlist_id)
+
+    def get_stable_ids(self) -> StableIdIndex:
+        return self.stable_ids.get()
+
+    def play_by_id(self, stable_id: str) -> None:
+        """
+        Play the song with this stable id, the active playlist is switched to the one holding
+        it unless it is already the active one. A playlist id plays its first song.
+        :param stable_id: The id of a song or a playlist
+        :return: Nothing
+        """
+        ids = self.get_stable_ids()
+        found = ids.find_item(stable_id)
+        if found is None:
+            playlist_id = ids.find_playlist(stable_id)
+            if playlist_id is None:
+                msg = f"Nothing found for id {stable_id}"
+                self.speech.say(msg, priority=URGENT)
+                self.logger.warning(msg)
+                return
+            found = (playlist_id, 0)
+        playlist_id, index = found
+        playlist = ids.get_playlist(playlist_id)
+        playlist_id = self.find_again(playlist_id, playlist)
+        if playlist_id is None:
+            msg = f"Nothing found for id {stable_id}"
+            self.speech.say(msg, priority=URGENT)
+            self.logger.warning(msg)
+            return
+        if playlist is not self.active_list.playlist:
+            self.active_list = PlaylistRef(index=playlist_id, playlist=playlist)
+        # The playlist may have been edited since the index was built
+        self.start(max(0, min(index, playlist.size() - 1)))
+
+    def set_playlist_by_id(self, stable_id: str) -> None:
+        """
+        Make the playlist with this stable id the active one
+        :param stable_id: The id of a playlist
+        :return: Nothing
+        """
+        ids = self.get_stable_ids()
+        playlist_id = ids.find_playlist(stable_id)
+        if playlist_id is not None:
+            playlist_id = self.find_again(playlist_id, ids.get_playlist(playlist_id))
+        if playlist_id is None:
+            msg = f"No playlist for id {stable_id}"
+            self.speech.say(msg, priority=URGENT)
+            self.logger.warning(msg)
+        else:
+            self.set_playlist(playlist_id)
+
+    def run_change(self, change: Callable[[], None]) -> None:
+        """
+        Make a change to the playlists on the player's thread, so the player never sees one half
+        changed, for the library watcher and the snapshot verifier. Any thread but the player's
+        may call this.
+        :param change: Changes the playlists of the media lib
+        :return: Nothing, once the change has been made
+        """
+        if self.commands.thread is None:
+            change()
+            return
+        cmd = LibraryChangeCommand(change=change)
+        self.commands.put(cmd)
+        cmd.done.wait()
+
+    def change_library(self, change: Callable[[], None]) -> None:
+        """
+        Make a change to the playlists, then find the song playing and the one queued again
+        in the active playlist if it was edited, so next and prev carry on from the same song
+        :param change: Changes the playlists of the media lib
+        :return: Nothing
+        """
+        playlist = self.active_list.playlist
+        items = playlist.items
+        playing = self.active_list.get_item_by_id(self.mru_item_index).src \
+            if self.active_list.exists(self.mru_item_index) else None
+        queued = self.queued_item.src if self.queued_item is not None and self.queued_playlist is playlist else None
+        change()
+        # Whole volumes may have been put back, at other positions
+        index = self.media_lib.index_of(playlist)
+        if index is not None:
+            self.active_list.index = index
+        if playlist.items is items:
+            return
+        self.mru_item_index = self.find_item(playing, self.mru_item_index)
+        if queued is not None:
+            # Kept while crossfading into it, when it isn't queued again
+            self.queued_index = self.find_item(queued, self.queued_index)
+        size = self.active_list.size()
+        if size == 0:
+            self.queued_index = None
+        elif self.state != PlayerState.STOPPED:
+            self.queue_item((self.mru_item_index + 1) % size)
+
+    def find_item(self, src: Optional[Path], index: int) -> int:
+        """
+        :param src: A song that was in the active playlist, None if there wasn't one
+        :param index: Where it was
+        :return: Where it is now, or the nearest position there is if it has gone
+        """
+        size = self.active_list.size()
+        if src is not None:
+            if self.active_list.exists(index) and self.active_list.get_item_by_id(index).src == src:
+                return index
+            for i, (path, _) in enumerate(self.active_list.playlist.items.entries()):
+                if path == str(src):
+                    return i
+        return max(0, min(index, size - 1))
+
+    @staticmethod
+    def playlist_announcement(playlist: Playlist) -> str:
+        return f"Play list has been set to {playlist.get_title()}"
+
+    @staticmethod
+    def song_announcement(item: Item) -> str:
+        return f"Start playing song {MusicPlayer.describe(item)}"
+
+    def common_announcements(self) -> Iterator[str]:
+        """
+        The phrases the player says most, for making ahead of time, see speech/presynth.py
+        :return: The controls, round volumes and every playlist title
+        """
+        yield from ("Stop the player", "Pause the player", "Resume the player")
+        yield from (f"Set volume {volume}" for volume in range(0, 101, 10))
+        for playlist in self.media_lib.playlists:
+            yield self.playlist_announcement(playlist)
+
+    def song_announcements(self, songs_per_playlist: int = 3) -> Iterator[str]:
+        """
+        :param songs_per_playlist: How many songs from the start of each playlist
+        :return: The songs most likely to be started, the first of each playlist first. Lazy
+        playlists that aren't loaded are left out.
+        """
+        playlists = [p for p in self.media_lib.playlists if not (isinstance(p, LazyPlaylist) and not p.is_loaded())]
+        for index in range(songs_per_playlist):
+            for playlist in playlists:
+                if playlist.exists(index):
+                    yield self.song_announcement(playlist.get_item_by_id(index))
+
+    @staticmethod
+    def describe(item: Item, with_duration: bool = False) -> str:
+        """
+        What to say about a song, the title and artist if its tags have been read,
+        otherwise the file name
+        :param item: The song
+        :param with_duration: Say how long the song is too, if known
+        :return: The words to say
+        """
+        description = item.get_title()
+        artist = item.get_artist()
+        if artist:
+            description = f"{description} by {artist}"
+        duration = item.get_duration()
+        if with_duration and duration:
+            minutes, seconds = divmod(int(duration), 60)
+            description = f"{description}, {minutes} minutes {seconds} seconds"
+        return description
+
     def do_status_report(self) -> None:
         """
         Report the playlist parameters
@@ -116,68 +743,122 @@ class MusicPlayer():
         :return: Nothing
         """
         # Not fully implemented at this time
-        self.logger.info("Reporting music player parameters")
-        # Another thread issue here, if the user changes the volume
-        # while the status is reported, this will be overwritten
-        # when the volume is reset to the value saved here. Really need
-        # a lock here so the volume cannot be changed until the speech is finished
-        curr_vol = self.get_volume()
-        self.set_volume(20)
-        msg = f"Active Playlist {self.active_list.playlist.title} with {len(self.active_list.size())} items"
+        self.logger.info("Reporting music player parameters, state %s, speech %s", self.state.value,
+                         str(self.speech.metrics()))
+        # Music playing is turned down until the report has been spoken, a volume set meanwhile
+        # is used when it is turned back up
+        self.announcement += 1
+        if self.state in (PlayerState.PLAYING, PlayerState.ANNOUNCING):
+            self.move_to(PlayerState.ANNOUNCING)
+            self.apply_volume()
+        msg = f"Active Playlist {self.active_list.playlist.title} with {self.active_list.size()} items"
         self.logger.info(msg)
-        do_text_to_speech(msg)
-        msg = f"Current song is {self.active_list.get_item_by_id(self.mru_item_index).get_song_name()}"
+        self.speech.say(msg)
+        msg = f"Current song is {self.describe(self.active_list.get_item_by_id(self.mru_item_index), True)}"
         self.logger.info(msg)
-        do_text_to_speech(msg)
-        self.set_volume(curr_vol * 100)
+        announcement = self.announcement
+        self.speech.say(msg, on_done=lambda: self.commands.put(AnnouncementDoneCommand(announcement=announcement)))
+
+    def end_announcement(self, announcement: int) -> None:
+        """
+        Turn the music back up once the latest status report has been spoken
+        :param announcement: The number of the report that has been spoken
+        :return: Nothing
+        """
+        if announcement == self.announcement and self.state == PlayerState.ANNOUNCING:
+            self.move_to(PlayerState.PLAYING)
+            self.apply_volume()
 
     def next(self) -> None:
         """
         Play the next item, wrapping around to 0 if the end it reached
         :return: None
         """
-        temp = self.mru_item_index + 1
-        if temp >= self.active_list.playlist.size():
-            temp = 0
-        self.start(temp)
+        self.skip(1)
 
     def prev(self) -> None:
         """
         Play the previous item, wrapping around to the end of the playlist if necessary
         :return: None
         """
-        temp = self.mru_item_index - 1
-        if temp < 0:
-            temp = self.active_list.playlist.size() - 1
-        self.start(temp)
+        self.skip(-1)
+
+    def skip(self, steps: int) -> None:
+        """
+        Play the item this many places on from the current one, wrapping around either end
+        of the playlist, what several nexts or prevs in a row come to
+        :param steps: How far to move, negative to go back
+        :return: None
+        """
+        size = self.active_list.playlist.size()
+        if size > 0:
+            self.start((self.mru_item_index + steps) % size, step=1 if steps >= 0 else -1)
 
     def stop(self) -> None:
         """
         Stop the music
         :return: None
         """
-        do_text_to_speech("Stop the player")
+        if not self.move_to(PlayerState.STOPPED):
+            return
+        self.speech.say("Stop the player", topic="transport")
+        # Stopping posts the end event too, nothing should follow on
+        pygame.mixer.music.set_endevent()
+        self.cancel_crossfade()
         pygame.mixer.music.stop()
         pygame.mixer.music.unload()
+        self.queued_index = None
+        self.fade_at = None
 
     def pause(self) -> None:
         """
         Pause the music
         :return: None
         """
-        do_text_to_speech("Pause the player")
+        if not self.move_to(PlayerState.PAUSED):
+            return
+        self.speech.say("Pause the player", topic="transport")
         pygame.mixer.music.pause()
+        if self.crossfade_timer is not None:
+            self.crossfade_timer.cancel()
+            self.crossfade_timer = None
+        if self.fading:
+            self.crossfader.pause()
+        # Turned back up in case it was paused while ducked
+        self.apply_volume()
 
     def unpause(self) -> None:
         """
         Unpause the music
         :return: None
         """
-        do_text_to_speech("Resume the player")
+        if self.state != PlayerState.PAUSED or not self.move_to(PlayerState.PLAYING):
+            return
+        self.speech.say("Resume the player", topic="transport")
         pygame.mixer.music.unpause()
+        if self.fading:
+            self.crossfader.unpause()
+        self.schedule_crossfade()
 
     def get_volume(self):
-        return pygame.mixer.music.get_volume()
+        return self.volume
+
+    def apply_volume(self) -> None:
+        """
+        Set the mixer to the user's volume with the song's gain, the mixer can't go over
+        full volume so a quiet song is only turned up as far as that
+        """
+        pygame.mixer.music.set_volume(self.mixer_volume(self.gain))
+        if self.fading:
+            self.crossfader.set_volume(self.mixer_volume(self.fade_gain))
+
+    def mixer_volume(self, gain: float) -> float:
+        """
+        :param gain: The gain of a song in dB
+        :return: The mixer volume to play it at, 0 to 1
+        """
+        volume = DUCKED_VOLUME if self.state == PlayerState.ANNOUNCING else self.volume
+        return min(1.0, volume * 10 ** (gain / 20))
 
     def set_volume(self, setting: int) -> None:
         """
@@ -187,9 +868,10 @@ class MusicPlayer():
         :param setting: The new volume setting.
         :return: The old volume setting as a value between 0 and 100
         """
-        do_text_to_speech(f"Set volume {setting}")
-        old_volume = pygame.mixer.music.get_volume()
+        self.speech.say(f"Set volume {setting}", topic="volume")
+        old_volume = self.volume
         new_value = max(0, min(100, setting))
-        pygame.mixer.music.set_volume(new_value / 100.0)
+        self.volume = new_value / 100.0
+        self.apply_volume()
         self.logger.info("Input value %d, adjusted to %d", setting, new_value)
         return int(old_volume * 100.0)
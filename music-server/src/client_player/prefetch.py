@@ -0,0 +1,116 @@
+"""
+Reads the songs the player is likely to play next into memory in the background, so next
+and prev start straight away instead of waiting for a slow USB stick to spin up and seek.
+The songs are held in a cache of limited size, the least recently used go first. A song too
+big for the cache only has its start read, which still puts it in the page cache.
+"""
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+DEFAULT_PREFETCH_BYTES = 64 * 1024 * 1024
+
+# How much of a song that doesn't fit in the cache is read ahead
+HEAD_BYTES = 1024 * 1024
+
+
+class Prefetcher:
+    """
+    Holds the contents of recently played and soon to be played songs
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_PREFETCH_BYTES):
+        """
+        :param max_bytes: The most the cached songs can take up, a song bigger than a quarter
+        of this isn't cached
+        """
+        self.logger = logging.getLogger("comms.mqtt")
+        self.max_bytes = max_bytes
+        # Song contents keyed by path, least recently used first
+        self.songs: "OrderedDict[str, bytes]" = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        # Each request is the list of songs wanted now, only the latest one matters
+        self.requests: "queue.Queue[List[Path]]" = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self._run, name="prefetcher", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            paths = self.requests.get()
+            try:
+                # Skip requests overtaken by newer ones while a slow read was going on
+                while not self.requests.empty():
+                    self.requests.task_done()
+                    paths = self.requests.get_nowait()
+                for path in paths:
+                    self.fetch(path)
+            except Exception as e:
+                self.logger.error("Problem prefetching songs %s", str(e))
+            finally:
+                self.requests.task_done()
+
+    def prefetch(self, paths: List[Path]) -> None:
+        """
+        Read songs into the cache in the background, in order
+        :param paths: The songs, most wanted first
+        :return: Nothing
+        """
+        self.requests.put(paths)
+
+    def wait(self) -> None:
+        """
+        Block until the songs asked for so far have been read
+        """
+        self.requests.join()
+
+    def fetch(self, path: Path) -> bool:
+        """
+        Read a song into the cache now, if it isn't there already
+        :param path: The song
+        :return: True if the song is in the cache
+        """
+        key = str(path)
+        with self.lock:
+            if key in self.songs:
+                self.songs.move_to_end(key)
+                return True
+        try:
+            with open(key, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size > self.max_bytes // 4:
+                    if hasattr(os, 'posix_fadvise'):
+                        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                    f.read(HEAD_BYTES)
+                    return False
+                data = f.read()
+        except OSError as e:
+            self.logger.warning("Can't prefetch %s %s", key, str(e))
+            return False
+        with self.lock:
+            if key not in self.songs:
+                self.songs[key] = data
+                self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.songs.popitem(last=False)
+                self.total_bytes -= len(evicted)
+        return True
+
+    def take(self, path: Path) -> Optional[bytes]:
+        """
+        :param path: A song about to be played
+        :return: Its contents if they are in the cache, they stay there for prev
+        """
+        key = str(path)
+        with self.lock:
+            data = self.songs.get(key)
+            if data is not None:
+                self.songs.move_to_end(key)
+            return data
@@ -1,19 +1,32 @@
 import argparse
 import logging
 import logging.config
+import threading
 import time
 import traceback
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
+from client_player.command_queue import DEFAULT_COALESCE_SECONDS
 from client_player.music_player import MusicPlayer
+from client_player.crossfade import Crossfader, DEFAULT_CROSSFADE_SECONDS, MAX_CROSSFADE_SECONDS
+from client_player.prefetch import Prefetcher, DEFAULT_PREFETCH_BYTES
 from comms import run_tasks_in_parallel_no_block
 from comms.mqtt_comms import SensorListener, MqttComms
 from discovery import get_service_host_port_block
-from messages.music_control import MusicPlayCommand, MusicStopCommand, MusicVolumeCommand, \
-    MusicPauseCommand, MusicUnpauseCommand, MusicNextCommand, MusicPrevCommand, MusicListCommand, MusicStatusReport
 from messages.serdeser import cmd_from_json
-from musiclib.media_lib import MediaLib, MediaLibParsers
+from musiclib.dedup import Deduplicator, HashCache
+from musiclib.lib_index import LibIndex
+from musiclib.lib_snapshot import LibSnapshot, SnapshotVerifier, warm_start
+from musiclib.lib_watcher import LibWatcher
+from musiclib.loudness import LoudnessScanner, DEFAULT_LOUDNESS_WORKERS
+from musiclib.media_lib import MediaLib, MediaLibParsers, PlaylistCache, DEFAULT_SCAN_WORKERS, \
+    DEFAULT_MAX_CACHED_ITEMS
+from musiclib.shared_index import SharedIndexPublisher
+from musiclib.tags import TagCache, TagScanner, DEFAULT_TAG_WORKERS
+from speech.phrase_cache import PhraseCache, PhraseSpeaker, DEFAULT_PHRASE_CACHE_BYTES
+from speech.presynth import Presynthesizer
+from speech.speech_queue import SpeechQueue
 
 """
 This is the music player, it receives commands from the mqtt broker and controls
@@ -33,10 +46,110 @@ class MusicCommandGatewayListener(SensorListener):
     which are used to command the music player.
     """
 
-    def __init__(self, volumes: List[Path]):
+    def __init__(self, volumes: List[Path], index_path: Path = None, workers: int = DEFAULT_SCAN_WORKERS,
+                 validate: bool = True, playlist_cache: PlaylistCache = None, watch: bool = False,
+                 mounts_root: Path = None, poll_seconds: float = None, tag_cache_path: Path = None,
+                 tag_workers: int = DEFAULT_TAG_WORKERS, dedup: bool = True, hash_cache_path: Path = None,
+                 snapshot_path: Path = None, loudness_workers: int = DEFAULT_LOUDNESS_WORKERS,
+                 shared_index_path: Path = None, prefetch_bytes: int = DEFAULT_PREFETCH_BYTES,
+                 coalesce_seconds: float = DEFAULT_COALESCE_SECONDS, phrase_cache_path: Path = None,
+                 phrase_cache_bytes: int = DEFAULT_PHRASE_CACHE_BYTES,
+                 crossfade_seconds: float = DEFAULT_CROSSFADE_SECONDS):
         self.logger = logging.getLogger("comms.mqtt")
-        media_lib: MediaLib = MediaLibParsers.parse_lib(volumes)
-        self.player = MusicPlayer(media_lib=media_lib)
+        index = LibIndex(index_path) if index_path is not None else None
+
+        def scan(scan_volumes: List[Path]) -> MediaLib:
+            return MediaLibParsers.parse_lib(scan_volumes, index=index, workers=workers, validate=validate,
+                                             playlist_cache=playlist_cache)
+
+        start = time.time()
+        # Lazy playlists are already quick to load from the index, the snapshot is for the rest
+        snapshot = LibSnapshot(snapshot_path) if snapshot_path is not None and playlist_cache is None else None
+        if snapshot is not None:
+            media_lib, from_snapshot = warm_start(volumes, snapshot, scan)
+        else:
+            media_lib = scan(volumes)
+        self.logger.info("Media library loaded in %.2f seconds", time.time() - start)
+        # Lazy playlists read their items from the index when they are first played, the
+        # volumes taken from the snapshot are scanned again with it and the loudness of the songs is kept in it
+        if snapshot is None and index is not None and playlist_cache is None and loudness_workers <= 0:
+            index.close()
+        prefetcher = None
+        if prefetch_bytes > 0:
+            prefetcher = Prefetcher(max_bytes=prefetch_bytes)
+            prefetcher.start()
+        # Phrases said before are played from the cache instead of running flite again
+        phrases = PhraseCache(phrase_cache_path, max_bytes=phrase_cache_bytes) if phrase_cache_path else None
+        speech = SpeechQueue(PhraseSpeaker(phrases) if phrases is not None else None)
+        speech.start()
+        # The player runs the commands one at a time on a thread of its own, bursts of them folded together
+        # Songs crossfade into the next, or follow on with no gap
+        crossfader = None
+        if crossfade_seconds > 0:
+            crossfader = Crossfader(fade_seconds=crossfade_seconds)
+            crossfader.start()
+        self.player = MusicPlayer(media_lib=media_lib, prefetcher=prefetcher, speech=speech,
+                                  coalesce_seconds=coalesce_seconds, crossfader=crossfader)
+        # The volumes taken from the snapshot are scanned again in the background, the player swaps in any that changed
+        if snapshot is not None:
+            SnapshotVerifier(media_lib, snapshot, from_snapshot, scan, run_change=self.player.run_change).start()
+        # The song names are made once the tags have been read, or straight away if they aren't
+        self.tags_read = threading.Event()
+        if tag_workers <= 0:
+            self.tags_read.set()
+        if phrases is not None:
+            threading.Thread(target=self.presynthesize, args=(Presynthesizer(phrases),), name="speech-presynth",
+                             daemon=True).start()
+        # Once the player is ready find the songs copied onto several volumes, then read the song
+        # tags of the rest and measure their loudness, they are filled in as they are read
+        deduplicator = None
+        if dedup:
+            deduplicator = Deduplicator(media_lib, cache=HashCache(hash_cache_path) if hash_cache_path else None)
+        tag_scanner = None
+        if tag_workers > 0:
+            tag_cache = TagCache(tag_cache_path) if tag_cache_path is not None else None
+            tag_scanner = TagScanner(media_lib, cache=tag_cache, workers=tag_workers)
+        loudness_scanner = None
+        if loudness_workers > 0:
+            loudness_scanner = LoudnessScanner(media_lib, index=index, workers=loudness_workers)
+        if deduplicator is not None or tag_scanner is not None or loudness_scanner is not None:
+            threading.Thread(target=self.scan_songs, args=(deduplicator, tag_scanner, loudness_scanner),
+                             name="song-scanner", daemon=True).start()
+        # Other processes read the library from the shared index instead of scanning the volumes
+        if shared_index_path is not None:
+            SharedIndexPublisher(media_lib, shared_index_path).start()
+        # Keep the library up to date as drives come and go and playlists are edited
+        self.watcher = None
+        if watch:
+            self.watcher = LibWatcher(media_lib, volumes, mounts_root=mounts_root, validate=validate,
+                                      poll_seconds=poll_seconds, run_change=self.player.run_change)
+            self.watcher.start()
+
+    def scan_songs(self, deduplicator: Optional[Deduplicator], tag_scanner: Optional[TagScanner],
+                   loudness_scanner: Optional[LoudnessScanner]) -> None:
+        try:
+            if deduplicator is not None:
+                deduplicator.scan()
+            if tag_scanner is not None:
+                tag_scanner.scan()
+            self.tags_read.set()
+            if loudness_scanner is not None:
+                loudness_scanner.scan()
+        except Exception as e:
+            self.logger.error("Problem scanning songs %s", str(e))
+        finally:
+            self.tags_read.set()
+
+    def presynthesize(self, presynth: Presynthesizer) -> None:
+        """
+        Make the phrases the player will say into the phrase cache, at a low priority
+        """
+        try:
+            presynth.run(self.player.common_announcements())
+            self.tags_read.wait()
+            presynth.run(self.player.song_announcements())
+        except Exception as e:
+            self.logger.error("Problem making phrases ahead of time %s", str(e))
 
     def on_disconnect(self, reason: str):
         self.logger.debug("Disconnection event %s", reason)
@@ -50,26 +163,7 @@ class MusicCommandGatewayListener(SensorListener):
             self.logger.info("Payload %s", cmd_str)
             cmd = cmd_from_json(cmd_str)
             self.logger.info("Message received Topic (%s) Type(%s) Payload (%s)", topic, type(cmd), str(cmd))
-            if isinstance(cmd, MusicPlayCommand):
-                self.player.start(cmd.payload)
-            elif isinstance(cmd, MusicNextCommand):
-                self.player.next()
-            elif isinstance(cmd, MusicPrevCommand):
-                self.player.prev()
-            elif isinstance(cmd, MusicStopCommand):
-                self.player.stop()
-            elif isinstance(cmd, MusicPauseCommand):
-                self.player.pause()
-            elif isinstance(cmd, MusicUnpauseCommand):
-                self.player.unpause()
-            elif isinstance(cmd, MusicVolumeCommand):
-                self.player.set_volume(cmd.payload)
-            elif isinstance(cmd, MusicListCommand):
-                self.player.set_playlist(cmd.payload)
-            elif isinstance(cmd, MusicStatusReport):
-                self.player.do_status_report()
-            else:
-                self.logger.warning("Unsupported cmd type %s", type(cmd))
+            self.player.submit(cmd)
         except Exception as e:
             self.logger.error("Problem executing message %s, exception %s", cmd_str, str(e))
             traceback.print_exc()
@@ -79,6 +173,13 @@ def parse_arguments() -> argparse.Namespace:
     # default_mqtt_broker = "localhost:1883"
     default_mqtt_service_name = "DYLAN MQTT Server"
     default_cmd_topic = "kontrol/music"
+    default_index = Path("target/cache/media-lib-index.sqlite")
+    default_mounts_root = Path("/media/pi")
+    default_tag_cache = Path("target/cache/media-lib-tags.sqlite")
+    default_hash_cache = Path("target/cache/media-lib-hashes.sqlite")
+    default_snapshot = Path("target/cache/media-lib-snapshot.bin")
+    default_shared_index = Path("target/cache/media-lib-shared.idx")
+    default_phrase_cache = Path("target/cache/speech-phrases")
     parser = argparse.ArgumentParser(description="Music Player")
     parser.add_argument("-l", "--log-config", type=Path, required=True, help="Path to logging configuration file")
     parser.add_argument("-id", "--client-id", type=str, required=False, default="music-player",
@@ -92,6 +193,69 @@ def parse_arguments() -> argparse.Namespace:
     parser.add_argument("-v", "--volumes", nargs="+", type=Path, required=True,
                         help="One or more Paths to volumes that hold the music and the playlists, They must all exist."
                              "Use space as the separator")
+    parser.add_argument("-i", "--index", type=Path, required=False, default=default_index,
+                        help=f"Path to the library index, it makes restarts much faster, default is \"{default_index}\"")
+    parser.add_argument("--no-index", action="store_true",
+                        help="Don't use the library index, scan every volume from scratch")
+    parser.add_argument("-w", "--workers", type=int, required=False, default=DEFAULT_SCAN_WORKERS,
+                        help=f"Number of threads used to scan the volumes, default is {DEFAULT_SCAN_WORKERS}")
+    parser.add_argument("--defer-validation", action="store_true",
+                        help="Don't check the songs in text playlists exist when loading, skip missing ones when played")
+    parser.add_argument("--lazy-playlists", action="store_true",
+                        help="Only read playlist titles at start up, read the songs when a playlist is first used")
+    parser.add_argument("--max-cached-items", type=int, required=False, default=DEFAULT_MAX_CACHED_ITEMS,
+                        help="With lazy playlists, the most songs to keep in memory before unused playlists are "
+                             f"dropped, default is {DEFAULT_MAX_CACHED_ITEMS}")
+    parser.add_argument("--watch", action="store_true",
+                        help="Watch the volumes and update the library when drives or playlists change")
+    parser.add_argument("--mounts-root", type=Path, required=False, default=default_mounts_root,
+                        help=f"Where USB drives are mounted, new drives found here are added, "
+                             f"default is \"{default_mounts_root}\"")
+    parser.add_argument("--poll-seconds", type=float, required=False, default=None,
+                        help="Look for changes this often instead of using inotify")
+    parser.add_argument("--tag-cache", type=Path, required=False, default=default_tag_cache,
+                        help=f"Path to the cache of song tags, default is \"{default_tag_cache}\"")
+    parser.add_argument("--tag-workers", type=int, required=False, default=DEFAULT_TAG_WORKERS,
+                        help=f"Number of processes reading song tags, 0 to not read them, "
+                             f"default is {DEFAULT_TAG_WORKERS}")
+    parser.add_argument("--loudness-workers", type=int, required=False, default=DEFAULT_LOUDNESS_WORKERS,
+                        help=f"Number of processes measuring the loudness of songs so they play equally loud, "
+                             f"0 to not measure it, it is kept in the index, default is {DEFAULT_LOUDNESS_WORKERS}")
+    parser.add_argument("--snapshot", type=Path, required=False, default=default_snapshot,
+                        help=f"Path to the library snapshot, it lets the player start before the volumes are "
+                             f"scanned, default is \"{default_snapshot}\"")
+    parser.add_argument("--no-snapshot", action="store_true",
+                        help="Don't use the library snapshot, scan the volumes before starting")
+    parser.add_argument("--shared-index", type=Path, required=False, default=default_shared_index,
+                        help=f"Path to the read-only copy of the library other programs read instead of scanning, "
+                             f"default is \"{default_shared_index}\"")
+    parser.add_argument("--no-shared-index", action="store_true",
+                        help="Don't publish the library for other programs")
+    default_prefetch_mb = DEFAULT_PREFETCH_BYTES // (1024 * 1024)
+    parser.add_argument("--prefetch-mb", type=int, required=False, default=default_prefetch_mb,
+                        help="Memory in MB for reading the songs either side of the one playing ahead of time, so "
+                             f"next and prev start at once, 0 to not, default is {default_prefetch_mb}")
+    parser.add_argument("--coalesce-ms", type=int, required=False, default=int(DEFAULT_COALESCE_SECONDS * 1000),
+                        help="Wait this long after a command for more before running them, so a burst of next or "
+                             "volume commands runs as one, 0 to run each command at once, default is "
+                             f"{int(DEFAULT_COALESCE_SECONDS * 1000)}")
+    parser.add_argument("--crossfade-ms", type=int, required=False, default=int(DEFAULT_CROSSFADE_SECONDS * 1000),
+                        help="Fade each song into the next over this long, up to "
+                             f"{int(MAX_CROSSFADE_SECONDS * 1000)}, songs whose length isn't known yet follow on "
+                             "with no gap, default is 0, no crossfade")
+    parser.add_argument("--phrase-cache", type=Path, required=False, default=default_phrase_cache,
+                        help=f"Folder for the spoken phrases, they are made once and played from there, "
+                             f"default is \"{default_phrase_cache}\"")
+    parser.add_argument("--phrase-cache-mb", type=int, required=False,
+                        default=DEFAULT_PHRASE_CACHE_BYTES // (1024 * 1024),
+                        help="Most space in MB the spoken phrases can take up, the least recently used are deleted, "
+                             f"default is {DEFAULT_PHRASE_CACHE_BYTES // (1024 * 1024)}")
+    parser.add_argument("--no-phrase-cache", action="store_true",
+                        help="Run flite for every announcement instead of keeping the phrases")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Don't look for songs copied onto more than one volume")
+    parser.add_argument("--hash-cache", type=Path, required=False, default=default_hash_cache,
+                        help=f"Path to the cache of file hashes used to find copies, default is \"{default_hash_cache}\"")
     args = parser.parse_args()
     return args
 
@@ -140,7 +304,22 @@ def main():
     cmd_topic = args.cmd_topic
     keep_alive_seconds = 20
 
-    test_listener = MusicCommandGatewayListener(volumes=volumes)
+    index_path = None if args.no_index else args.index
+    playlist_cache = PlaylistCache(max_items=args.max_cached_items) if args.lazy_playlists else None
+    test_listener = MusicCommandGatewayListener(volumes=volumes, index_path=index_path, workers=args.workers,
+                                                validate=not args.defer_validation, playlist_cache=playlist_cache,
+                                                watch=args.watch, mounts_root=args.mounts_root,
+                                                poll_seconds=args.poll_seconds, tag_cache_path=args.tag_cache,
+                                                tag_workers=args.tag_workers, dedup=not args.no_dedup,
+                                                hash_cache_path=args.hash_cache,
+                                                snapshot_path=None if args.no_snapshot else args.snapshot,
+                                                loudness_workers=args.loudness_workers,
+                                                shared_index_path=None if args.no_shared_index else args.shared_index,
+                                                prefetch_bytes=args.prefetch_mb * 1024 * 1024,
+                                                coalesce_seconds=args.coalesce_ms / 1000,
+                                                phrase_cache_path=None if args.no_phrase_cache else args.phrase_cache,
+                                                phrase_cache_bytes=args.phrase_cache_mb * 1024 * 1024,
+                                                crossfade_seconds=args.crossfade_ms / 1000)
     comms = MqttComms(client_id=client_id,
                       cert_path=cert_path,
                       username=username,
@@ -0,0 +1,70 @@
+"""
+Waits on the pygame event queue for the mixer's end of song events, so the player can move on
+to the next song without polling the mixer. The wait is on a thread of its own, the player's
+thread waits on its command queue, and each event is handed to whoever registered its type.
+There is only one pygame event queue however many players there are.
+
+pygame only posts the events once its video system is up, the dummy video driver is used
+unless another is set as the player has no window.
+"""
+import logging
+import os
+import threading
+from typing import Callable, Dict, Optional
+
+import pygame
+
+
+class TrackEvents:
+    """
+    Hands out event types for the mixer to post and calls back when one arrives
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("comms.mqtt")
+        self.handlers: Dict[int, Callable[[int], None]] = {}
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    def register(self, handler: Callable[[int], None]) -> int:
+        """
+        :param handler: Called on the event thread with the event type when the event arrives
+        :return: A new event type to give to pygame.mixer.music.set_endevent
+        """
+        with self.lock:
+            if self.thread is None:
+                os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+                pygame.display.init()
+                # Only the mixer's events are wanted, nothing else should fill the queue
+                pygame.event.set_blocked(None)
+                self.thread = threading.Thread(target=self._run, name="player-events", daemon=True)
+                self.thread.start()
+            event_type = pygame.event.custom_type()
+            pygame.event.set_allowed(event_type)
+            self.handlers[event_type] = handler
+            return event_type
+
+    def unregister(self, event_type: int) -> None:
+        """
+        Stop calling back for an event type, events of it still waiting are dropped
+        :param event_type: A type register handed out
+        """
+        with self.lock:
+            self.handlers.pop(event_type, None)
+            pygame.event.set_blocked(event_type)
+
+    def _run(self) -> None:
+        while True:
+            event = pygame.event.wait()
+            with self.lock:
+                handler = self.handlers.get(event.type)
+            if handler is None:
+                continue
+            try:
+                handler(event.type)
+            except Exception as e:
+                self.logger.error("Problem handling player event %s, exception %s", str(event), str(e))
+
+
+# The one pygame event queue
+TRACK_EVENTS = TrackEvents()
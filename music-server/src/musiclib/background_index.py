@@ -0,0 +1,85 @@
+"""
+Keeps an index over the media lib, like the search index or the stable ids, that takes
+seconds to build over a big library. It is built on a thread of its own at start up and
+again whenever the library changes, and the last complete index is used meanwhile, so the
+player's commands never wait for one to be built, only the first one.
+
+An index is anything built from a media lib that can tell when the library has changed
+since, with is_current.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Generic, Optional, TypeVar
+
+from musiclib.media_lib import MediaLib
+
+Index = TypeVar("Index")
+
+
+class BackgroundIndex(Generic[Index]):
+    """
+    An index of the media lib, built again in the background when the library changes
+    """
+
+    def __init__(self, media_lib: MediaLib, build: Callable[[MediaLib], Index], name: str):
+        """
+        :param media_lib: The library to index
+        :param build: Builds an index of the library, it must have an is_current method
+        :param name: What the index is, for the log and the name of the thread
+        """
+        self.logger = logging.getLogger("comms.mqtt")
+        self.media_lib = media_lib
+        self.build = build
+        self.name = name
+        # The last complete index
+        self.index: Optional[Index] = None
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.built = threading.Event()
+
+    def start(self) -> None:
+        """
+        Build the first index
+        """
+        self.refresh()
+
+    def refresh(self) -> None:
+        """
+        Build the index again, unless it is current or is being built
+        """
+        with self.lock:
+            if self.thread is not None or (self.index is not None and self.index.is_current()):
+                return
+            self.thread = threading.Thread(target=self._run, name=self.name.replace(" ", "-"), daemon=True)
+            self.thread.start()
+
+    def get(self) -> Index:
+        """
+        :return: The last complete index, which may be out of date while the next one is built,
+        only the first is waited for
+        """
+        self.refresh()
+        self.built.wait()
+        index = self.index
+        if index is None:
+            # Building it in the background failed, there is no older one to use
+            index = self.index = self.build(self.media_lib)
+        return index
+
+    def _run(self) -> None:
+        index = None
+        try:
+            start = time.time()
+            index = self.build(self.media_lib)
+            self.index = index
+            self.logger.info("%s built in %.2f seconds", self.name.capitalize(), time.time() - start)
+        except Exception as e:
+            self.logger.error("Problem building the %s %s", self.name, str(e))
+        finally:
+            with self.lock:
+                self.thread = None
+            self.built.set()
+        if index is not None and not index.is_current():
+            # The library changed while it was being built
+            self.refresh()
@@ -1,23 +1,36 @@
+import sys
 from pathlib import Path
 
 from musiclib.media_lib import MediaLibParsers
+from musiclib.shared_index import SharedIndex
+from musiclib.stable_ids import item_stable_id, playlist_stable_id
 
 """
-A test program for verifying the music_lib package operation.
+A test program for verifying the music_lib package operation. Give it the path to the
+shared index published by the music player to list that instead of scanning the volumes.
 """
 
 
 def main():
     rootdirs = [Path("/Volumes/Samsung USB/"), Path("/Volumes/DYLAN/")]
 
-    media_lib = MediaLibParsers.parse_lib(rootdirs)
+    if len(sys.argv) > 1:
+        shared = SharedIndex.open(Path(sys.argv[1]))
+        if shared is None:
+            print("No shared index at", sys.argv[1])
+            return
+        media_lib = shared.to_media_lib()
+        rootdirs = sorted({playlist.volume for playlist in media_lib.playlists})
+    else:
+        media_lib = MediaLibParsers.parse_lib(rootdirs)
     print(f"{str(rootdirs)} contains {media_lib.size()} playlists")
     for playlist in media_lib.playlists:
         print("Kind:", playlist.get_kind())
-        print("Title:", playlist.get_title())
+        print("Title:", playlist.get_title(), "Id:", playlist_stable_id(playlist))
         print(f"There {playlist.size()} items in playlist")
-        for item in playlist.items:
-            print("Album:", item.album_name, "Item:", item.src, "Exists?", item.src.exists())
+        for index, item in enumerate(playlist.items):
+            print("Album:", item.album_name, "Item:", item.src, "Id:", item_stable_id(playlist, index),
+                  "Exists?", item.src.exists())
 
 
 if __name__ == "__main__":
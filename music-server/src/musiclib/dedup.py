@@ -0,0 +1,209 @@
+"""
+Finds the songs that are on more than one volume, the same album copied onto two USB
+drives, so each song is only tag read, indexed and announced once. Copies are found by
+content rather than by name:
+
+* Files are first grouped by size, a file whose size is unique can't have a copy and is
+  never opened. Most songs drop out here.
+* Files of the same size are told apart by a hash of their first and last blocks, which is
+  two small reads however big the file is.
+* Only files whose size and partial hash both match are read in full and hashed, to be sure.
+
+The hashes are kept in a SQLite cache keyed by path, size and mtime so later scans don't
+open the files that haven't changed. The first copy in library order is the canonical one,
+the others are recorded against it in the item table.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from musiclib.item_table import ItemTable
+from musiclib.media_lib import LazyPlaylist, MediaLib
+
+# How much of each end of a file goes into the partial hash
+PARTIAL_BLOCK_SIZE = 64 * 1024
+
+# Read size when hashing a whole file
+FULL_READ_SIZE = 1024 * 1024
+
+HASHES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    partial BLOB,
+    full BLOB);
+"""
+
+
+def partial_hash(path: str, size: int) -> bytes:
+    """
+    Hash the first and last blocks of a file, small files are hashed whole
+    :param path: The file
+    :param size: Its size
+    :return: The digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        if size <= 2 * PARTIAL_BLOCK_SIZE:
+            digest.update(f.read())
+        else:
+            digest.update(f.read(PARTIAL_BLOCK_SIZE))
+            f.seek(size - PARTIAL_BLOCK_SIZE)
+            digest.update(f.read(PARTIAL_BLOCK_SIZE))
+    return digest.digest()
+
+
+def full_hash(path: str) -> bytes:
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(FULL_READ_SIZE), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+@dataclass
+class FileHashes():
+    size: int
+    mtime_ns: int
+    # None until the file has had to be hashed
+    partial: Optional[bytes] = None
+    full: Optional[bytes] = None
+
+
+class HashCache:
+    """
+    The hashes worked out so far, in a SQLite database. An entry is only used if the file
+    still has the size and mtime it had when it was hashed.
+    """
+
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(HASHES_SCHEMA)
+
+    def lookup(self) -> Dict[str, FileHashes]:
+        with self.lock:
+            rows = self.conn.execute("SELECT path, size, mtime_ns, partial, full FROM hashes").fetchall()
+        return {path: FileHashes(size=size, mtime_ns=mtime_ns, partial=partial, full=full)
+                for path, size, mtime_ns, partial, full in rows}
+
+    def store(self, rows: List[Tuple[str, FileHashes]]) -> None:
+        """
+        :param rows: The path and hashes of files that were hashed
+        :return: Nothing
+        """
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO hashes (path, size, mtime_ns, partial, full) VALUES (?, ?, ?, ?, ?)",
+                [(path, h.size, h.mtime_ns, h.partial, h.full) for path, h in rows])
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+class Deduplicator:
+    """
+    Finds the copies among the songs of the media lib whose items are in memory
+    """
+
+    def __init__(self, media_lib: MediaLib, cache: HashCache = None):
+        """
+        :param media_lib: The library to look through
+        :param cache: Optional cache, files whose size and mtime are unchanged are not hashed again
+        """
+        self.logger = logging.getLogger("comms.mqtt")
+        self.media_lib = media_lib
+        self.cache = cache
+
+    def _songs(self) -> Dict[str, List[ItemTable]]:
+        """
+        :return: Each song named by a loaded playlist, in library order, with the tables holding it
+        """
+        songs: Dict[str, List[ItemTable]] = {}
+        for playlist in self.media_lib.playlists:
+            if isinstance(playlist, LazyPlaylist) and not playlist.is_loaded():
+                continue
+            items = playlist.items
+            for src, _ in items.entries():
+                tables = songs.setdefault(src, [])
+                if items.table not in tables:
+                    tables.append(items.table)
+        return songs
+
+    def scan(self) -> int:
+        """
+        Find the copies and record them in the item tables
+        :return: The number of songs that are copies of another
+        """
+        songs = self._songs()
+        cached = self.cache.lookup() if self.cache is not None else {}
+        hashes: Dict[str, FileHashes] = {}
+        by_size: Dict[int, List[str]] = {}
+        for path in songs:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entry = cached.get(path)
+            if entry is None or entry.size != st.st_size or entry.mtime_ns != st.st_mtime_ns:
+                entry = FileHashes(size=st.st_size, mtime_ns=st.st_mtime_ns)
+            hashes[path] = entry
+            by_size.setdefault(st.st_size, []).append(path)
+
+        updated: Dict[str, FileHashes] = {}
+
+        def split(paths: List[str], attr: str, fn) -> List[List[str]]:
+            groups: Dict[bytes, List[str]] = {}
+            for path in paths:
+                entry = hashes[path]
+                if getattr(entry, attr) is None:
+                    try:
+                        setattr(entry, attr, fn(path, entry.size))
+                    except OSError:
+                        continue
+                    updated[path] = entry
+                groups.setdefault(getattr(entry, attr), []).append(path)
+            return [group for group in groups.values() if len(group) > 1]
+
+        canonical: Dict[str, str] = {}
+        for paths in by_size.values():
+            if len(paths) < 2:
+                continue
+            for same_ends in split(paths, 'partial', partial_hash):
+                for same in split(same_ends, 'full', lambda path, _: full_hash(path)):
+                    # The paths are in library order, the first copy stands for the rest
+                    for path in same[1:]:
+                        canonical[path] = same[0]
+        if self.cache is not None and len(updated) > 0:
+            self.cache.store(list(updated.items()))
+        self._record(songs, canonical)
+        self.logger.info("Checked %d songs for copies, hashed %d, found %d copies", len(hashes), len(updated),
+                         len(canonical))
+        self.media_lib.changed()
+        return len(canonical)
+
+    @staticmethod
+    def _record(songs: Dict[str, List[ItemTable]], canonical: Dict[str, str]) -> None:
+        tables: Dict[int, Tuple[ItemTable, Dict[int, int]]] = {}
+        for path, table_list in songs.items():
+            for table in table_list:
+                tables.setdefault(id(table), (table, {}))
+        for path, original in canonical.items():
+            for table in songs[path]:
+                key = table.path_key(path)
+                original_key = table.path_key(original)
+                if key is not None and original_key is not None:
+                    tables[id(table)][1][key] = original_key
+        # Swapped in whole, readers see either the old copies or the new ones
+        for table, mapping in tables.values():
+            table.canonical = mapping
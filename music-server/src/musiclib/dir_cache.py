@@ -0,0 +1,73 @@
+"""
+Checks whether files exist by listing each directory once and looking names up in the
+listing, rather than a stat per file. On FAT and exFAT USB sticks every stat is slow and
+a text playlist usually names a dozen songs from the same album folder.
+
+Those file systems also ignore case, a playlist naming "01 song.MP3" plays "01 Song.mp3",
+so a name that isn't in the listing as it is spelled is looked for again ignoring case.
+"""
+import os
+import unicodedata
+from pathlib import Path
+from typing import Dict, Optional
+
+
+def _normalize(name: str) -> str:
+    # The Mac writes accented names decomposed (NFD), playlists written elsewhere usually
+    # have them composed (NFC). Compare in one form so both spellings match.
+    return unicodedata.normalize('NFC', name)
+
+
+class DirListingCache:
+    """
+    Holds the listing of every directory asked about. It is safe to share between the
+    threads parsing playlists, the worst that can happen is a directory gets listed twice.
+    """
+
+    def __init__(self):
+        # Maps a directory to its entries, normalized name to the name on disk.
+        # None means the directory could not be listed.
+        self.listings: Dict[str, Optional[Dict[str, str]]] = {}
+        # The same, keyed by the normalized name with its case folded, only made for the
+        # directories where a name wasn't found as it was spelled
+        self.folded: Dict[str, Dict[str, str]] = {}
+
+    def _listing(self, dir: str) -> Optional[Dict[str, str]]:
+        if dir in self.listings:
+            return self.listings[dir]
+        try:
+            listing = {_normalize(name): name for name in os.listdir(dir)}
+        except OSError:
+            listing = None
+        return self.listings.setdefault(dir, listing)
+
+    def resolve(self, path: Path) -> Optional[Path]:
+        """
+        Find the file on disk
+        :param path: The path to look for
+        :return: The path with the name spelled the way it is on disk, or None if there is no such file
+        """
+        listing = self._listing(str(path.parent))
+        if listing is None:
+            return None
+        name = listing.get(_normalize(path.name))
+        if name is None:
+            name = self._folded(str(path.parent), listing).get(_normalize(path.name).casefold())
+        if name is None:
+            return None
+        return path if name == path.name else path.parent.joinpath(name)
+
+    def _folded(self, dir: str, listing: Dict[str, str]) -> Dict[str, str]:
+        folded = self.folded.get(dir)
+        if folded is None:
+            folded = self.folded.setdefault(dir, {key.casefold(): name for key, name in listing.items()})
+        return folded
+
+    def exists(self, path: Path) -> bool:
+        return self.resolve(path) is not None
+
+    def size(self) -> int:
+        """
+        :return: The number of directories listed so far
+        """
+        return len(self.listings)
@@ -0,0 +1,152 @@
+"""
+Interned string tables shared by every playlist. A big library names the same folders and
+albums over and over, and the same song is often in several playlists, so each distinct
+string is held once and the playlists just keep small integers that refer to it.
+
+Nothing is ever taken out of the tables, the playlists, snapshots and search indexes all
+hold numbers into them and renumbering would mean finding every one. The growth is bounded
+by the distinct paths seen since the player started instead: a string keeps its number, so
+reading a volume again, or a stick that is taken out and put back, adds nothing, and the
+tags and gains of its songs are still known when it comes back. Only songs and folders with
+new paths add to them, a few hundred bytes a song, and the library watcher logs their size
+each time a volume comes or goes.
+"""
+import os
+import threading
+from array import array
+from typing import Dict, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from musiclib.tags import TrackTags
+
+
+class StringTable:
+    """
+    Hands out a small integer for each distinct string, the same string always gets the
+    same number. Strings are never removed, a table only grows as new strings are seen.
+    """
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self.ids: Dict[str, int] = {}
+        # Playlists are parsed on several threads
+        self.lock = threading.Lock()
+
+    def intern(self, s: str) -> int:
+        """
+        :param s: A string
+        :return: The number standing for the string
+        """
+        id = self.ids.get(s)
+        if id is None:
+            with self.lock:
+                id = self.ids.get(s)
+                if id is None:
+                    id = len(self.strings)
+                    self.strings.append(s)
+                    self.ids[s] = id
+        return id
+
+    def intern_all(self, strings: List[str]) -> Optional[array]:
+        """
+        Intern a whole table of strings at once, e.g. one read back from a snapshot
+        :param strings: Distinct strings
+        :return: The number each string got, in the same order, or None if they got the
+        numbers of their positions, which they do when the table starts out empty
+        """
+        with self.lock:
+            if len(self.strings) == 0:
+                self.strings.extend(strings)
+                self.ids.update(zip(strings, range(len(strings))))
+                return None
+        return array('I', (self.intern(s) for s in strings))
+
+    def __getitem__(self, id: int) -> str:
+        return self.strings[id]
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+
+class ItemTable:
+    """
+    The tables a playlist item is split across, the folder holding the song, its file
+    name and its album name
+    """
+
+    def __init__(self):
+        self.dirs = StringTable()
+        self.names = StringTable()
+        self.albums = StringTable()
+        # The tags of the songs that have been read, keyed by the song_key of the canonical copy
+        self.tags: Dict[int, "TrackTags"] = {}
+        # The song_key of each song that is a copy of another, mapped to the key of the copy used
+        # in its place, see dedup.py. Replaced as a whole each time the duplicates are found.
+        self.canonical: Dict[int, int] = {}
+        # The replay gain of the songs that have been analysed, in dB, keyed like the tags
+        self.gains: Dict[int, float] = {}
+
+    def get_info(self) -> str:
+        return f"{len(self.dirs)} folders, {len(self.names)} file names, {len(self.albums)} albums, " \
+               f"{len(self.tags)} tags and {len(self.gains)} gains"
+
+    @staticmethod
+    def song_key(dir_id: int, name_id: int) -> int:
+        return (dir_id << 32) | name_id
+
+    def canonical_key(self, dir_id: int, name_id: int) -> int:
+        """
+        :return: The song_key of the copy of the song that stands for all of its copies
+        """
+        key = ItemTable.song_key(dir_id, name_id)
+        return self.canonical.get(key, key)
+
+    def path_key(self, path: str) -> Optional[int]:
+        """
+        :param path: The path to a song
+        :return: Its song_key, None if the song isn't in the table
+        """
+        dir, name = os.path.split(path)
+        dir_id = self.dirs.ids.get(dir)
+        name_id = self.names.ids.get(name)
+        if dir_id is None or name_id is None:
+            return None
+        return ItemTable.song_key(dir_id, name_id)
+
+    def is_duplicate(self, path: str) -> bool:
+        """
+        :return: True if the song is a copy of another one that stands in for it
+        """
+        return self.path_key(path) in self.canonical
+
+    def set_tags(self, path: str, tags: "TrackTags") -> None:
+        """
+        Record the tags of a song, songs that aren't in the table are ignored
+        :param path: The path to the song
+        :param tags: Its tags
+        :return: Nothing
+        """
+        key = self.path_key(path)
+        if key is not None:
+            self.tags[self.canonical.get(key, key)] = tags
+
+    def get_tags(self, dir_id: int, name_id: int) -> Optional["TrackTags"]:
+        return self.tags.get(self.canonical_key(dir_id, name_id))
+
+    def set_gain(self, path: str, gain: float) -> None:
+        """
+        Record the gain of a song, songs that aren't in the table are ignored
+        :param path: The path to the song
+        :param gain: Its gain in dB
+        :return: Nothing
+        """
+        key = self.path_key(path)
+        if key is not None:
+            self.gains[self.canonical.get(key, key)] = gain
+
+    def get_gain(self, dir_id: int, name_id: int) -> Optional[float]:
+        return self.gains.get(self.canonical_key(dir_id, name_id))
+
+
+# Used by every playlist unless told otherwise
+SHARED_ITEM_TABLE = ItemTable()
@@ -0,0 +1,338 @@
+"""
+A persistent index of the media library, kept in a SQLite database so that a restart
+of the music player does not have to walk every volume and re-parse every playlist.
+
+The index remembers the modification time of every directory on a volume together with
+the playlist and music files found in it. On the next scan a directory is only listed
+again if its mtime changed; playlist files are re-parsed only when their size or mtime
+changed. Everything else is rebuilt from the rows stored in the database.
+"""
+import functools
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from musiclib.dir_cache import DirListingCache
+from musiclib.media_lib import ItemList, LazyPlaylist, MediaLib, MediaLibParsers, Playlist, PlaylistCache
+from musiclib.playlist_formats import format_for
+from musiclib.volume_walker import DirListing, FileRecord, VolumeScan, VolumeWalker, list_dir, \
+    WINDOWS_MEDIA, PLAYLIST_FILES
+
+# Bump this when the layout of the tables changes, an index with a different
+# version is thrown away and rebuilt
+SCHEMA_VERSION = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    volume TEXT NOT NULL,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS dirs_volume ON dirs (volume);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    volume TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS files_volume ON files (volume);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE TABLE IF NOT EXISTS playlists (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    volume TEXT NOT NULL,
+    source TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    title TEXT NOT NULL,
+    source_size INTEGER NOT NULL,
+    source_mtime_ns INTEGER NOT NULL,
+    item_count INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS playlists_volume ON playlists (volume);
+CREATE TABLE IF NOT EXISTS items (
+    playlist_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    src TEXT NOT NULL,
+    album_name TEXT NOT NULL,
+    PRIMARY KEY (playlist_id, position));
+CREATE TABLE IF NOT EXISTS loudness (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    lufs REAL);
+"""
+
+class LibIndex:
+    """
+    Wraps the SQLite database holding the index. Several volumes can be scanned at the
+    same time from different threads; the walking and parsing happen outside the lock
+    and the changes for each volume are written in one short transaction at the end.
+    """
+
+    def __init__(self, db_path: Path):
+        self.logger = logging.getLogger("comms.mqtt")
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._check_schema()
+
+    def _check_schema(self) -> None:
+        """
+        Create the tables, or re-create them if the index was written by an incompatible version
+        :return: Nothing
+        """
+        self.conn.executescript(SCHEMA)
+        row = self.conn.execute("SELECT value FROM meta WHERE key='schema_version'").fetchone()
+        if row is not None and row[0] == str(SCHEMA_VERSION):
+            return
+        if row is not None:
+            self.logger.warning("Library index %s has schema %s, rebuilding it", str(self.db_path), row[0])
+        with self.conn:
+            for table in ("dirs", "files", "playlists", "items"):
+                self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+            self.conn.executescript(SCHEMA)
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)",
+                              (str(SCHEMA_VERSION),))
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+    def lookup_loudness(self) -> Dict[str, Tuple[int, int, Optional[float]]]:
+        """
+        The loudness of the songs analysed so far, see loudness.py. It doesn't depend on the
+        layout of the other tables so it is kept when they are rebuilt.
+        :return: The size and mtime of each file when it was analysed, and its loudness in LUFS,
+        None if it couldn't be decoded
+        """
+        return {path: (size, mtime_ns, lufs) for path, size, mtime_ns, lufs in
+                self._read("SELECT path, size, mtime_ns, lufs FROM loudness", ())}
+
+    def store_loudness(self, rows: List[Tuple[str, int, int, Optional[float]]]) -> None:
+        """
+        :param rows: The path, size, mtime and loudness of files that were analysed
+        :return: Nothing
+        """
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO loudness (path, size, mtime_ns, lufs) VALUES (?, ?, ?, ?)",
+                                  rows)
+
+    def scan_volume(self, volume: Path, medialib: MediaLib, executor: Executor = None,
+                    dir_cache: DirListingCache = None, validate: bool = True,
+                    playlist_cache: PlaylistCache = None) -> MediaLib:
+        """
+        Bring the index up to date for this volume and add its playlists to the media lib.
+        The volume is classified the same way as MediaLibParsers.parse_lib does it.
+        :param volume: The root of the volume
+        :param medialib: The playlists found are added to this collection
+        :param executor: Optional pool used to parse the playlists that changed in parallel
+        :param dir_cache: Used to check the entries of text playlists exist
+        :param validate: Check the entries of text playlists exist
+        :param playlist_cache: If given the playlists that are unchanged are lazy, their items are
+        only read from the index when they are first used. Keep the index open while they are in use.
+        :return: The media lib
+        """
+        updates = _IndexUpdates()
+        scan, changed = self._scan(volume, updates)
+        parse = functools.partial(self._parse, dir_cache=dir_cache, validate=validate)
+        # Without validation a text playlist only depends on its own file
+        playlists = self._update_playlists(scan, changed and validate, updates, parse, executor, playlist_cache)
+        with self.lock, self.conn:
+            updates.apply(self.conn, str(volume))
+        if len(playlists) > 0:
+            medialib.add_playlists(playlists)
+        return medialib
+
+    def _read(self, sql: str, parameters: tuple) -> List[tuple]:
+        with self.lock:
+            return self.conn.execute(sql, parameters).fetchall()
+
+    def _scan(self, volume: Path, updates: "_IndexUpdates") -> Tuple[VolumeScan, bool]:
+        """
+        Walk the volume, listing only the directories whose mtime differs from the one
+        recorded in the index
+        :param volume: The root of the volume
+        :param updates: Collects the changes to write back to the index
+        :return: What the walker found and whether any directory it looked at had changed
+        """
+        vol = str(volume)
+        known_dirs: Dict[str, int] = {}
+        children: Dict[str, List[str]] = {}
+        for path, parent, mtime_ns in self._read("SELECT path, parent, mtime_ns FROM dirs WHERE volume=?", (vol,)):
+            known_dirs[path] = mtime_ns
+            children.setdefault(parent, []).append(path)
+        known_files: Dict[str, List[FileRecord]] = {}
+        for path, dir, size, mtime_ns in self._read(
+                "SELECT path, dir, size, mtime_ns FROM files WHERE volume=?", (vol,)):
+            known_files.setdefault(dir, []).append(FileRecord(path=path, dir=dir, size=size, mtime_ns=mtime_ns))
+
+        changed = False
+
+        def cached_list_dir(path: str) -> Optional[DirListing]:
+            nonlocal changed
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                return None
+            if known_dirs.get(path) == mtime_ns:
+                return DirListing(subdirs=children.get(path, []), files=known_files.get(path, []))
+            changed = True
+            listing = list_dir(path, with_stat=True)
+            if listing is None:
+                return None
+            updates.dirs.append((path, os.path.dirname(path), mtime_ns, listing.files))
+            # Forget about sub-directories that have gone away, and everything below them
+            current = set(listing.subdirs)
+            updates.forgotten_dirs.extend(subdir for subdir in children.get(path, []) if subdir not in current)
+            return listing
+
+        scan = VolumeWalker(cached_list_dir).scan(volume)
+        return scan, changed
+
+    def _update_playlists(self, scan: VolumeScan, changed: bool, updates: "_IndexUpdates",
+                          parse: Callable[[VolumeScan, str], Playlist], executor: Executor = None,
+                          playlist_cache: PlaylistCache = None) -> List[Playlist]:
+        """
+        Work out which playlists the volume holds, re-parse the ones that changed and load
+        the rest from the index
+        :param scan: The result of walking the volume
+        :param changed: True if the walk found directories that changed since the last time
+        :param updates: Collects the changes to write back to the index
+        :param parse: Parses a playlist that is not in the index or has changed
+        :param executor: Optional pool used to parse the playlists in parallel
+        :param playlist_cache: Make lazy playlists for the ones re-used from the index
+        :return: The playlists on the volume
+        """
+        volume = scan.volume
+        vol = str(volume)
+        # Each entry is the source of the playlist, its size and mtime and whether it must be re-parsed
+        sources: List[Tuple[str, int, int, bool]] = []
+        if scan.kind == WINDOWS_MEDIA:
+            for f in scan.wpl_files:
+                size, mtime_ns = self._stat(f)
+                sources.append((f.path, size, mtime_ns, False))
+        elif scan.kind == PLAYLIST_FILES:
+            for f in scan.playlist_files:
+                size, mtime_ns = self._stat(f)
+                # Most formats drop entries that don't exist, so these
+                # depend on the rest of the volume too
+                sources.append((f.path, size, mtime_ns, changed and format_for(Path(f.path)).validate))
+        else:
+            # The single playlist has no file of its own, the volume stands in for it
+            sources.append((vol, 0, 0, changed))
+
+        cached: Dict[str, Tuple[int, int, int, str, str, int]] = {}
+        for id, source, size, mtime_ns, kind, title, item_count in self._read(
+                "SELECT id, source, source_size, source_mtime_ns, kind, title, item_count FROM playlists "
+                "WHERE volume=?", (vol,)):
+            cached[source] = (id, size, mtime_ns, kind, title, item_count)
+
+        def load_or_parse(source: str, size: int, mtime_ns: int, stale: bool) -> Tuple[Playlist, Optional[int]]:
+            entry = cached.get(source)
+            if entry is not None and entry[1] == size and entry[2] == mtime_ns and not stale:
+                id, _, _, kind, title, item_count = entry
+                pl_source = None if source == vol else Path(source)
+                if playlist_cache is not None:
+                    return LazyPlaylist(volume=volume, kind=kind, title=title, source=pl_source, count=item_count,
+                                        loader=functools.partial(self.load_items, id), cache=playlist_cache), id
+                return Playlist(volume=volume, kind=kind, title=title, items=self.load_items(id), source=pl_source), id
+            return parse(scan, source), None
+
+        if executor is not None:
+            results = list(executor.map(lambda s: load_or_parse(*s), sources))
+        else:
+            results = [load_or_parse(*s) for s in sources]
+
+        # Everything not re-used is replaced by the freshly parsed playlists
+        reused = {id for _, id in results if id is not None}
+        updates.deleted_playlists.extend(entry[0] for entry in cached.values() if entry[0] not in reused)
+        for position, ((source, size, mtime_ns, _), (playlist, id)) in enumerate(zip(sources, results)):
+            if id is None:
+                updates.new_playlists.append((source, position, size, mtime_ns, playlist))
+            else:
+                updates.positions.append((position, id))
+        self.logger.info("Index for %s: %d playlists, %d of them re-parsed", vol, len(results),
+                         len(updates.new_playlists))
+        return [playlist for playlist, _ in results]
+
+    def load_items(self, playlist_id: int) -> ItemList:
+        """
+        :param playlist_id: The id of the playlist in the index
+        :return: The items of the playlist, in order
+        """
+        items = ItemList()
+        for src, album_name in self._read(
+                "SELECT src, album_name FROM items WHERE playlist_id=? ORDER BY position", (playlist_id,)):
+            items.add(src, album_name)
+        return items
+
+    @staticmethod
+    def _stat(f: FileRecord) -> Tuple[int, int]:
+        """
+        Playlist files can be edited in place, which does not change the mtime of
+        their directory, so always look at them afresh
+        :param f: A playlist file
+        :return: The current size and mtime
+        """
+        try:
+            st = os.stat(f.path)
+            return st.st_size, st.st_mtime_ns
+        except OSError:
+            return f.size, f.mtime_ns
+
+    @staticmethod
+    def _parse(scan: VolumeScan, source: str, dir_cache: DirListingCache = None, validate: bool = True) -> Playlist:
+        if scan.kind == WINDOWS_MEDIA or scan.kind == PLAYLIST_FILES:
+            return MediaLibParsers.parse_playlist_file(scan.volume, Path(source), dir_cache, validate)
+        else:
+            return MediaLibParsers.make_single_playlist(scan.volume, [Path(f.path) for f in scan.music_files])
+
+
+@dataclass
+class _IndexUpdates():
+    """
+    The changes found while scanning one volume, held back so they can all be
+    written in one transaction
+    """
+    # Directories that were listed again: path, parent, mtime and the files found in it
+    dirs: List[Tuple[str, str, int, List[FileRecord]]] = field(default_factory=list)
+    # Directories that have gone away, along with everything below them
+    forgotten_dirs: List[str] = field(default_factory=list)
+    # Playlists that were parsed: source, position, size, mtime and the playlist
+    new_playlists: List[Tuple[str, int, int, int, Playlist]] = field(default_factory=list)
+    # The new positions of the playlists that were re-used from the index
+    positions: List[Tuple[int, int]] = field(default_factory=list)
+    # Playlist ids to remove
+    deleted_playlists: List[int] = field(default_factory=list)
+
+    def apply(self, conn: sqlite3.Connection, vol: str) -> None:
+        for path in self.forgotten_dirs:
+            prefix = path + os.sep
+            conn.execute("DELETE FROM dirs WHERE path=? OR substr(path, 1, ?)=?", (path, len(prefix), prefix))
+            conn.execute("DELETE FROM files WHERE dir=? OR substr(dir, 1, ?)=?", (path, len(prefix), prefix))
+        for path, parent, mtime_ns, files in self.dirs:
+            conn.execute("INSERT OR REPLACE INTO dirs (path, volume, parent, mtime_ns) VALUES (?, ?, ?, ?)",
+                         (path, vol, parent, mtime_ns))
+            conn.execute("DELETE FROM files WHERE dir=?", (path,))
+            conn.executemany("INSERT INTO files (path, dir, volume, size, mtime_ns) VALUES (?, ?, ?, ?, ?)",
+                             [(f.path, f.dir, vol, f.size, f.mtime_ns) for f in files])
+        for id in self.deleted_playlists:
+            conn.execute("DELETE FROM items WHERE playlist_id=?", (id,))
+            conn.execute("DELETE FROM playlists WHERE id=?", (id,))
+        conn.executemany("UPDATE playlists SET position=? WHERE id=?", self.positions)
+        for source, position, size, mtime_ns, playlist in self.new_playlists:
+            cursor = conn.execute(
+                "INSERT INTO playlists (volume, source, position, kind, title, source_size, source_mtime_ns, "
+                "item_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (vol, source, position, playlist.kind, playlist.title, size, mtime_ns, len(playlist.items)))
+            id = cursor.lastrowid
+            conn.executemany("INSERT INTO items (playlist_id, position, src, album_name) VALUES (?, ?, ?, ?)",
+                             [(id, i, src, album_name) for i, (src, album_name) in enumerate(playlist.items.entries())])
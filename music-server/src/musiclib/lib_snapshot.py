@@ -0,0 +1,348 @@
+"""
+A snapshot of the whole media lib in one compact binary file, so a restart can have the
+player going before anything has been walked or parsed. The string tables are written as
+one block each and the items of each playlist as the three arrays of numbers they already
+are in memory, so loading is a handful of big reads and no per song Python objects.
+
+Each volume is saved with a fingerprint, the mtime of its root and of the folders holding
+its playlists and the size and mtime of each playlist file. On loading, a volume is only
+taken from the snapshot if its fingerprint still matches, the others are scanned as usual.
+A fingerprint can't see a song added deep inside an album folder, so the volumes taken from
+the snapshot are scanned again in the background and their playlists swapped for the new
+ones if they differ, while the player is already taking commands.
+"""
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from musiclib.item_table import ItemTable, SHARED_ITEM_TABLE, StringTable
+from musiclib.media_lib import ItemList, LazyPlaylist, MediaLib, Playlist
+
+SNAPSHOT_MAGIC = b"MLSNAP\0\0"
+# Bump this when the layout of the file changes, a snapshot with a different version is ignored
+SNAPSHOT_VERSION = 1
+
+HEADER = struct.Struct("<8sHI")
+COUNT = struct.Struct("<I")
+STRINGS = struct.Struct("<II")
+FILE_STAMP = struct.Struct("<qq")
+
+# Paths can hold bytes that aren't UTF-8, Python keeps them as surrogates
+ENCODING = 'utf-8'
+ERRORS = 'surrogateescape'
+
+
+@dataclass
+class VolumeFingerprint():
+    volume: Path
+    # The path, size and mtime of the volume root, the folders holding playlists and the playlist files
+    stamps: List[Tuple[str, int, int]] = field(default_factory=list)
+
+    @staticmethod
+    def take(volume: Path, playlists: List[Playlist]) -> "VolumeFingerprint":
+        """
+        :param volume: The root of a volume
+        :param playlists: The playlists read from it
+        :return: The fingerprint of the volume as it is now
+        """
+        paths = [str(volume)]
+        for playlist in playlists:
+            if playlist.source is not None:
+                folder = str(playlist.source.parent)
+                if folder not in paths:
+                    paths.append(folder)
+                paths.append(str(playlist.source))
+        fingerprint = VolumeFingerprint(volume=volume)
+        for path in paths:
+            stamp = VolumeFingerprint._stat(path)
+            if stamp is None:
+                return VolumeFingerprint(volume=volume, stamps=[])
+            fingerprint.stamps.append((path,) + stamp)
+        return fingerprint
+
+    @staticmethod
+    def _stat(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        # The size of a folder means nothing, only its mtime is compared
+        return (0 if os.path.isdir(path) else st.st_size), st.st_mtime_ns
+
+    def is_current(self) -> bool:
+        """
+        :return: True if nothing in the fingerprint has changed since it was taken
+        """
+        return len(self.stamps) > 0 and \
+            all(self._stat(path) == (size, mtime_ns) for path, size, mtime_ns in self.stamps)
+
+
+class _Writer:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def pack(self, fmt: struct.Struct, *values) -> None:
+        self.buffer += fmt.pack(*values)
+
+    def string(self, s: str) -> None:
+        data = s.encode(ENCODING, ERRORS)
+        self.pack(COUNT, len(data))
+        self.buffer += data
+
+    def strings(self, table: StringTable) -> None:
+        # A NUL can't be in a path or a name, so the table is written as one NUL separated block
+        data = "\0".join(table.strings).encode(ENCODING, ERRORS)
+        self.pack(STRINGS, len(table.strings), len(data))
+        self.buffer += data
+
+    def numbers(self, numbers: array) -> None:
+        if sys.byteorder == 'big':
+            numbers = array('I', numbers)
+            numbers.byteswap()
+        self.buffer += numbers.tobytes()
+
+
+class _Reader:
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def unpack(self, fmt: struct.Struct) -> tuple:
+        values = fmt.unpack_from(self.data, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def _bytes(self, length: int) -> bytes:
+        data = self.data[self.offset:self.offset + length]
+        if len(data) != length:
+            raise ValueError("Snapshot is truncated")
+        self.offset += length
+        return bytes(data)
+
+    def string(self) -> str:
+        length, = self.unpack(COUNT)
+        return self._bytes(length).decode(ENCODING, ERRORS)
+
+    def strings(self) -> List[str]:
+        count, length = self.unpack(STRINGS)
+        if count == 0:
+            return []
+        strings = self._bytes(length).decode(ENCODING, ERRORS).split("\0")
+        if len(strings) != count:
+            raise ValueError("Snapshot string table is damaged")
+        return strings
+
+    def numbers(self, count: int) -> array:
+        numbers = array('I')
+        numbers.frombytes(self._bytes(count * numbers.itemsize))
+        if sys.byteorder == 'big':
+            numbers.byteswap()
+        return numbers
+
+
+@dataclass
+class SnapshotVolume():
+    fingerprint: VolumeFingerprint
+    playlists: List[Playlist]
+
+
+class LibSnapshot:
+    """
+    Reads and writes the snapshot file
+    """
+
+    def __init__(self, path: Path, table: ItemTable = SHARED_ITEM_TABLE):
+        """
+        :param path: The snapshot file
+        :param table: The item table the playlists use
+        """
+        self.logger = logging.getLogger("comms.mqtt")
+        self.path = path
+        self.table = table
+        self.lock = threading.Lock()
+
+    def save(self, media_lib: MediaLib) -> int:
+        """
+        Write the media lib to the snapshot file. Volumes with lazy playlists that aren't loaded
+        are left out, they are scanned on the next start.
+        :param media_lib: The library
+        :return: The number of volumes written
+        """
+        volumes: Dict[Path, List[Playlist]] = {}
+        for playlist in media_lib.playlists:
+            volumes.setdefault(playlist.volume, []).append(playlist)
+        whole = {volume: playlists for volume, playlists in volumes.items()
+                 if all(not (isinstance(p, LazyPlaylist) and not p.is_loaded()) and p.items.table is self.table
+                        for p in playlists)}
+        writer = _Writer()
+        writer.pack(HEADER, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(whole))
+        # The tables only grow, so these hold every string the playlists refer to
+        for strings in (self.table.dirs, self.table.names, self.table.albums):
+            writer.strings(strings)
+        for volume, playlists in whole.items():
+            fingerprint = VolumeFingerprint.take(volume, playlists)
+            writer.string(str(volume))
+            writer.pack(COUNT, len(fingerprint.stamps))
+            for path, size, mtime_ns in fingerprint.stamps:
+                writer.string(path)
+                writer.pack(FILE_STAMP, size, mtime_ns)
+            writer.pack(COUNT, len(playlists))
+            for playlist in playlists:
+                items = playlist.items
+                writer.string(playlist.kind)
+                writer.string(playlist.title or "")
+                writer.string(str(playlist.source) if playlist.source is not None else "")
+                writer.pack(COUNT, len(items))
+                for numbers in (items.dirs, items.names, items.albums):
+                    writer.numbers(numbers)
+        with self.lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Written aside and moved over so a crash never leaves half a snapshot
+            temp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(temp_path, 'wb') as f:
+                f.write(writer.buffer)
+            os.replace(temp_path, self.path)
+        self.logger.info("Library snapshot of %d volumes, %d bytes written to %s", len(whole), len(writer.buffer),
+                         str(self.path))
+        return len(whole)
+
+    def load(self) -> Dict[Path, SnapshotVolume]:
+        """
+        Read the snapshot, the strings go into the item table as they are read
+        :return: The playlists of each volume in the snapshot, with its fingerprint. Empty if
+        there is no snapshot or it can't be used.
+        """
+        try:
+            with self.lock, open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return {}
+        try:
+            return self._read(_Reader(data))
+        except (ValueError, struct.error, UnicodeDecodeError) as e:
+            self.logger.warning("Library snapshot %s can't be read, ignoring it: %s", str(self.path), str(e))
+            return {}
+
+    def _read(self, reader: _Reader) -> Dict[Path, SnapshotVolume]:
+        magic, version, volume_count = reader.unpack(HEADER)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            self.logger.warning("Library snapshot %s has version %d, ignoring it", str(self.path), version)
+            return {}
+        # How the numbers in the file map to the numbers in the table, None if they are the same
+        mappings = [table.intern_all(reader.strings())
+                    for table in (self.table.dirs, self.table.names, self.table.albums)]
+        volumes: Dict[Path, SnapshotVolume] = {}
+        for _ in range(volume_count):
+            volume = Path(reader.string())
+            fingerprint = VolumeFingerprint(volume=volume)
+            stamp_count, = reader.unpack(COUNT)
+            for _ in range(stamp_count):
+                path = reader.string()
+                fingerprint.stamps.append((path,) + reader.unpack(FILE_STAMP))
+            playlists: List[Playlist] = []
+            playlist_count, = reader.unpack(COUNT)
+            for _ in range(playlist_count):
+                kind = reader.string()
+                title = reader.string()
+                source = reader.string()
+                item_count, = reader.unpack(COUNT)
+                items = ItemList(table=self.table)
+                columns = []
+                for mapping in mappings:
+                    numbers = reader.numbers(item_count)
+                    columns.append(numbers if mapping is None else array('I', (mapping[n] for n in numbers)))
+                items.dirs, items.names, items.albums = columns
+                playlists.append(Playlist(volume=volume, kind=kind, title=title, items=items,
+                                          source=Path(source) if source else None))
+            volumes[volume] = SnapshotVolume(fingerprint=fingerprint, playlists=playlists)
+        return volumes
+
+
+def warm_start(volumes: List[Path], snapshot: LibSnapshot,
+               scan: Callable[[List[Path]], MediaLib]) -> Tuple[MediaLib, List[Path]]:
+    """
+    Make the media lib from the snapshot, scanning only the volumes it doesn't hold or that
+    have changed since it was written
+    :param volumes: The volumes, the playlists are in this order as they are from parse_lib
+    :param snapshot: The snapshot
+    :param scan: Scans volumes the usual way, e.g. with MediaLibParsers.parse_lib
+    :return: The media lib and the volumes taken from the snapshot, which want verifying
+    """
+    logger = logging.getLogger("comms.mqtt")
+    start = time.time()
+    saved = snapshot.load()
+    from_snapshot = [volume for volume in volumes if volume in saved and saved[volume].fingerprint.is_current()]
+    logger.info("Library snapshot read in %.2f seconds, %d of %d volumes unchanged", time.time() - start,
+                len(from_snapshot), len(volumes))
+    to_scan = [volume for volume in volumes if volume not in from_snapshot]
+    scanned = scan(to_scan) if len(to_scan) > 0 else MediaLib(playlists=[])
+    playlists: List[Playlist] = []
+    for volume in volumes:
+        if volume in from_snapshot:
+            playlists.extend(saved[volume].playlists)
+        else:
+            playlists.extend(scanned.get_volume_playlists(volume))
+    return MediaLib(playlists=playlists), from_snapshot
+
+
+class SnapshotVerifier:
+    """
+    Scans the volumes that came from the snapshot again in the background, updates the
+    playlists of any that changed in ways the fingerprint couldn't see, then writes a new
+    snapshot
+    """
+
+    def __init__(self, media_lib: MediaLib, snapshot: LibSnapshot, volumes: List[Path],
+                 scan: Callable[[List[Path]], MediaLib], run_change: Callable[[Callable[[], None]], None] = None):
+        """
+        :param media_lib: The library to keep up to date
+        :param snapshot: Written once the library is known to be right
+        :param volumes: The volumes to scan again, none to just write the snapshot
+        :param scan: Scans volumes the usual way
+        :param run_change: Swaps in the playlists of a volume, on the player's thread so it
+        never sees the library half changed, and returns once it is done. Done here if not given.
+        """
+        self.logger = logging.getLogger("comms.mqtt")
+        self.media_lib = media_lib
+        self.snapshot = snapshot
+        self.volumes = volumes
+        self.scan = scan
+        self.run_change = run_change if run_change is not None else lambda change: change()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self._run, name="snapshot-verifier", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        try:
+            self.verify()
+        except Exception as e:
+            self.logger.error("Problem verifying the library snapshot %s", str(e))
+
+    def verify(self) -> int:
+        """
+        :return: The number of volumes that had changed
+        """
+        changed = 0
+        if len(self.volumes) > 0:
+            fresh = self.scan(self.volumes)
+            for volume in self.volumes:
+                playlists = fresh.get_volume_playlists(volume)
+                if self._contents(playlists) != self._contents(self.media_lib.get_volume_playlists(volume)):
+                    self.logger.info("Volume %s changed since the snapshot, updating it", str(volume))
+                    self.run_change(lambda: self.media_lib.update_volume(volume, playlists))
+                    changed += 1
+        self.snapshot.save(self.media_lib)
+        return changed
+
+    @staticmethod
+    def _contents(playlists: List[Playlist]) -> List[tuple]:
+        return [(p.kind, p.title, p.source, list(p.items.entries())) for p in playlists]
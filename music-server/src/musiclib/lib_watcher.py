@@ -0,0 +1,538 @@
+"""
+Watches the volumes for changes and updates the media lib while the music player is running,
+so a new USB stick or an edited playlist doesn't need a restart and a full rescan.
+
+On Linux the kernel's inotify interface is used through ctypes, elsewhere, or if inotify
+can't be set up, the volumes are polled. Changes are collected until things have been quiet
+for a moment, a USB stick being mounted or an album being copied produces a burst of events,
+and then applied to the media lib:
+
+* A folder appearing under the mounts root (/media/pi on the Raspberry PI) is a new volume, its
+  playlists are added at the end of the library. A folder disappearing removes its playlists.
+* A WPL or text playlist being added, changed or removed is parsed again or removed on its own.
+* Music files added or removed update the "All Items" playlist of volumes that don't have
+  playlists, or re-check the text playlists of the volume.
+
+Playlists that change are updated in place so the player's reference to the active playlist
+stays valid and the song that is playing is not interrupted. The files are read here, but the
+changes to the playlists are handed to the player to make on its own thread.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from musiclib.dir_cache import DirListingCache
+from musiclib.item_table import SHARED_ITEM_TABLE
+from musiclib.media_lib import ItemList, MediaLib, MediaLibParsers, Playlist
+from musiclib.playlist_formats import WPL_SUFFIX, format_for, is_playlist
+from musiclib.volume_walker import DirListing, FileRecord, MUSIC_SUFFIXES, is_skipped_dir, list_dir
+
+CREATED = "created"
+DELETED = "deleted"
+MODIFIED = "modified"
+# Events were lost, everything needs looking at again
+RESCAN = "rescan"
+
+# How long things must be quiet before a batch of changes is applied
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_POLL_SECONDS = 30.0
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+
+@dataclass
+class FsEvent():
+    # One of CREATED, DELETED, MODIFIED or RESCAN
+    kind: str
+    # The file or folder the event is about
+    path: str
+    is_dir: bool = False
+
+
+class InotifyBackend:
+    """
+    Reports changes using inotify. Every folder of a volume needs its own watch, new
+    folders are watched as they appear and the files already in them are reported.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("comms.mqtt")
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.libc.inotify_init1.argtypes = [ctypes.c_int]
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # Maps each watch descriptor to its folder, and the folders whose new sub-folders are watched too
+        self.wds: Dict[int, str] = {}
+        self.recursive: Set[str] = set()
+        self.out_of_watches = False
+
+    @staticmethod
+    def available() -> bool:
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6')
+            return hasattr(libc, 'inotify_init1')
+        except OSError:
+            return False
+
+    def _add_watch(self, path: str) -> bool:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC and not self.out_of_watches:
+                self.out_of_watches = True
+                self.logger.warning("Out of inotify watches, raise fs.inotify.max_user_watches. "
+                                    "Changes under %s will be missed", path)
+            return False
+        self.wds[wd] = path
+        return True
+
+    def watch_dir(self, path: str) -> None:
+        """
+        Watch a single folder, its sub-folders are not watched
+        """
+        self._add_watch(path)
+
+    def watch_tree(self, root: str, report: bool = False) -> List[FsEvent]:
+        """
+        Watch a folder and everything below it
+        :param root: The folder
+        :param report: Report the files and folders found as created
+        :return: The created events if asked for
+        """
+        events: List[FsEvent] = []
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            listing = list_dir(path)
+            if listing is None or not self._add_watch(path):
+                continue
+            self.recursive.add(path)
+            if report:
+                events.extend(FsEvent(kind=CREATED, path=f.path) for f in listing.files)
+                events.extend(FsEvent(kind=CREATED, path=d, is_dir=True) for d in listing.subdirs)
+            stack.extend(listing.subdirs)
+        return events
+
+    def unwatch(self, root: str) -> None:
+        prefix = root + os.sep
+        for wd, path in list(self.wds.items()):
+            if path == root or path.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                self.wds.pop(wd, None)
+                self.recursive.discard(path)
+
+    def read(self, timeout: float) -> List[FsEvent]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events: List[FsEvent] = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0'))
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                events.append(FsEvent(kind=RESCAN, path=""))
+                continue
+            if mask & IN_IGNORED:
+                path = self.wds.pop(wd, None)
+                self.recursive.discard(path)
+                continue
+            dir = self.wds.get(wd)
+            if dir is None:
+                continue
+            path = os.path.join(dir, name) if name else dir
+            is_dir = bool(mask & IN_ISDIR)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                events.append(FsEvent(kind=CREATED, path=path, is_dir=is_dir))
+                # Files can land in a new folder before it is watched, report what is already there
+                if is_dir and dir in self.recursive and not is_skipped_dir(name):
+                    events.extend(self.watch_tree(path, report=True))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                events.append(FsEvent(kind=DELETED, path=path, is_dir=is_dir))
+            elif mask & IN_CLOSE_WRITE:
+                events.append(FsEvent(kind=MODIFIED, path=path))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingBackend:
+    """
+    Reports changes by looking at the volumes every so often. Only the folders whose
+    mtime changed are listed again, the playlist files are looked at every time since
+    editing one in place doesn't change the mtime of its folder.
+    """
+
+    def __init__(self, poll_seconds: float = DEFAULT_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self.next_poll = time.monotonic() + poll_seconds
+        # For each watched tree, the mtime and listing of every folder in it
+        self.trees: Dict[str, Dict[str, Tuple[int, DirListing]]] = {}
+        # The folders watched on their own, with the names of their sub-folders
+        self.dirs: Dict[str, Set[str]] = {}
+
+    def watch_dir(self, path: str) -> None:
+        self.dirs[path] = self._subdirs(path)
+
+    def watch_tree(self, root: str, report: bool = False) -> List[FsEvent]:
+        self.trees[root] = self._snapshot(root, {})
+        return []
+
+    def unwatch(self, root: str) -> None:
+        self.trees.pop(root, None)
+        self.dirs.pop(root, None)
+
+    def read(self, timeout: float) -> List[FsEvent]:
+        wait = self.next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(0.0, wait))
+        self.next_poll = time.monotonic() + self.poll_seconds
+        events: List[FsEvent] = []
+        for path, old in list(self.dirs.items()):
+            new = self._subdirs(path)
+            events.extend(FsEvent(kind=CREATED, path=os.path.join(path, name), is_dir=True) for name in new - old)
+            events.extend(FsEvent(kind=DELETED, path=os.path.join(path, name), is_dir=True) for name in old - new)
+            self.dirs[path] = new
+        for root, old in list(self.trees.items()):
+            new = self._snapshot(root, old)
+            events.extend(self._diff(old, new))
+            self.trees[root] = new
+        return events
+
+    def close(self) -> None:
+        pass
+
+    @staticmethod
+    def _subdirs(path: str) -> Set[str]:
+        try:
+            return {entry.name for entry in os.scandir(path) if entry.is_dir(follow_symlinks=False)}
+        except OSError:
+            return set()
+
+    @staticmethod
+    def _snapshot(root: str, old: Dict[str, Tuple[int, DirListing]]) -> Dict[str, Tuple[int, DirListing]]:
+        new: Dict[str, Tuple[int, DirListing]] = {}
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            previous = old.get(path)
+            if previous is not None and previous[0] == mtime_ns:
+                listing = previous[1]
+            else:
+                listing = list_dir(path, with_stat=True)
+                if listing is None:
+                    continue
+            new[path] = (mtime_ns, listing)
+            stack.extend(listing.subdirs)
+        return new
+
+    @staticmethod
+    def _diff(old: Dict[str, Tuple[int, DirListing]], new: Dict[str, Tuple[int, DirListing]]) -> List[FsEvent]:
+        events: List[FsEvent] = []
+        old_files: Dict[str, FileRecord] = {f.path: f for _, listing in old.values() for f in listing.files}
+        new_files: Dict[str, FileRecord] = {f.path: f for _, listing in new.values() for f in listing.files}
+        events.extend(FsEvent(kind=CREATED, path=d, is_dir=True) for d in new if d not in old)
+        events.extend(FsEvent(kind=DELETED, path=d, is_dir=True) for d in old if d not in new)
+        events.extend(FsEvent(kind=CREATED, path=path) for path in new_files if path not in old_files)
+        events.extend(FsEvent(kind=DELETED, path=path) for path in old_files if path not in new_files)
+        for path, f in new_files.items():
+            if path in old_files and is_playlist(path):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if st.st_size != f.size or st.st_mtime_ns != f.mtime_ns:
+                    f.size, f.mtime_ns = st.st_size, st.st_mtime_ns
+                    events.append(FsEvent(kind=MODIFIED, path=path))
+        return events
+
+
+@dataclass
+class _VolumeChanges():
+    playlists_changed: Set[Path] = field(default_factory=set)
+    playlists_deleted: Set[Path] = field(default_factory=set)
+    music_added: Set[Path] = field(default_factory=set)
+    music_deleted: Set[Path] = field(default_factory=set)
+    # Something happened that is easier to deal with by scanning the volume again
+    rescan: bool = False
+
+
+class LibWatcher:
+    """
+    Runs a thread that watches the volumes and keeps the media lib up to date
+    """
+
+    def __init__(self, media_lib: MediaLib, volumes: List[Path], mounts_root: Path = None, validate: bool = True,
+                 poll_seconds: float = None, settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+                 on_items_removed: Callable[[Playlist, List[int]], None] = None,
+                 run_change: Callable[[Callable[[], None]], None] = None):
+        """
+        :param media_lib: The library to keep up to date
+        :param volumes: The volumes the library was built from
+        :param mounts_root: Where USB drives are mounted, new volumes are looked for here
+        :param validate: Check the entries of text playlists exist, as parse_lib does
+        :param poll_seconds: Poll this often instead of using inotify
+        :param settle_seconds: How long things must be quiet before the changes are applied
+        :param on_items_removed: Told which positions of a playlist were removed, so the
+        player can keep track of where it is
+        :param run_change: Makes each change to the playlists, on the player's thread so it never
+        sees a playlist half changed, and returns once it is made. Made here if not given.
+        """
+        self.logger = logging.getLogger("comms.mqtt")
+        self.media_lib = media_lib
+        self.volumes: List[Path] = list(volumes)
+        self.mounts_root = mounts_root
+        self.validate = validate
+        self.poll_seconds = poll_seconds
+        self.settle_seconds = settle_seconds
+        self.on_items_removed = on_items_removed
+        self.run_change = run_change if run_change is not None else lambda change: change()
+        self.backend = None
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.poll_seconds is None and InotifyBackend.available():
+            try:
+                self.backend = InotifyBackend()
+            except OSError as e:
+                self.logger.warning("Could not use inotify, polling instead %s", str(e))
+        if self.backend is None:
+            self.backend = PollingBackend(self.poll_seconds or DEFAULT_POLL_SECONDS)
+        if self.mounts_root is not None:
+            self.backend.watch_dir(str(self.mounts_root))
+        for volume in self.volumes:
+            self.backend.watch_tree(str(volume))
+        self.logger.info("Watching %d volumes for changes using %s", len(self.volumes), type(self.backend).__name__)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="lib-watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        if self.backend is not None:
+            self.backend.close()
+
+    def _run(self) -> None:
+        pending: List[FsEvent] = []
+        last_event = 0.0
+        while self.running:
+            try:
+                events = self.backend.read(0.5)
+                if len(events) > 0:
+                    pending.extend(events)
+                    last_event = time.monotonic()
+                elif len(pending) > 0 and time.monotonic() - last_event >= self.settle_seconds:
+                    batch, pending = pending, []
+                    self.apply(batch)
+            except Exception as e:
+                self.logger.error("Problem updating the media library %s", str(e))
+
+    def _volume_of(self, path: Path) -> Optional[Path]:
+        for volume in sorted(self.volumes, key=lambda v: len(v.parts), reverse=True):
+            if path == volume or volume in path.parents:
+                return volume
+        return None
+
+    def apply(self, events: List[FsEvent]) -> None:
+        """
+        Apply a batch of changes to the media lib
+        :param events: What changed
+        :return: Nothing
+        """
+        added_volumes: List[Path] = []
+        removed_volumes: Set[Path] = set()
+        changes: Dict[Path, _VolumeChanges] = {}
+        for event in events:
+            if event.kind == RESCAN:
+                for volume in self.volumes:
+                    changes.setdefault(volume, _VolumeChanges()).rescan = True
+                continue
+            path = Path(event.path)
+            if self.mounts_root is not None and path.parent == self.mounts_root:
+                if event.is_dir and event.kind == CREATED and path not in added_volumes:
+                    added_volumes.append(path)
+                elif event.is_dir and event.kind == DELETED:
+                    removed_volumes.add(path)
+                continue
+            volume = self._volume_of(path)
+            if volume is None:
+                continue
+            change = changes.setdefault(volume, _VolumeChanges())
+            name = path.name
+            if event.is_dir:
+                # A folder moved away takes its files with it without reporting them
+                if event.kind == DELETED:
+                    change.rescan = True
+            elif is_playlist(name):
+                if event.kind == DELETED:
+                    change.playlists_deleted.add(path)
+                    change.playlists_changed.discard(path)
+                else:
+                    change.playlists_changed.add(path)
+                    change.playlists_deleted.discard(path)
+            elif name.endswith(MUSIC_SUFFIXES) and not name.startswith('.'):
+                if event.kind == DELETED:
+                    change.music_deleted.add(path)
+                    change.music_added.discard(path)
+                elif event.kind == CREATED:
+                    change.music_added.add(path)
+                    change.music_deleted.discard(path)
+
+        for volume in removed_volumes:
+            if volume in self.volumes:
+                self.logger.info("Volume %s has gone, removing its playlists", str(volume))
+                self.volumes.remove(volume)
+                self.backend.unwatch(str(volume))
+                self.run_change(lambda: self.media_lib.replace_volume(volume, []))
+                changes.pop(volume, None)
+        for volume in added_volumes:
+            if volume.is_dir() and volume not in self.volumes and volume not in removed_volumes:
+                self.logger.info("New volume %s", str(volume))
+                self.volumes.append(volume)
+                self.backend.watch_tree(str(volume))
+                changes.setdefault(volume, _VolumeChanges()).rescan = True
+
+        for volume, change in changes.items():
+            if change.rescan or self._apply_volume(volume, change):
+                self._rescan(volume)
+        if len(removed_volumes) > 0 or len(added_volumes) > 0:
+            # The strings of the volumes that have gone are kept, they are used again if they come back
+            self.logger.info("The item table holds %s", SHARED_ITEM_TABLE.get_info())
+
+    def _apply_volume(self, volume: Path, change: _VolumeChanges) -> bool:
+        """
+        Apply the changes to the playlists of one volume
+        :return: True if the volume needs scanning again instead
+        """
+        current = self.media_lib.get_volume_playlists(volume)
+        if len(current) == 0:
+            return True
+        playlists_root = volume.joinpath("Playlists")
+
+        def in_playlists_folder(p: Path) -> bool:
+            return p.suffix.lower() == WPL_SUFFIX and p.parent == playlists_root
+
+        if current[0].get_kind() == "Single Playlist":
+            # Any playlist turning up changes what kind of volume this is
+            if len(change.playlists_changed) > 0:
+                return True
+            self._update_single(current[0], change)
+            return False
+
+        # A Windows Media volume only uses the Playlists folder, any other volume uses every playlist file
+        windows_media = all(p.source is not None and in_playlists_folder(p.source) for p in current)
+        if not windows_media and any(in_playlists_folder(p) for p in change.playlists_changed):
+            return True
+        changed = [p for p in change.playlists_changed if not windows_media or in_playlists_folder(p)]
+        dir_cache = DirListingCache()
+        for pl_path in sorted(changed):
+            self._update_playlist(volume, pl_path, dir_cache)
+        for pl_path in change.playlists_deleted:
+            if not windows_media or in_playlists_folder(pl_path):
+                playlist = self.media_lib.find_playlist_by_source(pl_path)
+                if playlist is not None:
+                    self.logger.info("Playlist %s removed", str(pl_path))
+                    self.run_change(lambda: self.media_lib.remove_playlist(playlist))
+        if not windows_media and self.validate and (len(change.music_added) > 0 or len(change.music_deleted) > 0):
+            # Songs that were missing may have turned up, or ones that were there have gone
+            for playlist in self.media_lib.get_volume_playlists(volume):
+                if playlist.source is not None and playlist.source not in changed and \
+                        format_for(playlist.source).validate:
+                    self._update_playlist(volume, playlist.source, dir_cache)
+        return len(self.media_lib.get_volume_playlists(volume)) == 0
+
+    def _update_playlist(self, volume: Path, pl_path: Path, dir_cache: DirListingCache) -> None:
+        """
+        Parse a playlist that is new or changed, an existing playlist is updated in place
+        """
+        if not pl_path.exists():
+            return
+        fresh = MediaLibParsers.parse_playlist_file(volume, pl_path, dir_cache, self.validate)
+        playlist = self.media_lib.find_playlist_by_source(pl_path)
+        if playlist is None:
+            self.logger.info("New playlist %s", fresh.get_title())
+            self.run_change(lambda: self.media_lib.replace_volume(
+                volume, self.media_lib.get_volume_playlists(volume) + [fresh]))
+        else:
+            self.logger.info("Playlist %s changed", fresh.get_title())
+
+            def change() -> None:
+                playlist.title = fresh.title
+                playlist.items = fresh.items
+                self.media_lib.changed()
+            self.run_change(change)
+
+    def _update_single(self, playlist: Playlist, change: _VolumeChanges) -> None:
+        """
+        Removed songs are taken out of the "All Items" playlist, new songs go at the end
+        so the positions of the songs before them don't change
+        """
+        deleted = {str(path) for path in change.music_deleted}
+        items = ItemList()
+        removed: List[int] = []
+        for i, (src, album_name) in enumerate(playlist.items.entries()):
+            if src in deleted:
+                removed.append(i)
+            else:
+                items.add(src, album_name)
+        known = set(src for src, _ in items.entries())
+        added = [path for path in sorted(change.music_added) if str(path) not in known]
+        for path in added:
+            items.add(str(path), path.parent.stem)
+        if len(removed) > 0 or len(added) > 0:
+            self.logger.info("%s: %d songs added, %d removed", str(playlist.volume), len(added), len(removed))
+
+            def change() -> None:
+                playlist.items = items
+                self.media_lib.changed()
+            self.run_change(change)
+            if len(removed) > 0 and self.on_items_removed is not None:
+                self.on_items_removed(playlist, removed)
+
+    def _rescan(self, volume: Path) -> None:
+        """
+        Scan one volume again. Playlists read from the same file as before are updated
+        in place, so the player can keep using them.
+        """
+        self.logger.info("Scanning volume %s again", str(volume))
+        fresh = MediaLibParsers.parse_volume(volume, dir_cache=DirListingCache(), validate=self.validate)
+        self.run_change(lambda: self.media_lib.update_volume(volume, fresh))
@@ -0,0 +1,262 @@
+"""
+Measures how loud each song is, the way ReplayGain 2 does it, so the player can even out
+the volume between songs instead of people having to keep changing it. Each song is decoded
+once, in the background in a pool of processes, and its integrated loudness (ITU-R BS.1770,
+in LUFS) is kept in the library index keyed by path, size and mtime. The gain that brings a
+song to the reference loudness is stored with the items, playing a song costs nothing more.
+
+The loudness is worked out with NumPy a block at a time. The signal is cut into 100 ms
+segments and the K-weighted energy of every segment is found at once from their spectra,
+weighting each frequency by the response of the K filter instead of running the filter
+sample by sample. The 400 ms gating blocks, overlapping by 75%, are sums of four segments.
+"""
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from musiclib.item_table import ItemTable
+from musiclib.lib_index import LibIndex
+from musiclib.media_lib import LazyPlaylist, MediaLib
+
+# ReplayGain 2 brings songs to this loudness
+REFERENCE_LOUDNESS = -18.0
+
+# Limits on the gain, a nearly silent track isn't turned up to full
+MIN_GAIN = -24.0
+MAX_GAIN = 12.0
+
+# Number of processes decoding songs, each one holds a whole decoded song in memory
+DEFAULT_LOUDNESS_WORKERS = 1
+
+# Songs handed to a worker at a time
+LOUDNESS_BATCH_SIZE = 8
+
+SEGMENT_SECONDS = 0.1
+SEGMENTS_PER_BLOCK = 4
+# How many segments are turned into floats and transformed at a time, keeps the memory down
+SEGMENTS_PER_CHUNK = 600
+
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+
+def _biquad_response(b: Tuple[float, float, float], a: Tuple[float, float, float], z: np.ndarray) -> np.ndarray:
+    return (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+
+
+def k_weighting(rate: int, length: int) -> np.ndarray:
+    """
+    The power response of the K filter, a high shelf for the effect of the head followed by
+    a high pass, at the frequencies of the spectrum of a segment. The filters are made for the
+    sample rate so any rate works, not just the 48 kHz of the published coefficients.
+    :param rate: The sample rate
+    :param length: The number of samples in a segment
+    :return: |H(f)|^2 for each frequency given by numpy.fft.rfft
+    """
+    # High shelf, +4 dB above about 1.5 kHz
+    w0 = 2 * math.pi * 1500.0 / rate
+    big_a = 10 ** (4.0 / 40)
+    alpha = math.sin(w0) / (2 * (1 / math.sqrt(2)))
+    cos_w0 = math.cos(w0)
+    shelf_b = (big_a * ((big_a + 1) + (big_a - 1) * cos_w0 + 2 * math.sqrt(big_a) * alpha),
+               -2 * big_a * ((big_a - 1) + (big_a + 1) * cos_w0),
+               big_a * ((big_a + 1) + (big_a - 1) * cos_w0 - 2 * math.sqrt(big_a) * alpha))
+    shelf_a = ((big_a + 1) - (big_a - 1) * cos_w0 + 2 * math.sqrt(big_a) * alpha,
+               2 * ((big_a - 1) - (big_a + 1) * cos_w0),
+               (big_a + 1) - (big_a - 1) * cos_w0 - 2 * math.sqrt(big_a) * alpha)
+    # High pass at 38 Hz
+    w0 = 2 * math.pi * 38.0 / rate
+    alpha = math.sin(w0) / (2 * 0.5)
+    cos_w0 = math.cos(w0)
+    pass_b = ((1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2)
+    pass_a = (1 + alpha, -2 * cos_w0, 1 - alpha)
+
+    z = np.exp(-2j * np.pi * np.fft.rfftfreq(length))
+    response = _biquad_response(shelf_b, shelf_a, z) * _biquad_response(pass_b, pass_a, z)
+    return np.abs(response) ** 2
+
+
+def segment_energies(samples: np.ndarray, rate: int) -> np.ndarray:
+    """
+    The mean square of the K weighted signal in each 100 ms segment. By Parseval's theorem
+    this is the weighted sum of the power spectrum of the segment, so no filtering is done
+    in the time domain.
+    :param samples: Shape (frames, channels), integers or floats in -1 to 1
+    :param rate: The sample rate
+    :return: Shape (segments, channels)
+    """
+    length = int(rate * SEGMENT_SECONDS)
+    weights = k_weighting(rate, length)
+    # Each frequency but the first and, for an even length, the last stands for two in the full spectrum
+    weights[1:(length + 1) // 2] *= 2
+    scale = 1.0 / 32768 if np.issubdtype(samples.dtype, np.integer) else 1.0
+    count = samples.shape[0] // length
+    energies = []
+    for start in range(0, count, SEGMENTS_PER_CHUNK):
+        end = min(count, start + SEGMENTS_PER_CHUNK)
+        chunk = samples[start * length:end * length].astype(np.float32) * scale
+        # Shape (segments, channels, length) so the transform runs along the samples of each segment
+        segments = chunk.reshape(end - start, length, -1).transpose(0, 2, 1)
+        power = np.abs(np.fft.rfft(segments, axis=2)) ** 2
+        energies.append(power @ weights / (length * length))
+    if len(energies) == 0:
+        return np.zeros((0, samples.shape[1] if samples.ndim > 1 else 1))
+    return np.concatenate(energies)
+
+
+def integrated_loudness(energies: np.ndarray) -> Optional[float]:
+    """
+    The gated loudness over the whole song, ITU-R BS.1770
+    :param energies: The mean square of each segment of each channel, from segment_energies
+    :return: The loudness in LUFS, None if the song is silent
+    """
+    if energies.shape[0] == 0:
+        return None
+    # The front channels count equally, summed over the channels
+    per_segment = energies.sum(axis=1)
+    if len(per_segment) < SEGMENTS_PER_BLOCK:
+        blocks = np.array([per_segment.mean()])
+    else:
+        sums = np.convolve(per_segment, np.ones(SEGMENTS_PER_BLOCK), mode='valid')
+        blocks = sums / SEGMENTS_PER_BLOCK
+    with np.errstate(divide='ignore'):
+        block_loudness = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[block_loudness > ABSOLUTE_GATE]
+    if len(gated) == 0:
+        return None
+    threshold = -0.691 + 10 * math.log10(gated.mean()) + RELATIVE_GATE
+    gated = blocks[(block_loudness > ABSOLUTE_GATE) & (block_loudness > threshold)]
+    return float(-0.691 + 10 * math.log10(gated.mean()))
+
+
+def gain_for(lufs: float) -> float:
+    """
+    :param lufs: The loudness of a song
+    :return: The gain in dB that brings it to the reference loudness
+    """
+    return max(MIN_GAIN, min(MAX_GAIN, REFERENCE_LOUDNESS - lufs))
+
+
+def decode(path: str) -> Tuple[np.ndarray, int]:
+    """
+    Decode a song with the pygame mixer, which plays it too, so anything that can be played
+    can be measured. In the worker processes the mixer is started without a sound device.
+    :return: The samples, shape (frames, channels), and the sample rate
+    """
+    import pygame
+    if pygame.mixer.get_init() is None:
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+        pygame.mixer.init()
+    rate = pygame.mixer.get_init()[0]
+    samples = pygame.sndarray.samples(pygame.mixer.Sound(path))
+    if samples.ndim == 1:
+        samples = samples.reshape(-1, 1)
+    return samples, rate
+
+
+def analyse(path: str) -> Optional[float]:
+    """
+    :param path: A music file
+    :return: Its loudness in LUFS, None if it can't be decoded or is silent
+    """
+    try:
+        samples, rate = decode(path)
+    except Exception:
+        return None
+    return integrated_loudness(segment_energies(samples, rate))
+
+
+def analyse_batch(paths: List[str]) -> List[Optional[float]]:
+    """
+    Run in the worker processes
+    """
+    return [analyse(path) for path in paths]
+
+
+class LoudnessScanner:
+    """
+    Works out the gain of the songs in the media lib, in the background after the tags
+    """
+
+    def __init__(self, media_lib: MediaLib, index: LibIndex = None, workers: int = DEFAULT_LOUDNESS_WORKERS):
+        """
+        :param media_lib: The library whose songs want gains
+        :param index: Optional library index, files whose size and mtime are unchanged are not decoded again
+        :param workers: Number of processes decoding songs, at least 1, they are never decoded in
+        the player's process
+        """
+        self.logger = logging.getLogger("comms.mqtt")
+        self.media_lib = media_lib
+        self.index = index
+        self.workers = max(1, workers)
+
+    def _songs(self) -> Dict[str, List[ItemTable]]:
+        """
+        :return: Each song named by a loaded playlist with the tables holding it, leaving out copies
+        """
+        songs: Dict[str, List[ItemTable]] = {}
+        for playlist in self.media_lib.playlists:
+            if isinstance(playlist, LazyPlaylist) and not playlist.is_loaded():
+                continue
+            items = playlist.items
+            for src, _ in items.entries():
+                if items.table.is_duplicate(src):
+                    continue
+                tables = songs.setdefault(src, [])
+                if items.table not in tables:
+                    tables.append(items.table)
+        return songs
+
+    def scan(self) -> int:
+        """
+        Analyse the songs that aren't in the index and set the gain of every song
+        :return: The number of songs that were decoded
+        """
+        songs = self._songs()
+        cached = self.index.lookup_loudness() if self.index is not None else {}
+        misses: List[Tuple[str, int, int]] = []
+        for path, tables in songs.items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entry = cached.get(path)
+            if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+                self._set_gain(path, tables, entry[2])
+            else:
+                misses.append((path, st.st_size, st.st_mtime_ns))
+        self.logger.info("Loudness of %d songs known, analysing %d", len(songs) - len(misses), len(misses))
+        if len(misses) == 0:
+            return 0
+
+        batches = [misses[i:i + LOUDNESS_BATCH_SIZE] for i in range(0, len(misses), LOUDNESS_BATCH_SIZE)]
+        paths = [[p for p, _, _ in batch] for batch in batches]
+        # Spawned rather than forked, the player already has threads running
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) \
+                as executor:
+            self._read_batches(batches, songs, executor.map(analyse_batch, paths))
+        return len(misses)
+
+    def _read_batches(self, batches: List[List[Tuple[str, int, int]]], songs: Dict[str, List[ItemTable]],
+                      results: Iterator[List[Optional[float]]]) -> None:
+        for batch, loudness in zip(batches, results):
+            rows = []
+            for (path, size, mtime_ns), lufs in zip(batch, loudness):
+                self._set_gain(path, songs[path], lufs)
+                # Files that can't be decoded are kept too, so they aren't tried again every time
+                rows.append((path, size, mtime_ns, lufs))
+            if self.index is not None:
+                self.index.store_loudness(rows)
+
+    @staticmethod
+    def _set_gain(path: str, tables: List[ItemTable], lufs: Optional[float]) -> None:
+        if lufs is None:
+            return
+        gain = gain_for(lufs)
+        for table in tables:
+            table.set_gain(path, gain)
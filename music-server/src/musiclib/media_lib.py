@@ -1,11 +1,32 @@
 """
 A class for parsing and reading Windows Media Playlists
 """
-from dataclasses import dataclass
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path, PureWindowsPath
-from typing import List
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
 
-from lxml import etree
+from musiclib import playlist_formats
+from musiclib.dir_cache import DirListingCache
+from musiclib.item_table import ItemTable, SHARED_ITEM_TABLE
+from musiclib.playlist_formats import ENTRY, PlaylistFormat
+from musiclib.volume_walker import VolumeWalker, WINDOWS_MEDIA, PLAYLIST_FILES
+
+if TYPE_CHECKING:
+    from musiclib.lib_index import LibIndex
+    from musiclib.tags import TrackTags
+
+# Number of threads used to scan volumes and parse playlists, most of the time is spent
+# waiting on the USB drives so this can be more than the number of cores
+DEFAULT_SCAN_WORKERS = 4
+
+# How many items lazy playlists may hold in memory before the least recently used are dropped
+DEFAULT_MAX_CACHED_ITEMS = 50000
 
 
 @dataclass
@@ -16,9 +37,124 @@ class Item():
     # Holds the name of the parent folder, which in some cases is the album name
     album_name: str
 
+    # The tags read from the file, None until they have been read
+    tags: Optional["TrackTags"] = field(default=None, compare=False)
+
+    # How many dB to change the volume by to bring the song to the reference loudness, None until analysed
+    gain: Optional[float] = field(default=None, compare=False)
+
     def get_song_name(self) -> str:
         return self.src.stem
 
+    def get_title(self) -> str:
+        """
+        :return: The title from the tags, or the file name if there isn't one
+        """
+        if self.tags is not None and self.tags.title:
+            return self.tags.title
+        return self.get_song_name()
+
+    def get_artist(self) -> Optional[str]:
+        return self.tags.artist if self.tags is not None else None
+
+    def get_duration(self) -> Optional[float]:
+        """
+        :return: The length of the song in seconds, if known
+        """
+        return self.tags.duration if self.tags is not None else None
+
+
+class ItemList(Sequence):
+    """
+    The items of a playlist, stored compactly. Each entry is three numbers in arrays, for
+    the folder, file name and album name, which are held once in a shared ItemTable. The
+    Item objects are made when an entry is asked for, so a playlist costs a few bytes per
+    song instead of a Path and a string each.
+    """
+    __slots__ = ('table', 'dirs', 'names', 'albums')
+
+    def __init__(self, items: Iterable[Item] = (), table: ItemTable = SHARED_ITEM_TABLE):
+        self.table = table
+        self.dirs = array('I')
+        self.names = array('I')
+        self.albums = array('I')
+        self.extend(items)
+
+    @staticmethod
+    def of(items: Iterable[Item]) -> "ItemList":
+        """
+        :param items: Items, in any kind of collection
+        :return: The items as an ItemList, the same object if it already is one
+        """
+        return items if isinstance(items, ItemList) else ItemList(items)
+
+    def add(self, src: str, album_name: str) -> None:
+        """
+        Add an entry without making an Item first
+        :param src: The absolute path to the music file
+        :param album_name: The album name
+        :return: Nothing
+        """
+        dir, name = os.path.split(src)
+        self.dirs.append(self.table.dirs.intern(dir))
+        self.names.append(self.table.names.intern(name))
+        self.albums.append(self.table.albums.intern(album_name))
+
+    def append(self, item: Item) -> None:
+        self.add(str(item.src), item.album_name)
+
+    def extend(self, items: Iterable[Item]) -> None:
+        if isinstance(items, ItemList) and items.table is self.table:
+            self.dirs.extend(items.dirs)
+            self.names.extend(items.names)
+            self.albums.extend(items.albums)
+        else:
+            for item in items:
+                self.append(item)
+
+    def get_path(self, index: int) -> str:
+        """
+        :return: The path to the music file of an entry, without making an Item
+        """
+        return os.path.join(self.table.dirs[self.dirs[index]], self.table.names[self.names[index]])
+
+    def entries(self) -> Iterator[Tuple[str, str]]:
+        """
+        :return: The path and album name of each entry, in order, without making Items
+        """
+        dirs, names, albums = self.table.dirs, self.table.names, self.table.albums
+        for d, n, a in zip(self.dirs, self.names, self.albums):
+            yield os.path.join(dirs[d], names[n]), albums[a]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            sliced = ItemList(table=self.table)
+            sliced.dirs = self.dirs[index]
+            sliced.names = self.names[index]
+            sliced.albums = self.albums[index]
+            return sliced
+        return Item(src=Path(self.get_path(index)), album_name=self.table.albums[self.albums[index]],
+                    tags=self.table.get_tags(self.dirs[index], self.names[index]),
+                    gain=self.table.get_gain(self.dirs[index], self.names[index]))
+
+    def __add__(self, other: Iterable[Item]) -> "ItemList":
+        joined = self[:]
+        joined.extend(other)
+        return joined
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ItemList) and other.table is self.table:
+            return self.dirs == other.dirs and self.names == other.names and self.albums == other.albums
+        if isinstance(other, (ItemList, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ItemList({list(self)!r})"
+
 
 @dataclass
 class Playlist():
@@ -30,7 +166,13 @@ class Playlist():
     title: str
 
     # Holds a list of items in the playlist and metadata
-    items: List[Item]
+    items: ItemList
+
+    # The file the playlist was read from, None for playlists made from a folder of music
+    source: Optional[Path] = None
+
+    def __post_init__(self):
+        self.items = ItemList.of(self.items)
 
     def exists(self, id: int) -> bool:
         return 0 <= id < len(self.items)
@@ -53,11 +195,143 @@ class Playlist():
         return len(self.items)
 
 
+class LazyPlaylist(Playlist):
+    """
+    A playlist that only knows its title and how many entries it has until one of its
+    items is asked for, then the source file is parsed. A PlaylistCache can drop the
+    items again when too many are held in memory, they are parsed again if needed.
+    """
+
+    def __init__(self, volume: Path, kind: str, title: str, source: Optional[Path], count: int,
+                 loader: Callable[[], Iterable[Item]], cache: "PlaylistCache" = None):
+        self.volume = volume
+        self.kind = kind
+        self.title = title
+        # The file the items come from
+        self.source = source
+        # The number of entries found when the playlist was scanned, replaced by the
+        # real number of items once they are loaded
+        self.count = count
+        self.loader = loader
+        self.cache = cache
+        # Called once the items have been loaded, the media lib holding the playlist sets it
+        self.on_loaded: Optional[Callable[[], None]] = None
+        self._items: Optional[ItemList] = None
+        self._lock = threading.Lock()
+
+    @property
+    def items(self) -> ItemList:
+        items = self._items
+        if items is None:
+            loaded = False
+            with self._lock:
+                if self._items is None:
+                    self._items = ItemList.of(self.loader())
+                    self.count = len(self._items)
+                    loaded = True
+                items = self._items
+            # Outside the lock, the cache may unload other playlists
+            if loaded and self.cache is not None:
+                self.cache.loaded(self)
+            if loaded and self.on_loaded is not None:
+                self.on_loaded()
+        elif self.cache is not None:
+            self.cache.touch(self)
+        return items
+
+    @items.setter
+    def items(self, items: Iterable[Item]) -> None:
+        items = ItemList.of(items)
+        self._items = items
+        self.count = len(items)
+
+    def is_loaded(self) -> bool:
+        return self._items is not None
+
+    def unload(self) -> None:
+        """
+        Drop the items, they are loaded again the next time they are needed
+        :return: Nothing
+        """
+        with self._lock:
+            self._items = None
+
+    def size(self) -> int:
+        items = self._items
+        return self.count if items is None else len(items)
+
+    def __repr__(self) -> str:
+        return f"LazyPlaylist(volume={self.volume!r}, kind={self.kind!r}, title={self.title!r}, " \
+               f"source={self.source!r}, count={self.count}, loaded={self.is_loaded()})"
+
+
+class PlaylistCache:
+    """
+    Keeps track of the lazy playlists that have loaded their items. When the total number
+    of items goes over the limit the least recently used playlists are unloaded.
+    """
+
+    def __init__(self, max_items: int = DEFAULT_MAX_CACHED_ITEMS):
+        self.max_items = max_items
+        # Loaded playlists, least recently used first, with the number of items each holds
+        self.playlists: "OrderedDict[int, Tuple[LazyPlaylist, int]]" = OrderedDict()
+        self.total_items = 0
+        self.lock = threading.Lock()
+
+    def loaded(self, playlist: LazyPlaylist) -> None:
+        """
+        Called by a playlist that has just loaded its items
+        :param playlist: The playlist
+        :return: Nothing
+        """
+        evicted: List[LazyPlaylist] = []
+        with self.lock:
+            key = id(playlist)
+            if key in self.playlists:
+                self.total_items -= self.playlists.pop(key)[1]
+            self.playlists[key] = (playlist, playlist.count)
+            self.total_items += playlist.count
+            # Never evict the playlist that was just loaded
+            while self.total_items > self.max_items and len(self.playlists) > 1:
+                _, (oldest, count) = self.playlists.popitem(last=False)
+                self.total_items -= count
+                evicted.append(oldest)
+        for oldest in evicted:
+            oldest.unload()
+
+    def touch(self, playlist: LazyPlaylist) -> None:
+        with self.lock:
+            key = id(playlist)
+            if key in self.playlists:
+                self.playlists.move_to_end(key)
+
+    def size(self) -> int:
+        """
+        :return: The number of items held by the loaded playlists
+        """
+        return self.total_items
+
+
 @dataclass
 class MediaLib():
     # A collection of the playlists found one more volumes
     playlists: List[Playlist]
 
+    # Goes up every time the playlists change, so things built from them can tell they are out of date
+    generation: int = field(default=0, compare=False)
+
+    # Called on whichever thread made a change, after the generation has gone up
+    listeners: List[Callable[[], None]] = field(default_factory=list, compare=False, repr=False)
+
+    def __post_init__(self):
+        self._watch_loads(self.playlists)
+
+    def _watch_loads(self, playlists: List[Playlist]) -> None:
+        # The songs of a lazy playlist that is loaded are new to the indexes built from the library
+        for playlist in playlists:
+            if isinstance(playlist, LazyPlaylist):
+                playlist.on_loaded = self.changed
+
     def get_info(self) -> str:
         return f"Loaded {len(self.playlists)} playlists"
 
@@ -77,7 +351,9 @@ class MediaLib():
         :param playlist: A playlist to add to the media lib
         :return: Nothing
         """
+        self._watch_loads([playlist])
         self.playlists.append(playlist)
+        self.changed()
 
     def add_playlists(self, playlists: List[Playlist]) -> None:
         """
@@ -85,11 +361,88 @@ class MediaLib():
         :param playlists: A list of one or more playlists to add to the collection
         :return: Nothing
         """
+        self._watch_loads(playlists)
         self.playlists.extend(playlists)
+        self.changed()
 
     def get_playlist_by_id(self, id: int) -> Playlist:
         return self.playlists[id]
 
+    def index_of(self, playlist: Playlist) -> Optional[int]:
+        """
+        :param playlist: A playlist that may have moved, or gone, since its id was known
+        :return: Its id now, or None if it is no longer in the library
+        """
+        return next((i for i, p in enumerate(self.playlists) if p is playlist), None)
+
+    def get_volume_playlists(self, volume: Path) -> List[Playlist]:
+        """
+        :param volume: The root of a volume
+        :return: The playlists found on that volume, in library order
+        """
+        return [playlist for playlist in self.playlists if playlist.volume == volume]
+
+    def find_playlist_by_source(self, source: Path) -> Optional[Playlist]:
+        """
+        :param source: The path to a playlist file
+        :return: The playlist read from that file, or None
+        """
+        for playlist in self.playlists:
+            if playlist.source == source:
+                return playlist
+        return None
+
+    def replace_volume(self, volume: Path, playlists: List[Playlist]) -> None:
+        """
+        Swap the playlists of a volume for a new set. They go where the old ones were, or
+        at the end if the volume is new, so the ids of the other volumes' playlists before it
+        don't change. A new list is swapped in so other threads always see a whole library.
+        :param volume: The root of the volume
+        :param playlists: The new playlists, empty to remove the volume
+        :return: Nothing
+        """
+        old = self.playlists
+        positions = [i for i, playlist in enumerate(old) if playlist.volume == volume]
+        at = positions[0] if len(positions) > 0 else len(old)
+        kept = [playlist for playlist in old if playlist.volume != volume]
+        self._watch_loads(playlists)
+        self.playlists = kept[:at] + playlists + kept[at:]
+        self.changed()
+
+    def update_volume(self, volume: Path, playlists: List[Playlist]) -> None:
+        """
+        Like replace_volume, but a playlist already in the library that was read from the same
+        file as a new one is kept and changed in place, so whoever holds on to it, like the
+        player its active playlist, sees the new songs
+        :param volume: The root of the volume
+        :param playlists: The playlists as they were read again
+        :return: Nothing
+        """
+        by_source = {(p.source, p.kind): p for p in self.get_volume_playlists(volume)}
+        updated: List[Playlist] = []
+        for playlist in playlists:
+            existing = by_source.get((playlist.source, playlist.kind))
+            if existing is not None:
+                existing.title = playlist.title
+                existing.items = playlist.items
+                updated.append(existing)
+            else:
+                updated.append(playlist)
+        self.replace_volume(volume, updated)
+
+    def remove_playlist(self, playlist: Playlist) -> None:
+        self.playlists = [p for p in self.playlists if p is not playlist]
+        self.changed()
+
+    def changed(self) -> None:
+        """
+        Call after changing a playlist in place, e.g. its items or title
+        :return: Nothing
+        """
+        self.generation += 1
+        for listener in self.listeners:
+            listener()
+
     def size(self) -> int:
         """
         Return the number of playlists the library contains
@@ -101,102 +454,274 @@ class MediaLib():
 class MediaLibParsers:
 
     @staticmethod
-    def parse_lib(volumes: List[Path]) -> MediaLib:
+    def parse_lib(volumes: List[Path], index: Optional["LibIndex"] = None,
+                  workers: int = DEFAULT_SCAN_WORKERS, validate: bool = True,
+                  playlist_cache: PlaylistCache = None) -> MediaLib:
         """
+        The volumes are scanned at the same time, each one is usually a separate USB drive
+        so the time taken is set by the slowest drive rather than the sum of them. The
+        playlists are added in the order the volumes were given, and within a volume in
+        the order of their paths, so the ids don't depend on which drive finished first.
         :param volumes: A collection of volumes to search for playlists, everything found
         is added to a single MediaLib which is returned
+        :param index: Optional persistent index, when supplied only the directories and
+        playlist files that changed since the last run are re-read
+        :param workers: The most threads to use for scanning volumes, and separately for
+        parsing playlists. Use 1 to do everything in the calling thread.
+        :param validate: Drop entries of playlist files whose files don't exist. If false the
+        check is left until the song is played.
+        :param playlist_cache: If given the playlist files are lazy, the scan only reads
+        their titles and counts their entries and the items are parsed when first used
         :return A populated media lib
         """
         medialib = MediaLib(playlists=[])
-        for volume in volumes:
-            if MediaLibParsers.is_windows_media_folder(volume):
-                MediaLibParsers.create_from_windows_media(volume, medialib)
-            elif MediaLibParsers.is_simple_text_playlist(volume):
-                MediaLibParsers.create_from_simple_text_playlist(volume, medialib)
-            else:
-                # Not a Windows Media Folder and doesn't contain a simple playlist,
-                # just make a list of all the MP3 files and make a single playlist
-                MediaLibParsers.create_single_playlist(volume, medialib)
+        # Shared by all the volumes, a playlist on one drive can name songs on another
+        dir_cache = DirListingCache()
+        if workers <= 1:
+            for volume in volumes:
+                medialib.add_playlists(MediaLibParsers.parse_volume(volume, index=index, dir_cache=dir_cache,
+                                                                    validate=validate, playlist_cache=playlist_cache))
+            return medialib
+
+        # Two pools, the volume tasks wait on the playlist tasks and must not starve them of threads
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="playlist-parser") as parsers, \
+                ThreadPoolExecutor(max_workers=min(workers, max(1, len(volumes))),
+                                   thread_name_prefix="volume-scanner") as scanners:
+            results = scanners.map(
+                lambda volume: MediaLibParsers.parse_volume(volume, index, parsers, dir_cache, validate,
+                                                            playlist_cache), volumes)
+            for playlists in results:
+                medialib.add_playlists(playlists)
         return medialib
 
     @staticmethod
-    def is_simple_text_playlist(volume: Path) -> bool:
-        txt_files = volume.rglob('*.txt')
-        count = 0
-        for file in txt_files:
-            count += 1
-        return count > 0
+    def parse_volume(volume: Path, index: Optional["LibIndex"] = None, executor: Executor = None,
+                     dir_cache: DirListingCache = None, validate: bool = True,
+                     playlist_cache: PlaylistCache = None) -> List[Playlist]:
+        """
+        Find and parse the playlists on a single volume
+        :param volume: The root of the volume
+        :param index: Optional persistent index
+        :param executor: Optional pool used to parse the playlists in parallel
+        :param dir_cache: Used to check the entries of playlist files exist
+        :param validate: Check the entries of playlist files exist
+        :param playlist_cache: Make lazy playlists held by this cache
+        :return: The playlists found on the volume
+        """
+        medialib = MediaLib(playlists=[])
+        if index is not None:
+            index.scan_volume(volume, medialib, executor, dir_cache, validate, playlist_cache)
+            return medialib.playlists
+        # One walk classifies the volume and finds the files needed to build its playlists
+        scan = VolumeWalker().scan(volume)
+        if scan.kind == WINDOWS_MEDIA or scan.kind == PLAYLIST_FILES:
+            files = scan.wpl_files if scan.kind == WINDOWS_MEDIA else scan.playlist_files
+            MediaLibParsers.create_from_playlist_files(volume, medialib, [Path(f.path) for f in files], executor,
+                                                       dir_cache, validate, playlist_cache)
+        else:
+            # Not a Windows Media Folder and doesn't contain any playlists,
+            # just make a list of all the MP3 files and make a single playlist
+            MediaLibParsers.create_single_playlist(volume, medialib, [Path(f.path) for f in scan.music_files])
+        return medialib.playlists
 
     @staticmethod
-    def create_from_simple_text_playlist(volume: Path, medialib: MediaLib) -> MediaLib:
+    def create_from_playlist_files(volume: Path, medialib: MediaLib,
+                                   playlist_paths: List[Path] = None, executor: Executor = None,
+                                   dir_cache: DirListingCache = None, validate: bool = True,
+                                   playlist_cache: PlaylistCache = None) -> MediaLib:
         """
-        Create the media lib from a volume that contains simple playlists, just text file
-        with a list of music files.
+        Create the media lib from a volume that contains playlist files, in any of the
+        registered formats and mixed together if need be.
         :param volume: The root to search from
         :param medialib: The playlists found are added to this collection
+        :param playlist_paths: The playlist files on the volume, the volume is searched if not given
+        :param executor: Optional pool used to parse the playlists in parallel
+        :param dir_cache: Used to check the entries exist
+        :param validate: Check the entries exist, if false this is left until the song is played
+        :param playlist_cache: Make lazy playlists held by this cache
         :return: A Media Lib
         """
-        # Recursive search for plain text playlists
-        simple_playlists = volume.rglob('*.txt')
-        playlists: List[Playlist] = []
-        for playlist_path in simple_playlists:
-            if not playlist_path.exists():
-                continue
-            playlist_root = playlist_path.parent
-            title = playlist_path.stem
-            with open(playlist_path, 'r') as f:
-                mfs = [line.strip() for line in f if not line.startswith("#")]
-                # Turn each string into an absolute path if not already absolute
-                items: List[Item] = []
-                for mf in mfs:
-                    music_file = Path(mf)
-                    if not music_file.is_absolute():
-                        music_file = playlist_root.joinpath(music_file)
-                    if music_file.exists():
-                        item: Item = Item(album_name=music_file.parent.stem, src=music_file)
-                        items.append(item)
-                    else:
-                        print(f"**WARN** File mentioned in playlist, but not found {str(music_file)}")
-            playlist: Playlist = Playlist(volume=volume, kind="Simple Text Playlist", title=title, items=items)
-            playlists.append(playlist)
+        if playlist_paths is None:
+            scan = VolumeWalker().scan(volume)
+            playlist_paths = [Path(f.path) for f in (scan.wpl_files if scan.kind == WINDOWS_MEDIA
+                                                     else scan.playlist_files)]
+        if validate and dir_cache is None:
+            dir_cache = DirListingCache()
+        if playlist_cache is not None:
+            playlists: List[Playlist] = MediaLibParsers._map(
+                lambda pl_path: MediaLibParsers.lazy_playlist_file(volume, pl_path, playlist_cache, dir_cache,
+                                                                   validate), playlist_paths, executor)
+        else:
+            playlists = MediaLibParsers._map(
+                lambda pl_path: MediaLibParsers.parse_playlist_file(volume, pl_path, dir_cache, validate),
+                playlist_paths, executor)
         if len(playlists) > 0:
             medialib.add_playlists(playlists)
         return medialib
 
     @staticmethod
-    def create_single_playlist(volume: Path, medialib: MediaLib) -> MediaLib:
+    def parse_playlist_file(volume: Path, pl_path: Path, dir_cache: DirListingCache = None,
+                            validate: bool = True) -> Playlist:
+        """
+        Read a playlist file in any of the registered formats
+        :param volume: The volume the playlist was found on
+        :param pl_path: The path to the playlist
+        :param dir_cache: Used to check the entries exist, each folder is only listed once
+        :param validate: Drop the entries that don't exist, for the formats that are checked. If
+        false every entry is kept and the music player skips missing ones when asked to play them.
+        :return: A Playlist holding the items that were found
+        """
+        fmt = MediaLibParsers.get_format(pl_path)
+        title = None
+        items = ItemList()
+        for event, value in fmt.reader(pl_path):
+            if event == ENTRY:
+                music_file = MediaLibParsers.resolve_entry(volume, pl_path, fmt, value, dir_cache, validate)
+                if music_file is not None:
+                    items.add(str(music_file), music_file.parent.stem)
+            elif title is None:
+                title = value
+        return Playlist(volume=volume, kind=fmt.kind, title=title if title else pl_path.stem, items=items,
+                        source=pl_path)
+
+    @staticmethod
+    def lazy_playlist_file(volume: Path, pl_path: Path, playlist_cache: PlaylistCache,
+                           dir_cache: DirListingCache = None, validate: bool = True) -> LazyPlaylist:
+        """
+        Read the title of a playlist file and count its entries, the entries are checked and
+        turned into items when the playlist is first used
+        :param volume: The volume the playlist was found on
+        :param pl_path: The path to the playlist
+        :param playlist_cache: Holds the playlist once it is loaded
+        :param dir_cache: Used to check the entries exist
+        :param validate: Drop the entries that don't exist when loading
+        :return: The lazy playlist
+        """
+        fmt = MediaLibParsers.get_format(pl_path)
+        title = None
+        count = 0
+        for event, value in fmt.reader(pl_path):
+            if event == ENTRY:
+                count += 1
+            elif title is None:
+                title = value
+
+        def loader() -> ItemList:
+            return MediaLibParsers.parse_playlist_file(volume, pl_path, dir_cache, validate).items
+
+        return LazyPlaylist(volume=volume, kind=fmt.kind, title=title if title else pl_path.stem, source=pl_path,
+                            count=count, loader=loader, cache=playlist_cache)
+
+    @staticmethod
+    def get_format(pl_path: Path) -> PlaylistFormat:
+        fmt = playlist_formats.format_for(pl_path)
+        if fmt is None:
+            raise ValueError(f"Not a playlist file {pl_path}")
+        return fmt
+
+    @staticmethod
+    def windows_entry(volume: Path, pl_path: Path, location: str) -> Path:
+        windows_path = PureWindowsPath(location)
+        if windows_path.anchor:
+            return volume.joinpath(*windows_path.parts[1:])
+        return pl_path.parent.joinpath(*windows_path.parts)
+
+    @staticmethod
+    def resolve_entry(volume: Path, pl_path: Path, fmt: PlaylistFormat, location: str,
+                      dir_cache: Optional[DirListingCache], validate: bool) -> Optional[Path]:
+        """
+        Turn an entry of a playlist into the path of the music file. Relative entries are
+        relative to the playlist's folder. Windows paths, the ones the format always uses and any
+        that can only be one, see is_windows_path, have their separators converted and, if they
+        start with a drive letter, are taken to be on the same volume as the playlist. Other
+        entries with a backslash in are tried as Windows paths if they aren't found as written.
+        :return: The path, or None if it is checked and doesn't exist
+        """
+        windows = fmt.windows_paths or playlist_formats.is_windows_path(location)
+        if windows:
+            music_file = MediaLibParsers.windows_entry(volume, pl_path, location)
+        else:
+            music_file = Path(location)
+            if not music_file.is_absolute():
+                music_file = pl_path.parent.joinpath(music_file)
+        if validate and fmt.validate:
+            if dir_cache is None:
+                dir_cache = DirListingCache()
+            # Use the name the way it is spelled on the disk
+            found = dir_cache.resolve(music_file)
+            if found is None and not windows and '\\' in location:
+                found = dir_cache.resolve(MediaLibParsers.windows_entry(volume, pl_path, location))
+            if found is None:
+                print(f"**WARN** File mentioned in playlist, but not found {str(music_file)}")
+            return found
+        return music_file
+
+    @staticmethod
+    def parse_text_playlist(volume: Path, playlist_path: Path, dir_cache: DirListingCache = None,
+                            validate: bool = True) -> Playlist:
+        """
+        Read a simple text playlist, one music file per line, lines starting
+        with # are comments. Relative paths are relative to the playlist's folder.
+        :param volume: The volume the playlist was found on
+        :param playlist_path: The path to the text file
+        :param dir_cache: Used to check the entries exist, each folder is only listed once
+        :param validate: Drop the entries that don't exist. If false every entry is kept and the
+        music player skips missing ones when asked to play them.
+        :return: A Playlist holding the items that were found
+        """
+        return MediaLibParsers.parse_playlist_file(volume, playlist_path, dir_cache, validate)
+
+    @staticmethod
+    def create_single_playlist(volume: Path, medialib: MediaLib, music_files: List[Path] = None) -> MediaLib:
         """
         Search for all supported media files, e.g. MP3, WAV and OGG
         and make a single playlist from that
         :param volume: The volume to search
+        :param music_files: The music files on the volume, the volume is searched if not given
         :return:
         """
-        items: List[Item] = []
-        # Ignore hidden files
-        visible_files = [file for file in volume.rglob('*.mp3') if not file.name.startswith('.')]
-        for path in visible_files:
-            items.append(Item(src=path, album_name=path.parent.stem))
-        playlist = Playlist(volume=volume, kind="Single Playlist", title="All Items", items=items)
-        medialib.add_playlist(playlist)
+        if music_files is None:
+            # Hidden files are ignored by the walker
+            music_files = [Path(f.path) for f in VolumeWalker().find_music(volume)]
+        medialib.add_playlist(MediaLibParsers.make_single_playlist(volume, music_files))
         return medialib
 
     @staticmethod
-    def create_from_windows_media(volume: Path, medialib: MediaLib) -> MediaLib:
+    def make_single_playlist(volume: Path, music_files: List[Path]) -> Playlist:
+        """
+        Make the "All Items" playlist from a list of music files
+        :param volume: The volume the files were found on
+        :param music_files: The music files, in playing order
+        :return: A playlist holding one item per file
+        """
+        items = ItemList()
+        for path in music_files:
+            items.add(str(path), path.parent.stem)
+        return Playlist(volume=volume, kind="Single Playlist", title="All Items", items=items)
+
+    @staticmethod
+    def create_from_windows_media(volume: Path, medialib: MediaLib, playlist_paths: List[Path] = None,
+                                  executor: Executor = None) -> MediaLib:
         """
         Create the library from the given Windows Media Folder
         :param volume: Path to the folder
         :param medialib: The playlists found are added to this collection
+        :param playlist_paths: The WPL files in the Playlists folder, the folder is searched if not given
+        :param executor: Optional pool used to parse the playlists in parallel
         :return: A populated media lib
         """
-        playlists_root = volume.joinpath("Playlists")
-        all_playlists_path = playlists_root.glob('*.wpl')
-        playlists: List[Playlist] = []
-        for pl_path in all_playlists_path:
-            playlist = MediaLibParsers.parse_wpl_playlist(volume, pl_path)
-            playlists.append(playlist)
-        if len(playlists) > 0:
-            medialib.add_playlists(playlists)
-        return medialib
+        if playlist_paths is None:
+            playlist_paths = sorted(volume.joinpath("Playlists").glob('*.wpl'))
+        return MediaLibParsers.create_from_playlist_files(volume, medialib, playlist_paths, executor)
+
+    @staticmethod
+    def _map(fn: Callable[[Path], Playlist], paths: List[Path], executor: Optional[Executor]) -> List[Playlist]:
+        """
+        Parse each playlist, in parallel if there is an executor, keeping the order of the paths
+        """
+        if executor is None or len(paths) < 2:
+            return [fn(path) for path in paths]
+        return list(executor.map(fn, paths))
 
     @staticmethod
     def is_windows_media_folder(volume: Path) -> bool:
@@ -207,10 +732,7 @@ class MediaLibParsers:
         """
         playlists_root = volume.joinpath("Playlists")
         if playlists_root.exists():
-            count = 0
-            for file in playlists_root.glob('*.wpl'):
-                count += 1
-            result = count > 0
+            result = any(True for _ in playlists_root.glob('*.wpl'))
         else:
             result = False
         return result
@@ -222,15 +744,4 @@ class MediaLibParsers:
         :param pl_path: The path to the playlist
         :return: A Playlist object containing a list of the items in it
         """
-        playlists_root = pl_path.parent
-        tree = etree.parse(str(pl_path))
-
-        title = tree.xpath('/smil/head/title')[0].text
-        items_element = tree.xpath('/smil/body/seq/media')
-        items: List[Item] = []
-        for item in items_element:
-            item_rel_path = PureWindowsPath(item.attrib['src'])
-            item_path = playlists_root.joinpath(item_rel_path)
-            item = Item(src=item_path, album_name=item_path.parent.stem)
-            items.append(item)
-        return Playlist(volume=volume, kind="Windows Media Playlist", title=title, items=items)
+        return MediaLibParsers.parse_playlist_file(volume, pl_path)
@@ -0,0 +1,202 @@
+"""
+The playlist file formats the library understands, kept in a registry keyed by file suffix
+so a new format only needs a reader and a call to register_format.
+
+A reader streams through a playlist file and yields events, ('title', text) for the title
+of the playlist if the file has one and ('entry', location) for each song, in order. The
+location is the path as written in the file, turning it into a path on the volume and
+checking the song exists is left to MediaLibParsers, the same way for every format.
+"""
+import re
+import urllib.parse
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from lxml import etree
+
+TITLE = 'title'
+ENTRY = 'entry'
+
+WPL_SUFFIX = '.wpl'
+TXT_SUFFIX = '.txt'
+
+
+@dataclass
+class PlaylistFormat():
+    # The name used for the kind of the playlists read in this format
+    kind: str
+    # The file suffixes, lower case and with the dot
+    suffixes: Tuple[str, ...]
+    # Streams the events out of a playlist file
+    reader: Callable[[Path], Iterator[Tuple[str, str]]]
+    # The entries are Windows style paths
+    windows_paths: bool = False
+    # Check the entries exist when reading the playlist, if the library is validating
+    validate: bool = True
+
+
+FORMATS: Dict[str, PlaylistFormat] = {}
+
+# The suffixes of every registered format, used by the volume walker to pick out playlist files
+PLAYLIST_SUFFIXES: Tuple[str, ...] = ()
+
+
+def register_format(playlist_format: PlaylistFormat) -> None:
+    """
+    Add a format, or replace the one registered for the same suffixes
+    :param playlist_format: The format
+    :return: Nothing
+    """
+    global PLAYLIST_SUFFIXES
+    for suffix in playlist_format.suffixes:
+        FORMATS[suffix] = playlist_format
+    PLAYLIST_SUFFIXES = tuple(FORMATS)
+
+
+def format_for(path: Path) -> Optional[PlaylistFormat]:
+    """
+    :param path: A file
+    :return: The format for the file's suffix, None if it isn't a playlist
+    """
+    return FORMATS.get(path.suffix.lower())
+
+
+def is_playlist(name: str) -> bool:
+    return name.lower().endswith(PLAYLIST_SUFFIXES)
+
+
+# A drive letter path (C:\Music or C:/Music), a UNC path (\\server\share) or one relative to
+# the playlist's folder written with backslashes (..\Album or .\Album)
+WINDOWS_PATH = re.compile(r'[A-Za-z]:[\\/]|\\\\|\.{1,2}\\')
+
+
+def is_windows_path(location: str) -> bool:
+    """
+    :param location: An entry of a playlist
+    :return: True if it can only be a Windows path, "a:b.mp3" or "a\\b.mp3" are names a file
+    on Linux could have
+    """
+    return WINDOWS_PATH.match(location) is not None
+
+
+def read_lines(pl_path: Path) -> Iterator[str]:
+    """
+    The lines of a text file, stripped. UTF-8 is expected but older M3U and PLS files are
+    often in the Windows code page, each line is decoded on its own so one odd line doesn't
+    spoil the rest.
+    """
+    with open(pl_path, 'rb') as f:
+        for raw in f:
+            try:
+                line = raw.decode('utf-8')
+            except UnicodeDecodeError:
+                line = raw.decode('cp1252', errors='replace')
+            yield line.lstrip('\ufeff').strip()
+
+
+def read_text(pl_path: Path) -> Iterator[Tuple[str, str]]:
+    """
+    A simple text playlist, one music file per line, lines starting with # are comments.
+    The title is the file name.
+    """
+    for line in read_lines(pl_path):
+        if len(line) > 0 and not line.startswith('#'):
+            yield ENTRY, line
+
+
+def read_m3u(pl_path: Path) -> Iterator[Tuple[str, str]]:
+    """
+    An M3U or M3U8 playlist, like a text playlist but the comments can be directives,
+    #PLAYLIST: gives the title
+    """
+    for line in read_lines(pl_path):
+        if len(line) == 0:
+            continue
+        if line.startswith('#'):
+            if line.startswith('#PLAYLIST:'):
+                yield TITLE, line[len('#PLAYLIST:'):].strip()
+        else:
+            yield ENTRY, line
+
+
+def read_pls(pl_path: Path) -> Iterator[Tuple[str, str]]:
+    """
+    A PLS playlist, an INI style file with a FileN=location line for each entry
+    """
+    for line in read_lines(pl_path):
+        key, sep, value = line.partition('=')
+        if sep and key[:4].lower() == 'file' and key[4:].isdigit() and len(value.strip()) > 0:
+            yield ENTRY, value.strip()
+
+
+def read_xspf(pl_path: Path) -> Iterator[Tuple[str, str]]:
+    """
+    An XSPF playlist, streamed like the WPL files. The locations are URIs, file:// ones and
+    relative ones are turned back into paths, anything else (http etc) is left out.
+    """
+    for _, element in etree.iterparse(str(pl_path), events=('end',), tag=('{*}title', '{*}location')):
+        parent = element.getparent()
+        parent_tag = etree.QName(parent).localname if parent is not None else None
+        tag = etree.QName(element).localname
+        if tag == 'location':
+            if parent_tag == 'track' and element.text:
+                location = uri_to_path(element.text.strip())
+                if location is not None:
+                    yield ENTRY, location
+        elif parent_tag == 'playlist' and element.text:
+            yield TITLE, element.text.strip()
+        element.clear()
+        if tag == 'location' and parent is not None and parent_tag == 'track':
+            # Drop the tracks already read, otherwise they pile up in the track list
+            track = parent
+            track_list = track.getparent()
+            if track_list is not None:
+                while track.getprevious() is not None:
+                    del track_list[0]
+
+
+def uri_to_path(location: str) -> Optional[str]:
+    """
+    :param location: An XSPF location
+    :return: The path it names, None if it isn't a file
+    """
+    parsed = urllib.parse.urlparse(location)
+    if parsed.scheme == 'file':
+        path = urllib.parse.unquote(parsed.path)
+        # file:///C:/Music/song.mp3, drop the slash in front of the drive
+        return path[1:] if len(path) > 2 and path[0] == '/' and path[2] == ':' else path
+    if parsed.scheme == '' or len(parsed.scheme) == 1:
+        # Relative, or a Windows drive letter which urlparse takes for a scheme
+        return urllib.parse.unquote(location)
+    return None
+
+
+def read_wpl(pl_path: Path) -> Iterator[Tuple[str, str]]:
+    """
+    Stream through a Windows playlist without building the whole document. Each element
+    is dropped as soon as it has been read so memory use doesn't grow with the playlist.
+    Only /smil/head/title and /smil/body/seq/media are used.
+    """
+    for _, element in etree.iterparse(str(pl_path), events=('end',), tag=('title', 'media')):
+        parent = element.getparent()
+        if element.tag == 'media':
+            if parent is not None and parent.tag == 'seq' and 'src' in element.attrib:
+                yield ENTRY, element.attrib['src']
+        elif parent is not None and parent.tag == 'head':
+            yield TITLE, element.text
+        element.clear()
+        # Drop the elements already read, otherwise the emptied elements pile up in the parent
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+WINDOWS_MEDIA_FORMAT = PlaylistFormat(kind="Windows Media Playlist", suffixes=(WPL_SUFFIX,), reader=read_wpl,
+                                      windows_paths=True, validate=False)
+SIMPLE_TEXT_FORMAT = PlaylistFormat(kind="Simple Text Playlist", suffixes=(TXT_SUFFIX,), reader=read_text)
+
+register_format(WINDOWS_MEDIA_FORMAT)
+register_format(SIMPLE_TEXT_FORMAT)
+register_format(PlaylistFormat(kind="M3U Playlist", suffixes=('.m3u', '.m3u8'), reader=read_m3u))
+register_format(PlaylistFormat(kind="PLS Playlist", suffixes=('.pls',), reader=read_pls))
+register_format(PlaylistFormat(kind="XSPF Playlist", suffixes=('.xspf',), reader=read_xspf))
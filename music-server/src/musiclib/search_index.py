@@ -0,0 +1,287 @@
+"""
+An inverted index over the media lib so playlists, albums and songs can be found by name
+rather than by position. Names are split into words, lower cased and stripped of accents,
+and each word points at the playlists, albums and songs that use it. A query word matches
+a word in the index exactly, as a prefix ("beat" finds "beatles") or, failing those, with
+one letter wrong, missing or extra ("beetles" finds "beatles").
+
+Fuzzy matches use the deletion neighbourhood of each word: every word with one letter
+deleted is kept in a table, so a misspelt word is found with a handful of dictionary lookups
+instead of comparing it against the whole vocabulary. The table is only built the first
+time a fuzzy match is needed.
+
+Building the index over a big library takes seconds, so the player builds it in the
+background, see background_index.py, and searches the last complete one meanwhile. An index
+holds on to the playlists and items it was built from so its hits stay consistent, and the
+player finds their playlist again by itself.
+"""
+import heapq
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
+
+from musiclib.media_lib import ItemList, LazyPlaylist, MediaLib, Playlist
+
+PLAYLIST = "playlist"
+ALBUM = "album"
+SONG = "song"
+ALL_KINDS = (PLAYLIST, ALBUM, SONG)
+KIND_CODES = {PLAYLIST: 0, ALBUM: 1, SONG: 2}
+
+# How much each kind of match counts for, an exact word beats a prefix beats a misspelling
+EXACT_WEIGHT = 1.0
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.6
+
+# How many of the document sets of recently used words are kept
+DOC_SET_CACHE_SIZE = 256
+
+# Shorter query words only match exactly, too many words start with one or two letters
+MIN_PREFIX_LENGTH = 3
+MIN_FUZZY_LENGTH = 4
+
+WORD = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a name into words, lower case and without accents, so "Beyoncé" matches "beyonce"
+    :param text: A name or a query
+    :return: The words
+    """
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return WORD.findall(stripped)
+
+
+@dataclass
+class SearchHit():
+    # One of PLAYLIST, ALBUM or SONG
+    kind: str
+    # The position of the playlist to select when the index was built
+    playlist_id: int
+    # The song to play, the first song of an album, or -1 for a playlist
+    item_index: int
+    # The name that matched
+    name: str
+    score: float
+    # The playlist itself, to find it again if the library has changed since
+    playlist: Optional[Playlist] = field(default=None, compare=False, repr=False)
+
+
+class SearchIndex:
+    """
+    Built from a media lib, remembers the generation of the lib so it can tell when it is
+    out of date. Lazy playlists that haven't been loaded are found by title only.
+
+    Documents are numbered playlists first, then albums, then songs, each in library order,
+    so the numbers themselves give the order ties are broken in and each kind of document
+    is a range of numbers. The document sets of the words used most recently are kept, so
+    repeated queries for common words are set operations on sets that already exist.
+    """
+
+    def __init__(self, media_lib: MediaLib):
+        self.media_lib = media_lib
+        self.generation = media_lib.generation
+        # The library as it was built from, the items of the playlists that weren't loaded are None
+        self.playlists: List[Playlist] = list(media_lib.playlists)
+        self.items: List[Optional[ItemList]] = []
+        # Each document is a playlist, an album in a playlist or a song, held in two columns
+        self.doc_playlists = array('I')
+        self.doc_items = array('i')
+        # Where the documents of each kind start, and where the last kind ends
+        self.kind_starts: List[int] = []
+        self.vocab: Dict[str, int] = {}
+        # The documents using each word, in document order
+        self.postings: List[array] = []
+        self.deletions: Optional[Dict[str, List[int]]] = None
+        self.doc_sets: "OrderedDict[Tuple[int, int, int], FrozenSet[int]]" = OrderedDict()
+        self._build()
+        # For prefix matches
+        self.sorted_words = sorted(self.vocab)
+
+    def is_current(self) -> bool:
+        return self.generation == self.media_lib.generation
+
+    def _add_doc(self, playlist_id: int, item_index: int, words: Iterable[str]) -> None:
+        doc = len(self.doc_playlists)
+        self.doc_playlists.append(playlist_id)
+        self.doc_items.append(item_index)
+        for word in words:
+            id = self.vocab.get(word)
+            if id is None:
+                id = len(self.postings)
+                self.vocab[word] = id
+                self.postings.append(array('I'))
+            posting = self.postings[id]
+            if len(posting) == 0 or posting[-1] != doc:
+                posting.append(doc)
+
+    def _build(self) -> None:
+        albums: List[Tuple[int, int, str]] = []
+        songs: List[Tuple[int, int, List[str]]] = []
+        songs_seen: Set[int] = set()
+        self.kind_starts.append(0)
+        for playlist_id, playlist in enumerate(self.playlists):
+            self._add_doc(playlist_id, -1, tokenize(playlist.get_title() or ""))
+            if isinstance(playlist, LazyPlaylist) and not playlist.is_loaded():
+                self.items.append(None)
+                continue
+            albums_seen: Set[str] = set()
+            items = playlist.items
+            self.items.append(items)
+            for index in range(len(items)):
+                # A song in several playlists, or copied onto several volumes, is found in the first one
+                key = items.table.canonical_key(items.dirs[index], items.names[index])
+                if key not in songs_seen:
+                    songs_seen.add(key)
+                    item = items[index]
+                    words = tokenize(item.get_title())
+                    artist = item.get_artist()
+                    if artist:
+                        words.extend(tokenize(artist))
+                    songs.append((playlist_id, index, words))
+                album = items.table.albums[items.albums[index]]
+                if album not in albums_seen:
+                    albums_seen.add(album)
+                    albums.append((playlist_id, index, album))
+        self.kind_starts.append(len(self.doc_playlists))
+        for playlist_id, index, album in albums:
+            self._add_doc(playlist_id, index, tokenize(album))
+        self.kind_starts.append(len(self.doc_playlists))
+        for playlist_id, index, words in songs:
+            self._add_doc(playlist_id, index, words)
+        self.kind_starts.append(len(self.doc_playlists))
+
+    def _build_deletions(self) -> Dict[str, List[int]]:
+        deletions: Dict[str, List[int]] = {}
+        for word, id in self.vocab.items():
+            if len(word) >= MIN_FUZZY_LENGTH - 1:
+                for variant in self._variants(word):
+                    deletions.setdefault(variant, []).append(id)
+        return deletions
+
+    @staticmethod
+    def _variants(word: str) -> Set[str]:
+        """
+        :return: The word and the word with each letter in turn deleted
+        """
+        return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+    def _matches(self, word: str, fuzzy: bool) -> Dict[int, float]:
+        """
+        :return: The ids of the words in the index a query word matches, with their weights
+        """
+        matches: Dict[int, float] = {}
+        id = self.vocab.get(word)
+        if id is not None:
+            matches[id] = EXACT_WEIGHT
+        if len(word) >= MIN_PREFIX_LENGTH:
+            i = bisect_left(self.sorted_words, word)
+            while i < len(self.sorted_words) and self.sorted_words[i].startswith(word):
+                matches.setdefault(self.vocab[self.sorted_words[i]], PREFIX_WEIGHT)
+                i += 1
+        if len(matches) == 0 and fuzzy and len(word) >= MIN_FUZZY_LENGTH:
+            if self.deletions is None:
+                self.deletions = self._build_deletions()
+            for variant in self._variants(word):
+                for id in self.deletions.get(variant, ()):
+                    matches.setdefault(id, FUZZY_WEIGHT)
+        return matches
+
+    def _docs(self, id: int, ranges: List[Tuple[int, int]]) -> FrozenSet[int]:
+        """
+        :return: The documents in the ranges that use a word
+        """
+        key = (id, ranges[0][0], ranges[-1][1])
+        docs = self.doc_sets.get(key)
+        if docs is not None:
+            self.doc_sets.move_to_end(key)
+            return docs
+        posting = self.postings[id]
+        docs = frozenset().union(*(posting[bisect_left(posting, lo):bisect_left(posting, hi)] for lo, hi in ranges))
+        # Only the common case of one range of kinds is kept, e.g. everything or just playlists
+        if len(ranges) == 1:
+            self.doc_sets[key] = docs
+            if len(self.doc_sets) > DOC_SET_CACHE_SIZE:
+                self.doc_sets.popitem(last=False)
+        return docs
+
+    def search(self, query: str, kinds: Sequence[str] = ALL_KINDS, limit: int = 10,
+               fuzzy: bool = True) -> List[SearchHit]:
+        """
+        Find the playlists, albums and songs whose names contain every word of the query
+        :param query: The words to look for
+        :param kinds: Which kinds of thing to look for
+        :param limit: The most hits to return
+        :param fuzzy: Allow a letter to be wrong when a word doesn't match otherwise
+        :return: The best hits first
+        """
+        words = tokenize(query)
+        if len(words) == 0:
+            return []
+        # The ranges of documents of the kinds wanted, kinds next to each other make one range
+        ranges: List[Tuple[int, int]] = []
+        for code in sorted(KIND_CODES[kind] for kind in set(kinds)):
+            lo, hi = self.kind_starts[code], self.kind_starts[code + 1]
+            if len(ranges) > 0 and ranges[-1][1] == lo:
+                ranges[-1] = (ranges[-1][0], hi)
+            else:
+                ranges.append((lo, hi))
+        # For each word, the documents matching it at each weight, best weight first
+        per_word: List[List[Tuple[float, FrozenSet[int]]]] = []
+        for word in words:
+            by_weight: Dict[float, List[FrozenSet[int]]] = {}
+            for id, weight in self._matches(word, fuzzy).items():
+                by_weight.setdefault(weight, []).append(self._docs(id, ranges))
+            if len(by_weight) == 0:
+                return []
+            per_word.append([(weight, sets[0] if len(sets) == 1 else frozenset().union(*sets))
+                             for weight, sets in sorted(by_weight.items(), reverse=True)])
+        # Every word must match, start from the word with the fewest documents
+        all_docs = sorted((levels[0][1] if len(levels) == 1 else frozenset().union(*(docs for _, docs in levels))
+                           for levels in per_word), key=len)
+        candidates = set(all_docs[0].intersection(*all_docs[1:]))
+        if len(candidates) == 0:
+            return []
+        # Split the candidates by score, one word at a time
+        scores: Dict[float, Set[int]] = {0.0: candidates}
+        for levels in per_word:
+            if len(levels) == 1:
+                # Every candidate has this word, all at the same weight
+                scores = {score + levels[0][0]: docs for score, docs in scores.items()}
+                continue
+            next_scores: Dict[float, Set[int]] = {}
+            for score, docs in scores.items():
+                for weight, matched in levels:
+                    part = docs.intersection(matched)
+                    if len(part) > 0:
+                        docs -= part
+                        next_scores.setdefault(score + weight, set()).update(part)
+            scores = next_scores
+        hits: List[SearchHit] = []
+        for score in sorted(scores, reverse=True):
+            for doc in heapq.nsmallest(limit - len(hits), scores[score]):
+                hits.append(self._hit(doc, score / len(words)))
+            if len(hits) >= limit:
+                break
+        return hits
+
+    def _hit(self, doc: int, score: float) -> SearchHit:
+        kind = ALL_KINDS[bisect_right(self.kind_starts, doc) - 1]
+        playlist_id = self.doc_playlists[doc]
+        item_index = self.doc_items[doc]
+        playlist = self.playlists[playlist_id]
+        if kind == PLAYLIST:
+            name = playlist.get_title()
+        elif kind == ALBUM:
+            name = self.items[playlist_id][item_index].album_name
+        else:
+            name = self.items[playlist_id][item_index].get_title()
+        return SearchHit(kind=kind, playlist_id=playlist_id, item_index=item_index, name=name, score=score,
+                         playlist=playlist)
+
@@ -0,0 +1,347 @@
+"""
+A read-only copy of the media lib that other processes open with mmap instead of scanning
+the volumes again, e.g. the speech gateway or the tools printing QR cards. The player
+publishes it whenever its library changes. A reader maps the file and reads only what it
+asks for, so opening it takes milliseconds however big the library is, and every process
+reading the same file shares its pages.
+
+The file is a header, a table of fixed-width playlist records, a table of fixed-width item
+records, a table of string offsets and a heap of UTF-8 strings. Item records hold the numbers
+of their folder, file name and album in the string tables, as the ItemList arrays do in
+memory. The three tables are stored one after the other in the heap.
+
+Updates never change a published file. The new one is written aside and renamed over the
+old one, which is atomic, so a reader always sees a whole library. A reader keeps the file
+it mapped until it calls refreshed(), which maps the new one if it has been replaced.
+"""
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from itertools import accumulate
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from musiclib.item_table import ItemTable, SHARED_ITEM_TABLE
+from musiclib.media_lib import Item, ItemList, LazyPlaylist, MediaLib, Playlist
+
+SHARED_INDEX_MAGIC = b"MLSHARE\0"
+# Bump this when the layout of the file changes, readers refuse other versions
+SHARED_INDEX_VERSION = 1
+
+# Magic, version, generation, counts of playlists, items and strings, the first string of the
+# names, the albums and the rest, and where the playlists, items, string offsets and heap start
+HEADER = struct.Struct("<8sIQIIIIIIQQQQ")
+# Volume, kind, title and source strings, first item, number of items and flags
+PLAYLIST = struct.Struct("<IIIIIII")
+# Folder, file name and album, numbered within their own table
+ITEM = struct.Struct("<III")
+OFFSET = struct.Struct("<Q")
+
+# The source of a playlist made from a folder of songs
+NO_STRING = 0xFFFFFFFF
+# The playlist is lazy and wasn't loaded when the index was published, it has no items here
+NOT_LOADED = 1
+
+DEFAULT_PUBLISH_SECONDS = 5.0
+
+# Paths can hold bytes that aren't UTF-8, Python keeps them as surrogates
+ENCODING = 'utf-8'
+ERRORS = 'surrogateescape'
+
+
+@dataclass
+class SharedPlaylist():
+    volume: Path
+    kind: str
+    title: str
+    source: Optional[Path]
+    # The position of its first item in the item records
+    first: int
+    size: int
+    loaded: bool
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _little_endian(numbers: array) -> array:
+    if sys.byteorder == 'big':
+        numbers = array(numbers.typecode, numbers)
+        numbers.byteswap()
+    return numbers
+
+
+def publish(media_lib: MediaLib, path: Path, table: ItemTable = SHARED_ITEM_TABLE) -> int:
+    """
+    Write the media lib to the shared index, replacing the old one in one step
+    :param media_lib: The library
+    :param path: The shared index file
+    :param table: The item table most playlists use, its strings are written as they are
+    :return: The generation of the new index, one more than the one it replaces
+    """
+    playlists = list(media_lib.playlists)
+    columns: List[ItemList] = []
+    for playlist in playlists:
+        if isinstance(playlist, LazyPlaylist) and not playlist.is_loaded():
+            columns.append(ItemList(table=table))
+        elif playlist.items.table is not table:
+            columns.append(ItemList(playlist.items, table=table))
+        else:
+            columns.append(playlist.items)
+
+    # The tables only grow, taken after the items so they hold every string the items refer
+    # to. The whole of each goes in, so the item numbers are written as they are. The strings
+    # of the playlists themselves come after them.
+    strings: List[str] = table.dirs.strings[:] + table.names.strings[:] + table.albums.strings[:]
+    name_base = len(table.dirs)
+    album_base = name_base + len(table.names)
+    other_base = len(strings)
+    others: Dict[str, int] = {}
+
+    def other(s: str) -> int:
+        id = others.get(s)
+        if id is None:
+            id = len(strings)
+            strings.append(s)
+            others[s] = id
+        return id
+
+    records = bytearray()
+    item_count = sum(len(items) for items in columns)
+    item_records = array('I', bytes(ITEM.size * item_count))
+    first = 0
+    for playlist, items in zip(playlists, columns):
+        flags = NOT_LOADED if isinstance(playlist, LazyPlaylist) and not playlist.is_loaded() else 0
+        source = other(str(playlist.source)) if playlist.source is not None else NO_STRING
+        records += PLAYLIST.pack(other(str(playlist.volume)), other(playlist.kind), other(playlist.title or ""),
+                                 source, first, len(items), flags)
+        # Interleave the three columns into records without a Python loop per song
+        end = first + len(items)
+        item_records[3 * first:3 * end:3] = items.dirs
+        item_records[3 * first + 1:3 * end:3] = items.names
+        item_records[3 * first + 2:3 * end:3] = items.albums
+        first = end
+
+    encoded = [s.encode(ENCODING, ERRORS) for s in strings]
+    offsets = array('Q', [0])
+    offsets.extend(accumulate(len(data) for data in encoded))
+
+    playlists_at = _align(HEADER.size)
+    items_at = _align(playlists_at + len(records))
+    offsets_at = _align(items_at + item_count * ITEM.size)
+    heap_at = offsets_at + len(offsets) * OFFSET.size
+
+    generation = 1
+    current = SharedIndex.open(path)
+    if current is not None:
+        generation = current.generation + 1
+        current.close()
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Each process writes its own temporary file, the rename is what readers see
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(SHARED_INDEX_MAGIC, SHARED_INDEX_VERSION, generation, len(playlists), item_count,
+                            len(strings), name_base, album_base, other_base, playlists_at, items_at, offsets_at,
+                            heap_at))
+        for at, block in ((playlists_at, bytes(records)), (items_at, _little_endian(item_records).tobytes()),
+                          (offsets_at, _little_endian(offsets).tobytes())):
+            f.write(bytes(at - f.tell()))
+            f.write(block)
+        for data in encoded:
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return generation
+
+
+class SharedIndex:
+    """
+    A published index mapped into memory. Strings and items are decoded when asked for,
+    nothing is read up front but the header.
+    """
+
+    def __init__(self, path: Path):
+        """
+        :param path: The shared index file
+        :raises OSError: If it can't be opened
+        :raises ValueError: If it isn't a shared index this version can read
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            # Which file was mapped, a new one is renamed over it when the library changes
+            self.stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if st.st_size < HEADER.size:
+                raise ValueError("Shared index is truncated")
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.generation, self.playlist_count, self.item_count, self.string_count, self.name_base,
+         self.album_base, self.other_base, self.playlists_at, self.items_at, self.offsets_at, self.heap_at) = \
+            HEADER.unpack_from(self.data, 0)
+        if magic != SHARED_INDEX_MAGIC or version != SHARED_INDEX_VERSION:
+            self.data.close()
+            raise ValueError(f"Not a version {SHARED_INDEX_VERSION} shared index")
+        if self.heap_at > len(self.data):
+            self.data.close()
+            raise ValueError("Shared index is truncated")
+
+    @staticmethod
+    def open(path: Path) -> Optional["SharedIndex"]:
+        """
+        :param path: The shared index file
+        :return: The index, None if there isn't one or it can't be read
+        """
+        try:
+            return SharedIndex(path)
+        except (OSError, ValueError, struct.error) as e:
+            if path.exists():
+                logging.getLogger("comms.mqtt").warning("Shared index %s can't be read: %s", str(path), str(e))
+            return None
+
+    def close(self) -> None:
+        self.data.close()
+
+    def is_current(self) -> bool:
+        """
+        :return: False once a newer index has been published over this one
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return True
+        return (st.st_ino, st.st_mtime_ns, st.st_size) == self.stamp
+
+    def refreshed(self) -> "SharedIndex":
+        """
+        :return: This index if it is still current, or the one that replaced it, this one
+        is closed then
+        """
+        if self.is_current():
+            return self
+        newer = SharedIndex.open(self.path)
+        if newer is None:
+            return self
+        self.close()
+        return newer
+
+    def string(self, id: int) -> str:
+        start, end = struct.unpack_from("<QQ", self.data, self.offsets_at + id * OFFSET.size)
+        return self.data[self.heap_at + start:self.heap_at + end].decode(ENCODING, ERRORS)
+
+    def strings(self, start: int, end: int) -> List[str]:
+        """
+        :return: The strings numbered start up to end, read in one go
+        """
+        at = self.offsets_at + start * OFFSET.size
+        offsets = _little_endian(array('Q', self.data[at:at + (end - start + 1) * OFFSET.size]))
+        heap = self.data[self.heap_at + offsets[0]:self.heap_at + offsets[-1]]
+        base = offsets[0]
+        return [heap[a - base:b - base].decode(ENCODING, ERRORS) for a, b in zip(offsets, offsets[1:])]
+
+    def __len__(self) -> int:
+        return self.playlist_count
+
+    def playlist(self, playlist_id: int) -> SharedPlaylist:
+        """
+        :param playlist_id: The position of the playlist in the library
+        :return: What the index holds about it, not its items
+        """
+        if not 0 <= playlist_id < self.playlist_count:
+            raise IndexError(f"No playlist {playlist_id}, there are {self.playlist_count}")
+        volume, kind, title, source, first, size, flags = \
+            PLAYLIST.unpack_from(self.data, self.playlists_at + playlist_id * PLAYLIST.size)
+        return SharedPlaylist(volume=Path(self.string(volume)), kind=self.string(kind), title=self.string(title),
+                              source=Path(self.string(source)) if source != NO_STRING else None, first=first,
+                              size=size, loaded=not flags & NOT_LOADED)
+
+    def playlists(self) -> Iterator[SharedPlaylist]:
+        return (self.playlist(playlist_id) for playlist_id in range(self.playlist_count))
+
+    def item(self, playlist: SharedPlaylist, index: int) -> Item:
+        """
+        :param playlist: A playlist from this index
+        :param index: The position of the song in it
+        :return: The song
+        """
+        if not 0 <= index < playlist.size:
+            raise IndexError(f"No item {index}, there are {playlist.size}")
+        dir, name, album = ITEM.unpack_from(self.data, self.items_at + (playlist.first + index) * ITEM.size)
+        return Item(src=Path(os.path.join(self.string(dir), self.string(self.name_base + name))),
+                    album_name=self.string(self.album_base + album))
+
+    def items(self, playlist: SharedPlaylist) -> Iterator[Item]:
+        return (self.item(playlist, index) for index in range(playlist.size))
+
+    def to_media_lib(self, table: ItemTable = SHARED_ITEM_TABLE) -> MediaLib:
+        """
+        Make an ordinary media lib from the index, for a process that wants all of it. The
+        playlists that weren't loaded when it was published are empty.
+        :param table: The item table the playlists use
+        :return: The media lib
+        """
+        bases = (0, self.name_base, self.album_base, self.other_base)
+        # How the numbers in the file map to the numbers in the table, None if they are the same
+        mappings = [strings.intern_all(self.strings(bases[i], bases[i + 1]))
+                    for i, strings in enumerate((table.dirs, table.names, table.albums))]
+        records = _little_endian(array('I', self.data[self.items_at:self.items_at + self.item_count * ITEM.size]))
+        playlists: List[Playlist] = []
+        for shared in self.playlists():
+            items = ItemList(table=table)
+            start, end = 3 * shared.first, 3 * (shared.first + shared.size)
+            columns = []
+            for column, mapping in enumerate(mappings):
+                numbers = records[start + column:end:3]
+                columns.append(numbers if mapping is None else array('I', (mapping[n] for n in numbers)))
+            items.dirs, items.names, items.albums = columns
+            playlists.append(Playlist(volume=shared.volume, kind=shared.kind, title=shared.title, items=items,
+                                      source=shared.source))
+        return MediaLib(playlists=playlists)
+
+
+class SharedIndexPublisher:
+    """
+    Publishes the media lib when it changes, checked every few seconds in the background
+    """
+
+    def __init__(self, media_lib: MediaLib, path: Path, poll_seconds: float = DEFAULT_PUBLISH_SECONDS):
+        self.logger = logging.getLogger("comms.mqtt")
+        self.media_lib = media_lib
+        self.path = path
+        self.poll_seconds = poll_seconds
+        # The generation of the media lib last published
+        self.published: Optional[int] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self._run, name="shared-index-publisher", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.publish_if_changed()
+            except Exception as e:
+                self.logger.error("Problem publishing the shared index %s", str(e))
+            time.sleep(self.poll_seconds)
+
+    def publish_if_changed(self) -> bool:
+        """
+        :return: True if the library had changed and was published
+        """
+        generation = self.media_lib.generation
+        if generation == self.published:
+            return False
+        start = time.time()
+        shared_generation = publish(self.media_lib, self.path)
+        self.published = generation
+        self.logger.info("Shared index %d of %d playlists published to %s in %.2f seconds", shared_generation,
+                         len(self.media_lib.playlists), str(self.path), time.time() - start)
+        return True
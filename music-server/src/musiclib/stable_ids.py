@@ -0,0 +1,120 @@
+"""
+Ids for playlists and songs that don't change when drives are added or scanned in another
+order, so they can be printed on QR cards and RFID tokens. The positions used by the other
+commands move whenever the library changes.
+
+An id is a short hash of the path relative to the folder the volume is mounted in, e.g.
+"MUSIC/Playlists/Road Trip.wpl", so it is the same whichever machine or mount point the
+drive is read on. The single "All Items" playlist of a volume of songs uses the volume name
+and its title.
+"""
+import base64
+import hashlib
+import os
+import unicodedata
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from musiclib.media_lib import LazyPlaylist, MediaLib, Playlist
+
+# 48 bits, a library would need millions of songs before two were likely to share an id
+STABLE_ID_BYTES = 6
+
+
+def stable_id(key: str) -> str:
+    """
+    :param key: A volume relative path
+    :return: Its id, 10 lower case letters and digits
+    """
+    # The Mac writes accented names decomposed, use one form so both give the same id
+    key = unicodedata.normalize('NFC', key).replace(os.sep, '/')
+    digest = hashlib.blake2b(key.encode('utf-8', 'surrogateescape'), digest_size=STABLE_ID_BYTES).digest()
+    return base64.b32encode(digest).decode('ascii').rstrip('=').lower()
+
+
+def volume_relative(volume: Path, path: str) -> str:
+    """
+    :param volume: The volume holding a file, a song can be on another volume
+    :param path: The absolute path to the file
+    :return: The path from the folder the volume is mounted in, the path as it is if it isn't under it
+    """
+    mounts = str(volume.parent)
+    if path.startswith(mounts.rstrip(os.sep) + os.sep):
+        return path[len(mounts.rstrip(os.sep)) + 1:]
+    return path
+
+
+def playlist_stable_id(playlist: Playlist) -> str:
+    if playlist.source is not None:
+        return stable_id(volume_relative(playlist.volume, str(playlist.source)))
+    return stable_id(f"{playlist.volume.name}/{playlist.get_title()}")
+
+
+def item_stable_id(playlist: Playlist, index: int) -> str:
+    """
+    :param playlist: A playlist
+    :param index: The position of a song in it
+    :return: The id of the song, the same in every playlist holding it
+    """
+    items = playlist.items
+    relative_dir = volume_relative(playlist.volume, items.table.dirs[items.dirs[index]])
+    return stable_id(os.path.join(relative_dir, items.table.names[items.names[index]]))
+
+
+class StableIdIndex:
+    """
+    Maps ids to the current positions of the playlists and songs, built from a media lib and
+    knowing when it is out of date the same way as the search index. Lazy playlists that
+    aren't loaded are found but not their songs. The positions are those of the library the
+    index was built from, which it holds on to.
+    """
+
+    def __init__(self, media_lib: MediaLib):
+        self.media_lib = media_lib
+        self.generation = media_lib.generation
+        self.library: List[Playlist] = list(media_lib.playlists)
+        self.playlists: Dict[str, int] = {}
+        # The playlist and position of the first place each song is found, packed into one int
+        self.items: Dict[str, int] = {}
+        for playlist_id, playlist in enumerate(self.library):
+            self.playlists.setdefault(playlist_stable_id(playlist), playlist_id)
+            if isinstance(playlist, LazyPlaylist) and not playlist.is_loaded():
+                continue
+            items = playlist.items
+            # Each folder's relative path is worked out once, not once per song
+            relative_dirs: Dict[int, str] = {}
+            for index in range(len(items)):
+                dir_id = items.dirs[index]
+                relative_dir = relative_dirs.get(dir_id)
+                if relative_dir is None:
+                    relative_dir = volume_relative(playlist.volume, items.table.dirs[dir_id])
+                    relative_dirs[dir_id] = relative_dir
+                key = stable_id(os.path.join(relative_dir, items.table.names[items.names[index]]))
+                self.items.setdefault(key, (playlist_id << 32) | index)
+
+    def is_current(self) -> bool:
+        return self.generation == self.media_lib.generation
+
+    def get_playlist(self, playlist_id: int) -> Playlist:
+        """
+        :param playlist_id: A position found in this index
+        :return: The playlist that was there when the index was built
+        """
+        return self.library[playlist_id]
+
+    def find_playlist(self, id: str) -> Optional[int]:
+        """
+        :param id: The stable id of a playlist
+        :return: Its position in the media lib, None if there is no such playlist
+        """
+        return self.playlists.get(id.strip().lower())
+
+    def find_item(self, id: str) -> Optional[Tuple[int, int]]:
+        """
+        :param id: The stable id of a song
+        :return: The position of the first playlist holding it and its position in that playlist
+        """
+        packed = self.items.get(id.strip().lower())
+        if packed is None:
+            return None
+        return packed >> 32, packed & 0xFFFFFFFF
@@ -0,0 +1,229 @@
+"""
+Reads the tags of the music files, the title, artist, album and length, so the player can
+say more than the file name. Reading tags means opening every file, which is slow on a USB
+drive, so it is done in a pool of processes after the library has loaded, and the results
+are kept in a SQLite cache keyed by path, size and mtime so a restart only reads the files
+that changed.
+"""
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import mutagen
+
+from musiclib.item_table import ItemTable
+from musiclib.media_lib import LazyPlaylist, MediaLib
+
+# Number of processes reading tags, reading is mostly parsing so it is done in processes
+DEFAULT_TAG_WORKERS = 2
+
+# Files handed to a worker at a time, keeps the pickling overhead down
+TAG_BATCH_SIZE = 64
+
+TAGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tags (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    title TEXT,
+    artist TEXT,
+    album TEXT,
+    duration REAL);
+"""
+
+
+@dataclass
+class TrackTags():
+    __slots__ = ('title', 'artist', 'album', 'duration')
+
+    # The title of the song, None if the file doesn't have one
+    title: Optional[str]
+    artist: Optional[str]
+    album: Optional[str]
+    # The length of the song in seconds
+    duration: Optional[float]
+
+    def is_empty(self) -> bool:
+        return self.title is None and self.artist is None and self.album is None and self.duration is None
+
+
+def read_tags(path: str) -> Optional[TrackTags]:
+    """
+    Read the ID3 or Vorbis tags of a music file
+    :param path: The path to the file
+    :return: The tags, None if the file can't be read
+    """
+    try:
+        audio = mutagen.File(path, easy=True)
+    except Exception:
+        return None
+    if audio is None:
+        return None
+    tags = audio.tags or {}
+
+    def first(key: str) -> Optional[str]:
+        values = tags.get(key)
+        return values[0] if values else None
+
+    duration = getattr(audio.info, 'length', None) if audio.info is not None else None
+    return TrackTags(title=first('title'), artist=first('artist'), album=first('album'), duration=duration)
+
+
+def read_tags_batch(paths: List[str]) -> List[Optional[Tuple]]:
+    """
+    Run in the worker processes, tuples are returned as they pickle smaller
+    """
+    result = []
+    for path in paths:
+        tags = read_tags(path)
+        result.append(None if tags is None else (tags.title, tags.artist, tags.album, tags.duration))
+    return result
+
+
+class TagCache:
+    """
+    The tags read so far, in a SQLite database. An entry is only used if the file still
+    has the size and mtime it had when it was read.
+    """
+
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(TAGS_SCHEMA)
+
+    def lookup(self) -> Dict[str, Tuple[int, int, TrackTags]]:
+        """
+        :return: The size and mtime of each file when it was read, and its tags
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT path, size, mtime_ns, title, artist, album, duration FROM tags").fetchall()
+        return {path: (size, mtime_ns, TrackTags(title=title, artist=artist, album=album, duration=duration))
+                for path, size, mtime_ns, title, artist, album, duration in rows}
+
+    def store(self, rows: List[Tuple[str, int, int, TrackTags]]) -> None:
+        """
+        :param rows: The path, size, mtime and tags of files that were read
+        :return: Nothing
+        """
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO tags (path, size, mtime_ns, title, artist, album, duration) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(path, size, mtime_ns, tags.title, tags.artist, tags.album, tags.duration)
+                 for path, size, mtime_ns, tags in rows])
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+class TagScanner:
+    """
+    Fills in the tags of the items in the media lib, in the background so the player
+    is ready to go before the tags have all been read
+    """
+
+    def __init__(self, media_lib: MediaLib, cache: TagCache = None, workers: int = DEFAULT_TAG_WORKERS):
+        """
+        :param media_lib: The library whose items want tags
+        :param cache: Optional cache, files whose size and mtime are unchanged are not read again
+        :param workers: Number of processes reading tags, 1 reads them in the calling thread
+        """
+        self.logger = logging.getLogger("comms.mqtt")
+        self.media_lib = media_lib
+        self.cache = cache
+        self.workers = workers
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self._run, name="tag-scanner", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        try:
+            self.scan()
+        except Exception as e:
+            self.logger.error("Problem reading tags %s", str(e))
+
+    def _songs(self) -> Dict[str, List[ItemTable]]:
+        """
+        :return: Each song named by a playlist whose items are in memory, with the tables holding it,
+        leaving out the copies of other songs
+        """
+        songs: Dict[str, List[ItemTable]] = {}
+        for playlist in self.media_lib.playlists:
+            if isinstance(playlist, LazyPlaylist) and not playlist.is_loaded():
+                continue
+            items = playlist.items
+            for src, _ in items.entries():
+                if items.table.is_duplicate(src):
+                    # Its tags are those of the copy that stands for it
+                    continue
+                tables = songs.setdefault(src, [])
+                if items.table not in tables:
+                    tables.append(items.table)
+        return songs
+
+    def scan(self) -> int:
+        """
+        Read the tags that aren't in the cache and set the tags of every song
+        :return: The number of files that were read
+        """
+        songs = self._songs()
+        cached = self.cache.lookup() if self.cache is not None else {}
+        misses: List[Tuple[str, int, int]] = []
+        for path, tables in songs.items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entry = cached.get(path)
+            if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+                self._set_tags(path, tables, entry[2])
+            else:
+                misses.append((path, st.st_size, st.st_mtime_ns))
+        self.logger.info("Tags for %d songs cached, reading %d", len(songs) - len(misses), len(misses))
+        if len(misses) == 0:
+            self.media_lib.changed()
+            return 0
+
+        batches = [misses[i:i + TAG_BATCH_SIZE] for i in range(0, len(misses), TAG_BATCH_SIZE)]
+        if self.workers <= 1:
+            self._read_batches(batches, songs, map(read_tags_batch, ([p for p, _, _ in b] for b in batches)))
+        else:
+            # Spawned rather than forked, the player already has threads running
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) \
+                    as executor:
+                self._read_batches(batches, songs, executor.map(read_tags_batch, [[p for p, _, _ in b]
+                                                                                  for b in batches]))
+        # Song titles and artists have changed
+        self.media_lib.changed()
+        return len(misses)
+
+    def _read_batches(self, batches: List[List[Tuple[str, int, int]]], songs: Dict[str, List[ItemTable]],
+                      results: Iterator[List[Optional[Tuple]]]) -> None:
+        for batch, batch_tags in zip(batches, results):
+            rows: List[Tuple[str, int, int, TrackTags]] = []
+            for (path, size, mtime_ns), values in zip(batch, batch_tags):
+                # Files that can't be read are cached too, so they aren't tried again every time
+                tags = TrackTags(None, None, None, None) if values is None else TrackTags(*values)
+                self._set_tags(path, songs[path], tags)
+                rows.append((path, size, mtime_ns, tags))
+            if self.cache is not None:
+                self.cache.store(rows)
+
+    @staticmethod
+    def _set_tags(path: str, tables: List[ItemTable], tags: TrackTags) -> None:
+        if tags.is_empty():
+            return
+        for table in tables:
+            table.set_tags(path, tags)
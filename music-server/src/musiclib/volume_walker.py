@@ -0,0 +1,163 @@
+"""
+Walks a volume once with os.scandir, classifies it and collects the playlist and music
+files on it. This replaces the separate rglob passes that parse_lib used to make, one to
+count the text playlists, one to read them and one more to find all the MP3s.
+"""
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from musiclib.playlist_formats import WPL_SUFFIX, is_playlist
+
+# Folders that operating systems create on removable drives, never any music in these
+SYSTEM_DIRS = frozenset({'.Trashes', 'System Volume Information', '.Spotlight-V100', '.fseventsd',
+                         '.TemporaryItems', '$RECYCLE.BIN', 'lost+found'})
+
+MUSIC_SUFFIXES = ('.mp3',)
+
+# The ways a volume can be organised, see MediaLibParsers.parse_lib
+WINDOWS_MEDIA = "Windows Media"
+PLAYLIST_FILES = "Playlist Files"
+SINGLE = "Single"
+
+
+@dataclass
+class FileRecord():
+    # The absolute path to the file
+    path: str
+    # The directory holding the file
+    dir: str
+    # Size in bytes and modification time in nano-seconds, zero unless the listing asked for them
+    size: int = 0
+    mtime_ns: int = 0
+
+
+@dataclass
+class DirListing():
+    # The sub-directories worth descending into
+    subdirs: List[str]
+    # The playlist and music files in the directory
+    files: List[FileRecord]
+
+
+@dataclass
+class VolumeScan():
+    # The root of the volume
+    volume: Path
+    # One of WINDOWS_MEDIA, PLAYLIST_FILES or SINGLE
+    kind: str
+    # The files found, each sorted by path. Only the ones needed for the kind are filled in
+    wpl_files: List[FileRecord] = field(default_factory=list)
+    # Playlists in any of the registered formats, found anywhere on the volume
+    playlist_files: List[FileRecord] = field(default_factory=list)
+    music_files: List[FileRecord] = field(default_factory=list)
+    # How many directories were listed to find them
+    dirs_listed: int = 0
+
+
+def is_skipped_dir(name: str) -> bool:
+    return name.startswith('.') or name in SYSTEM_DIRS
+
+
+def list_dir(path: str, with_stat: bool = False) -> Optional[DirListing]:
+    """
+    List a single directory
+    :param path: The directory to list
+    :param with_stat: Fill in the size and mtime of each file, costs a stat per file on most systems
+    :return: The sub-directories and the interesting files it holds, None if it can't be read
+    """
+    subdirs: List[str] = []
+    files: List[FileRecord] = []
+    try:
+        it = os.scandir(path)
+    except OSError:
+        return None
+    with it:
+        for entry in it:
+            name = entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not is_skipped_dir(name):
+                        subdirs.append(entry.path)
+                elif is_playlist(name) or (name.endswith(MUSIC_SUFFIXES) and not name.startswith('.')):
+                    if with_stat:
+                        st = entry.stat()
+                        files.append(FileRecord(path=entry.path, dir=path, size=st.st_size, mtime_ns=st.st_mtime_ns))
+                    else:
+                        files.append(FileRecord(path=entry.path, dir=path))
+            except OSError:
+                continue
+    return DirListing(subdirs=subdirs, files=files)
+
+
+class VolumeWalker:
+    """
+    Classifies a volume and collects its files in a single pass. The directory lister
+    can be swapped out, the library index uses that to answer from its cache.
+    """
+
+    def __init__(self, lister: Callable[[str], Optional[DirListing]] = list_dir):
+        self.lister = lister
+
+    def scan(self, volume: Path) -> VolumeScan:
+        """
+        A volume with WPL files in its Playlists folder is a Windows Media volume and nothing
+        else needs to be looked at. Otherwise the whole volume is walked once; if it holds any
+        playlists, in any of the registered formats, those are used, if not every MP3 goes into
+        a single playlist.
+        :param volume: The root of the volume
+        :return: What was found
+        """
+        dirs_listed = 0
+        playlists_root = str(volume.joinpath("Playlists"))
+        if os.path.isdir(playlists_root):
+            listing = self.lister(playlists_root)
+            dirs_listed += 1
+            if listing is not None:
+                wpl_files = [f for f in listing.files if f.path.endswith(WPL_SUFFIX)]
+                if len(wpl_files) > 0:
+                    wpl_files.sort(key=lambda f: f.path)
+                    return VolumeScan(volume=volume, kind=WINDOWS_MEDIA, wpl_files=wpl_files, dirs_listed=dirs_listed)
+
+        playlist_files: List[FileRecord] = []
+        music_files: List[FileRecord] = []
+        stack: List[str] = [str(volume)]
+        while stack:
+            listing = self.lister(stack.pop())
+            dirs_listed += 1
+            if listing is None:
+                continue
+            for f in listing.files:
+                if is_playlist(f.path):
+                    if len(playlist_files) == 0:
+                        music_files = []
+                    playlist_files.append(f)
+                elif len(playlist_files) == 0 and f.path.endswith(MUSIC_SUFFIXES):
+                    # Only needed if the volume turns out to have no playlists
+                    music_files.append(f)
+            stack.extend(listing.subdirs)
+
+        if len(playlist_files) > 0:
+            playlist_files.sort(key=lambda f: f.path)
+            return VolumeScan(volume=volume, kind=PLAYLIST_FILES, playlist_files=playlist_files,
+                              dirs_listed=dirs_listed)
+        music_files.sort(key=lambda f: f.path)
+        return VolumeScan(volume=volume, kind=SINGLE, music_files=music_files, dirs_listed=dirs_listed)
+
+    def find_music(self, volume: Path) -> List[FileRecord]:
+        """
+        Walk the whole volume and collect every music file, whatever kind of volume it is
+        :param volume: The root of the volume
+        :return: The music files sorted by path
+        """
+        music_files: List[FileRecord] = []
+        stack: List[str] = [str(volume)]
+        while stack:
+            listing = self.lister(stack.pop())
+            if listing is None:
+                continue
+            music_files.extend(f for f in listing.files if f.path.endswith(MUSIC_SUFFIXES))
+            stack.extend(listing.subdirs)
+        music_files.sort(key=lambda f: f.path)
+        return music_files
@@ -1,18 +1,35 @@
 import logging
 import subprocess
+from typing import List
 
 logger = logging.getLogger("text.to.speech")
 
+# The flite voice everything is spoken in
+VOICE = 'slt'
+
+
+def flite_command(text: str, voice: str = VOICE, output: str = None) -> List[str]:
+    """
+    :param text: Words to say
+    :param voice: The flite voice
+    :param output: A WAV file to write the speech to instead of playing it
+    :return: The command line that says them with flite
+    """
+    command = ['flite', '-voice', voice, '-t', text]
+    if output is not None:
+        command += ['-o', output]
+    return command
+
 
 def do_text_to_speech(text: str) -> None:
     """
     Invoke a subprocess to cause flite to speak the text. This requires flite to have
-    been installed. This blocks until the speech has finished
+    been installed. This blocks until the speech has finished, see speech_queue.py for
+    speaking without waiting
     :param text: Should be a short English phrase to be spoken
     :return: None
     """
-    cmd = 'flite -voice slt ' + f"\"{text}\""
     try:
-        subprocess.call(cmd, shell=True)
+        subprocess.call(flite_command(text))
     except Exception as e:
         logger.error("Problem speechifying %s", str(e))
@@ -12,7 +12,7 @@ from comms import run_tasks_in_parallel_no_block
 from comms.mqtt_comms import SensorListener, MqttComms
 from messages.music_control import TextToSpeech
 from messages.serdeser import cmd_from_json
-from speech import do_text_to_speech
+from speech.speech_queue import SpeechQueue
 
 """
 This is the music player, it receives commands from the mqtt broker and controls
@@ -31,6 +31,9 @@ class SpeechGatewayListener(SensorListener):
 
     def __init__(self):
         self.logger = logging.getLogger("comms.mqtt")
+        # Spoken in order on a thread of its own so messages keep being taken in
+        self.speech = SpeechQueue()
+        self.speech.start()
 
     def on_disconnect(self, reason: str):
         self.logger.debug("Disconnection event %s", reason)
@@ -44,7 +47,7 @@ class SpeechGatewayListener(SensorListener):
             cmd = cmd_from_json(cmd_str)
             self.logger.info("Message received Topic (%s) Type(%s) Payload (%s)", topic, type(cmd), str(cmd))
             if isinstance(cmd, TextToSpeech):
-                do_text_to_speech(cmd.payload)
+                self.speech.say(cmd.payload)
             else:
                 self.logger.warning("Unsupported cmd type %s", type(cmd))
         except Exception as e:
@@ -0,0 +1,182 @@
+"""
+Speaks announcements from WAV files made once by flite and kept on disk, so the phrases
+said over and over, "Stop the player", "Set volume 50", the playlist titles, come out at
+once through the pygame mixer instead of waiting for flite to start up and synthesise them
+again every time. The files are keyed by the voice and the text and the cache has a limit
+on its size, the least recently used phrases are deleted to keep under it.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import pygame
+
+from speech import VOICE, flite_command
+from speech.speech_queue import ProcessSpeaker, Speaker, Speaking
+
+DEFAULT_PHRASE_CACHE_BYTES = 32 * 1024 * 1024
+
+# The mixer channel kept for speech, so sound effects never take it
+SPEECH_CHANNEL = 0
+
+
+class PhraseCache:
+    """
+    The WAV files of the phrases spoken so far, in one folder
+    """
+
+    def __init__(self, folder: Path, voice: str = VOICE, max_bytes: int = DEFAULT_PHRASE_CACHE_BYTES,
+                 command: Callable[[str, str, str], List[str]] = flite_command):
+        """
+        :param folder: Where the files are kept, they are found again after a restart
+        :param voice: The flite voice the phrases are made in
+        :param max_bytes: The most the files can take up
+        :param command: Makes the command line that writes some text in a voice to a WAV file
+        """
+        self.logger = logging.getLogger("text.to.speech")
+        self.folder = folder
+        self.voice = voice
+        self.max_bytes = max_bytes
+        self.command = command
+        self.lock = threading.Lock()
+        folder.mkdir(parents=True, exist_ok=True)
+        # The size of each file keyed by name, least recently used first, the last use is its mtime
+        self.files: "OrderedDict[str, int]" = OrderedDict()
+        found = []
+        for entry in os.scandir(folder):
+            if entry.name.endswith(".wav") and entry.is_file():
+                st = entry.stat()
+                found.append((st.st_mtime_ns, entry.name, st.st_size))
+        for _, name, size in sorted(found):
+            self.files[name] = size
+        self.total_bytes = sum(self.files.values())
+
+    def key(self, text: str) -> str:
+        """
+        :return: The name of the file of a phrase
+        """
+        digest = hashlib.blake2b(f"{self.voice}\0{text}".encode('utf-8'), digest_size=16).hexdigest()
+        return f"{digest}.wav"
+
+    def lookup(self, text: str) -> Optional[Path]:
+        """
+        :param text: A phrase
+        :return: Its WAV file, None if it hasn't been made
+        """
+        name = self.key(text)
+        with self.lock:
+            if name not in self.files:
+                return None
+            self.files.move_to_end(name)
+        path = self.folder.joinpath(name)
+        try:
+            os.utime(path)
+        except OSError:
+            # Deleted by someone else
+            with self.lock:
+                self.total_bytes -= self.files.pop(name, 0)
+            return None
+        return path
+
+    def has(self, text: str) -> bool:
+        """
+        :return: True if the phrase has been made, without counting as a use
+        """
+        with self.lock:
+            return self.key(text) in self.files
+
+    def render(self, text: str, nice: int = 0) -> Optional[Path]:
+        """
+        Make the WAV file of a phrase, if it hasn't been made already
+        :param text: A phrase
+        :param nice: How much to lower the priority of flite, for making phrases ahead of time
+        :return: Its WAV file, None if flite failed
+        """
+        path = self.lookup(text)
+        if path is not None:
+            return path
+        name = self.key(text)
+        path = self.folder.joinpath(name)
+        # Written aside and moved in so a half written file is never played
+        temp_path = self.folder.joinpath(f"{name}.{threading.get_ident()}.tmp")
+        start = time.perf_counter()
+        try:
+            command = self.command(text, self.voice, str(temp_path))
+            # Through nice(1), a preexec_fn isn't safe with the other threads running
+            if nice > 0 and shutil.which('nice') is not None:
+                command = ['nice', '-n', str(nice)] + command
+            subprocess.run(command, check=True)
+            os.replace(temp_path, path)
+            size = path.stat().st_size
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.logger.error("Problem making the speech for %s %s", text, str(e))
+            if temp_path.exists():
+                temp_path.unlink()
+            return None
+        self.logger.debug("Made the speech for %s in %.0f ms", text, (time.perf_counter() - start) * 1000)
+        evicted = []
+        with self.lock:
+            self.total_bytes += size - self.files.pop(name, 0)
+            self.files[name] = size
+            while self.total_bytes > self.max_bytes and len(self.files) > 1:
+                old, old_size = self.files.popitem(last=False)
+                self.total_bytes -= old_size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                self.folder.joinpath(old).unlink()
+            except OSError:
+                pass
+        return path
+
+
+class _ChannelSpeaking(Speaking):
+    def __init__(self, channel: pygame.mixer.Channel, sound: pygame.mixer.Sound):
+        self.channel = channel
+        # Held until it has been played
+        self.sound = sound
+        # The channel has just been told to play it
+        self.ends_at = time.monotonic() + sound.get_length()
+        self.stopped = threading.Event()
+
+    def wait(self) -> None:
+        # Woken early when it is cut short
+        self.stopped.wait(max(0.0, self.ends_at - time.monotonic()))
+
+    def stop(self) -> None:
+        self.channel.stop()
+        self.stopped.set()
+
+
+class PhraseSpeaker(Speaker):
+    """
+    Plays the phrases from the cache on a mixer channel of their own, over the music,
+    making them first if they aren't there. Needs the mixer to have been started.
+    """
+
+    def __init__(self, phrases: PhraseCache, fallback: Speaker = None):
+        """
+        :param phrases: The cache
+        :param fallback: Speaks a phrase that couldn't be made, runs flite if not given
+        """
+        self.phrases = phrases
+        self.fallback = fallback if fallback is not None else ProcessSpeaker()
+        self.channel: Optional[pygame.mixer.Channel] = None
+
+    def speak(self, text: str) -> Speaking:
+        path = self.phrases.render(text)
+        if path is None:
+            return self.fallback.speak(text)
+        if self.channel is None:
+            pygame.mixer.set_reserved(SPEECH_CHANNEL + 1)
+            self.channel = pygame.mixer.Channel(SPEECH_CHANNEL)
+        sound = pygame.mixer.Sound(str(path))
+        self.channel.play(sound)
+        return _ChannelSpeaking(self.channel, sound)
@@ -0,0 +1,61 @@
+"""
+Makes the phrases the player is going to say into the phrase cache in the background, once
+the library is known, so even the first "Play list has been set to ..." is heard at once.
+flite is run at a low priority and the job rests between phrases so it never takes more
+than a share of the CPU away from the music. It stops once the cache is part full so the
+phrases actually said aren't pushed out by ones that may never be.
+"""
+import logging
+import time
+from typing import Iterable
+
+from speech.phrase_cache import PhraseCache
+
+# Added to the nice value of flite
+DEFAULT_NICE = 10
+# The most of one CPU the job takes, on average
+DEFAULT_CPU_FRACTION = 0.25
+# Stop once the cache is this full
+DEFAULT_FILL_FRACTION = 0.5
+
+
+class Presynthesizer:
+    """
+    Makes phrases ahead of time
+    """
+
+    def __init__(self, phrases: PhraseCache, nice: int = DEFAULT_NICE, cpu_fraction: float = DEFAULT_CPU_FRACTION,
+                 fill_fraction: float = DEFAULT_FILL_FRACTION):
+        """
+        :param phrases: The cache the speaker plays from
+        :param nice: How much to lower the priority of flite
+        :param cpu_fraction: Rest between phrases for long enough to keep to this share of a CPU
+        :param fill_fraction: Stop when the cache is this full
+        """
+        self.logger = logging.getLogger("text.to.speech")
+        self.phrases = phrases
+        self.nice = nice
+        self.cpu_fraction = cpu_fraction
+        self.fill_fraction = fill_fraction
+
+    def run(self, texts: Iterable[str]) -> int:
+        """
+        Make the phrases that aren't in the cache yet, in order
+        :param texts: The phrases, the most wanted first
+        :return: The number made
+        """
+        made = 0
+        start = time.perf_counter()
+        for text in texts:
+            if self.phrases.has(text):
+                continue
+            if self.phrases.total_bytes >= self.phrases.max_bytes * self.fill_fraction:
+                self.logger.info("Phrase cache is %d bytes, stopped making phrases", self.phrases.total_bytes)
+                break
+            rendered = time.perf_counter()
+            if self.phrases.render(text, nice=self.nice) is not None:
+                made += 1
+            busy = time.perf_counter() - rendered
+            time.sleep(busy * (1 - self.cpu_fraction) / self.cpu_fraction)
+        self.logger.info("Made %d phrases ahead of time in %.1f seconds", made, time.perf_counter() - start)
+        return made
@@ -0,0 +1,220 @@
+"""
+Speaks announcements one at a time on a thread of its own, so whoever asks for them carries
+on at once instead of waiting for flite to finish talking. The most urgent announcement is
+spoken first. An announcement on the same topic as one still waiting replaces it, and cuts
+short the one being spoken, so only the latest "Set volume" is heard after a burst of them.
+How long announcements wait and how many are waiting is kept as metrics.
+
+A speaker does the speaking, a flite process each time, or from the phrase cache through
+the mixer, see phrase_cache.py.
+"""
+import abc
+import logging
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from speech import flite_command
+
+# Priorities, the lowest number is spoken first
+URGENT = 0
+NORMAL = 1
+LOW = 2
+
+
+@dataclass
+class Announcement():
+    text: str
+    # Announcements on the same topic replace each other, None for ones that never are
+    topic: Optional[str]
+    priority: int
+    # Order of arrival, announcements of the same priority are spoken in this order
+    seq: int
+    queued_at: float
+    # Set once it has been spoken, replaced or cut short
+    done: threading.Event = field(default_factory=threading.Event, repr=False)
+    # True if it was replaced or cut short
+    cancelled: bool = False
+    # Called once it is done, on the speech thread unless it was replaced
+    on_done: Optional[Callable[[], None]] = field(default=None, repr=False)
+
+
+@dataclass
+class SpeechMetrics():
+    # Announcements waiting now, and the most there have been
+    depth: int = 0
+    max_depth: int = 0
+    spoken: int = 0
+    # Replaced while waiting, and cut short while being spoken
+    replaced: int = 0
+    cut_short: int = 0
+    # Seconds from being asked for to starting to speak, of the last announcement and on average
+    last_latency: float = 0.0
+    mean_latency: float = 0.0
+
+
+class Speaking(abc.ABC):
+    """
+    An announcement being spoken
+    """
+
+    @abc.abstractmethod
+    def wait(self) -> None:
+        """
+        Block until it has been spoken or stopped
+        """
+
+    @abc.abstractmethod
+    def stop(self) -> None:
+        pass
+
+
+class Speaker(abc.ABC):
+    @abc.abstractmethod
+    def speak(self, text: str) -> Speaking:
+        """
+        Start speaking
+        :param text: Should be a short English phrase to be spoken
+        :return: The speech, which carries on after this returns
+        :raises Exception: If it can't be spoken
+        """
+
+
+class _ProcessSpeaking(Speaking):
+    def __init__(self, process: subprocess.Popen):
+        self.process = process
+
+    def wait(self) -> None:
+        self.process.wait()
+
+    def stop(self) -> None:
+        self.process.terminate()
+
+
+class ProcessSpeaker(Speaker):
+    """
+    Runs flite for every announcement
+    """
+
+    def __init__(self, command: Callable[[str], List[str]] = flite_command):
+        """
+        :param command: Makes the command line that speaks some text
+        """
+        self.command = command
+
+    def speak(self, text: str) -> Speaking:
+        return _ProcessSpeaking(subprocess.Popen(self.command(text)))
+
+
+class SpeechQueue:
+    """
+    A priority queue of announcements and the thread speaking them
+    """
+
+    def __init__(self, speaker: Speaker = None):
+        """
+        :param speaker: Speaks each announcement, runs flite if not given
+        """
+        self.logger = logging.getLogger("text.to.speech")
+        self.speaker = speaker if speaker is not None else ProcessSpeaker()
+        self.pending: List[Announcement] = []
+        self.current: Optional[Announcement] = None
+        self.speaking: Optional[Speaking] = None
+        self.condition = threading.Condition()
+        self.seq = 0
+        self.stats = SpeechMetrics()
+        self.total_latency = 0.0
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self._run, name="speech", daemon=True)
+        self.thread.start()
+
+    def say(self, text: str, topic: str = None, priority: int = NORMAL,
+            on_done: Callable[[], None] = None) -> Announcement:
+        """
+        Queue an announcement and return at once
+        :param text: Should be a short English phrase to be spoken
+        :param topic: What it is about, e.g. "volume", it replaces the announcements on the same topic
+        :param priority: URGENT, NORMAL or LOW
+        :param on_done: Called once it has been spoken, replaced or cut short
+        :return: The announcement, wait on its done event to know when it has been spoken
+        """
+        with self.condition:
+            if topic is not None:
+                for stale in [a for a in self.pending if a.topic == topic]:
+                    self.pending.remove(stale)
+                    self._finish(stale, cancelled=True)
+                    self.stats.replaced += 1
+                if self.current is not None and self.current.topic == topic:
+                    # If it is still starting it is stopped as soon as it has started
+                    self.current.cancelled = True
+                    if self.speaking is not None:
+                        self.speaking.stop()
+            self.seq += 1
+            announcement = Announcement(text=text, topic=topic, priority=priority, seq=self.seq,
+                                        queued_at=time.monotonic(), on_done=on_done)
+            self.pending.append(announcement)
+            self.stats.max_depth = max(self.stats.max_depth, len(self.pending))
+            self.condition.notify_all()
+        return announcement
+
+    def wait(self) -> None:
+        """
+        Block until everything asked for so far has been spoken
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.pending) == 0 and self.current is None)
+
+    def metrics(self) -> SpeechMetrics:
+        """
+        :return: A copy of the metrics as they are now
+        """
+        with self.condition:
+            return SpeechMetrics(depth=len(self.pending), max_depth=self.stats.max_depth, spoken=self.stats.spoken,
+                                 replaced=self.stats.replaced, cut_short=self.stats.cut_short,
+                                 last_latency=self.stats.last_latency, mean_latency=self.stats.mean_latency)
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.pending) > 0)
+                announcement = min(self.pending, key=lambda a: (a.priority, a.seq))
+                self.pending.remove(announcement)
+                self.current = announcement
+            # Starting can take a while, e.g. making the speech, new announcements are taken meanwhile
+            speaking = None
+            try:
+                speaking = self.speaker.speak(announcement.text)
+            except Exception as e:
+                self.logger.error("Problem speechifying %s", str(e))
+            latency = time.monotonic() - announcement.queued_at
+            if speaking is not None:
+                with self.condition:
+                    self.speaking = speaking
+                    if announcement.cancelled:
+                        speaking.stop()
+                speaking.wait()
+            with self.condition:
+                if speaking is not None:
+                    self.stats.spoken += 1
+                    self.stats.last_latency = latency
+                    self.total_latency += latency
+                    self.stats.mean_latency = self.total_latency / self.stats.spoken
+                    if announcement.cancelled:
+                        self.stats.cut_short += 1
+                self._finish(announcement, announcement.cancelled)
+                self.current = None
+                self.speaking = None
+                self.condition.notify_all()
+
+    def _finish(self, announcement: Announcement, cancelled: bool) -> None:
+        announcement.cancelled = cancelled
+        announcement.done.set()
+        if announcement.on_done is not None:
+            try:
+                announcement.on_done()
+            except Exception as e:
+                self.logger.error("Problem after speaking %s", str(e))
@@ -0,0 +1,54 @@
+"""
+Fixtures and helpers shared by the tests
+"""
+import os
+import sys
+from pathlib import Path
+from typing import Union
+
+import pytest
+
+from client_player.music_player import MusicPlayer
+from musiclib.media_lib import MediaLib
+from speech.speech_queue import ProcessSpeaker, SpeechQueue
+
+
+def touch(path: Path, data: Union[str, bytes] = "") -> None:
+    """
+    Write a file, and the folders it is in
+    :param path: The file
+    :param data: Its contents, text or bytes
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if isinstance(data, bytes):
+        path.write_bytes(data)
+    else:
+        path.write_text(data)
+
+
+def contents(media_lib: MediaLib):
+    """
+    :return: What the playlists of a library hold, to compare libraries read different ways
+    """
+    return [(p.volume, p.kind, p.title, p.source, list(p.items.entries())) for p in media_lib.playlists]
+
+
+@pytest.fixture
+def make_player():
+    """
+    Makes players with the dummy sound driver and a speaker that says nothing, running each
+    command at once, and closes them after the test so none carries on into the next
+    """
+    players = []
+
+    def make(media_lib: MediaLib, **kwargs) -> MusicPlayer:
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+        speech = SpeechQueue(ProcessSpeaker(lambda text: [sys.executable, "-c", "pass"]))
+        speech.start()
+        player = MusicPlayer(media_lib, speech=speech, coalesce_seconds=0, **kwargs)
+        players.append(player)
+        return player
+
+    yield make
+    for player in players:
+        player.close()
@@ -0,0 +1,57 @@
+"""
+Check bursts of player commands fold into the ones that decide the end state
+"""
+import threading
+
+from client_player.command_queue import CommandQueue, MusicSkipCommand, coalesce
+from messages.music_control import MusicNextCommand, MusicPrevCommand, MusicVolumeCommand, MusicPlayCommand, \
+    MusicListCommand, MusicPauseCommand, MusicUnpauseCommand, MusicStopCommand, MusicStatusReport
+
+
+def test_coalesce():
+    nxt, prev = MusicNextCommand(), MusicPrevCommand()
+    assert coalesce([nxt, nxt, nxt]) == [MusicSkipCommand(steps=3)]
+    assert coalesce([nxt, prev]) == []
+    assert coalesce([prev, prev, MusicPauseCommand(), nxt]) == \
+        [MusicSkipCommand(steps=-2), MusicPauseCommand(), MusicSkipCommand(steps=1)]
+    assert coalesce([MusicVolumeCommand(payload=v) for v in (10, 40, 70)]) == [MusicVolumeCommand(payload=70)]
+
+    # A play replaces the plays and skips before it, but not the playlist it plays from
+    assert coalesce([MusicPlayCommand(payload=1), nxt, MusicListCommand(payload=2), MusicPlayCommand(payload=5)]) == \
+        [MusicListCommand(payload=2), MusicPlayCommand(payload=5)]
+    assert coalesce([MusicStopCommand(), MusicPlayCommand(payload=3)]) == [MusicPlayCommand(payload=3)]
+    # A playlist nothing was played from is dropped, one that was is kept
+    assert coalesce([MusicListCommand(payload=1), MusicListCommand(payload=2)]) == [MusicListCommand(payload=2)]
+    assert coalesce([MusicListCommand(payload=1), nxt, MusicListCommand(payload=2)]) == \
+        [MusicListCommand(payload=1), MusicSkipCommand(steps=1), MusicListCommand(payload=2)]
+
+    assert coalesce([MusicPauseCommand(), MusicUnpauseCommand()]) == [MusicUnpauseCommand()]
+    assert coalesce([MusicStopCommand(), MusicUnpauseCommand()]) == [MusicStopCommand(), MusicUnpauseCommand()]
+    assert coalesce([MusicStatusReport(), MusicStatusReport()]) == [MusicStatusReport()]
+
+
+def test_burst_runs_once():
+    ran = []
+    done = threading.Event()
+
+    def execute(cmd):
+        ran.append(cmd)
+        done.set()
+
+    commands = CommandQueue(execute, coalesce_seconds=0.2)
+    for _ in range(5):
+        commands.put(MusicNextCommand())
+    commands.start()
+    assert done.wait(5)
+    assert ran == [MusicSkipCommand(steps=5)]
+
+
+def test_stop_runs_what_was_put():
+    ran = []
+    commands = CommandQueue(ran.append, coalesce_seconds=0)
+    commands.start()
+    commands.put(MusicStopCommand())
+    commands.put(MusicVolumeCommand(payload=10))
+    commands.stop()
+    assert ran == [MusicStopCommand(), MusicVolumeCommand(payload=10)]
+    assert commands.thread is None
@@ -0,0 +1,101 @@
+"""
+Check the start of a song is decoded from the first bytes of the file, and the player crossfades into it
+"""
+import os
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+import pygame
+
+from client_player.crossfade import Crossfader, decode_head, shape
+from client_player.music_player import PlayerState
+from messages.music_control import MusicPlayCommand, MusicListCommand
+from musiclib.item_table import ItemTable
+from musiclib.media_lib import MediaLib, Playlist, ItemList
+from musiclib.tags import TrackTags
+
+RATE = 44100
+
+
+def write_song(path: Path, seconds: float) -> Path:
+    # A ramp, so where the samples come from in the song can be told
+    frames = np.arange(int(RATE * seconds), dtype=np.int16)
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(RATE)
+        f.writeframes(np.repeat(frames, 2).tobytes())
+    return path
+
+
+def test_decode_head(tmp_path):
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    pygame.mixer.init()
+    rate = pygame.mixer.get_init()[0]
+    song = write_song(tmp_path.joinpath("song.wav"), 4)
+    # Too short a guess at the length reads too little at first
+    for duration in (None, 4, 40):
+        samples = decode_head(song, 1.0, duration=duration)
+        assert len(samples) == rate
+    assert np.array_equal(decode_head(song, 1.0, data=song.read_bytes()), samples)
+    assert decode_head(tmp_path.joinpath("missing.wav"), 1.0) is None
+
+    shaped = shape(samples, rate, fade_seconds=0.5, join_seconds=0.1)
+    assert shaped.dtype == samples.dtype and shaped.shape == samples.shape
+    assert shaped[0].max() == 0 and shaped[-1].max() == 0
+    middle = int(rate * 0.7)
+    assert np.array_equal(shaped[middle], samples[middle])
+
+
+def tagged_playlist(folder: Path, title: str, count: int) -> Playlist:
+    folder.mkdir()
+    table = ItemTable()
+    items = ItemList(table=table)
+    for i in range(count):
+        song = write_song(folder.joinpath(f"song {i}.wav"), 1.5)
+        items.add(str(song), "Album")
+        table.set_tags(str(song), TrackTags(title=None, artist=None, album=None, duration=1.5))
+    return Playlist(volume=folder, kind="Single Playlist", title=title, items=items)
+
+
+def wait_for(condition, seconds: float = 10) -> bool:
+    deadline = time.monotonic() + seconds
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_player_crossfades(tmp_path, make_player):
+    media_lib = MediaLib(playlists=[tagged_playlist(tmp_path.joinpath("all"), "All", 3)])
+    crossfader = Crossfader(fade_seconds=0.5)
+    crossfader.start()
+    player = make_player(media_lib, crossfader=crossfader)
+    player.submit(MusicPlayCommand(payload=0))
+    player.commands.wait()
+    assert player.queued_index == 1 and player.fade_at == 1.0
+
+    assert wait_for(lambda: player.mru_item_index != 0)
+    # The second song carries on in the music stream from as far as its start played
+    assert player.mru_item_index == 1
+    assert player.song_start >= 0.4 and not player.fading
+    assert player.queued_index == 2 and player.state == PlayerState.PLAYING
+
+
+def test_playlist_changed_while_crossfading(tmp_path, make_player):
+    first = tagged_playlist(tmp_path.joinpath("first"), "First", 3)
+    # Too short to have the song being crossfaded into at its position
+    second = tagged_playlist(tmp_path.joinpath("second"), "Second", 1)
+    crossfader = Crossfader(fade_seconds=0.5)
+    crossfader.start()
+    player = make_player(MediaLib(playlists=[first, second]), crossfader=crossfader)
+    player.submit(MusicPlayCommand(payload=0))
+    assert wait_for(lambda: player.fading)
+    player.submit(MusicListCommand(payload=1))
+
+    # The song already fading in carries on, then the new playlist from its start
+    assert wait_for(lambda: player.playing_item is not None and player.playing_item.src == first.items[1].src)
+    player.commands.wait()
+    assert not player.fading and player.state == PlayerState.PLAYING
+    assert player.queued_playlist is second and player.queued_index == 0 and player.mru_item_index == 0
@@ -0,0 +1,44 @@
+"""
+Check songs copied onto two volumes are found and only the changed files are hashed again
+"""
+import os
+from pathlib import Path
+
+from musiclib import dedup
+from musiclib.dedup import Deduplicator, HashCache
+from musiclib.media_lib import MediaLibParsers
+from musiclib.search_index import SONG, SearchIndex
+
+
+def write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+def test_copies_collapse_to_the_first(tmp_path, monkeypatch):
+    song = os.urandom(300 * 1024)
+    for volume in ("A", "B"):
+        write(tmp_path.joinpath(volume, "Album", "Song One.mp3"), song)
+    # Same size and same ends as the song, only the middle differs
+    write(tmp_path.joinpath("B", "Album", "Remix.mp3"), song[:150 * 1024] + b"x" + song[150 * 1024 + 1:])
+    write(tmp_path.joinpath("B", "Album", "Other.mp3"), b"short")
+    media_lib = MediaLibParsers.parse_lib([tmp_path.joinpath("A"), tmp_path.joinpath("B")], workers=1)
+
+    cache = HashCache(tmp_path.joinpath("cache", "hashes.sqlite"))
+    assert Deduplicator(media_lib, cache).scan() == 1
+    copy = media_lib.get_playlist_by_id(1).items
+    table = copy.table
+    assert table.is_duplicate(str(tmp_path.joinpath("B", "Album", "Song One.mp3")))
+    assert not table.is_duplicate(str(tmp_path.joinpath("B", "Album", "Remix.mp3")))
+    assert not table.is_duplicate(str(tmp_path.joinpath("A", "Album", "Song One.mp3")))
+    hits = SearchIndex(media_lib).search("song one", kinds=(SONG,))
+    assert [(h.playlist_id, h.name) for h in hits] == [(0, "Song One")]
+
+    # Nothing changed, nothing is read again
+    def no_reading(*args):
+        raise AssertionError("hashed again")
+
+    monkeypatch.setattr(dedup, "partial_hash", no_reading)
+    monkeypatch.setattr(dedup, "full_hash", no_reading)
+    assert Deduplicator(media_lib, cache).scan() == 1
+    cache.close()
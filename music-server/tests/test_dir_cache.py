@@ -0,0 +1,49 @@
+import unicodedata
+
+from musiclib.dir_cache import DirListingCache
+from musiclib.media_lib import MediaLibParsers
+
+
+def test_each_folder_listed_once(tmp_path):
+    album = tmp_path.joinpath("Album")
+    album.mkdir()
+    for name in ("a.mp3", "b.mp3"):
+        album.joinpath(name).write_bytes(b"")
+
+    cache = DirListingCache()
+    assert cache.exists(album.joinpath("a.mp3"))
+    assert cache.exists(album.joinpath("b.mp3"))
+    assert not cache.exists(album.joinpath("c.mp3"))
+    assert not cache.exists(tmp_path.joinpath("Missing", "a.mp3"))
+    assert cache.size() == 2
+
+
+def test_accented_names_match_either_spelling(tmp_path):
+    on_disk = unicodedata.normalize('NFD', "Café.mp3")
+    tmp_path.joinpath(on_disk).write_bytes(b"")
+
+    found = DirListingCache().resolve(tmp_path.joinpath(unicodedata.normalize('NFC', "Café.mp3")))
+    assert found is not None
+    assert found.exists()
+
+
+def test_names_match_ignoring_case(tmp_path):
+    # As on FAT and exFAT, whatever the file system the tests run on
+    on_disk = unicodedata.normalize('NFD', "01 Café.mp3")
+    tmp_path.joinpath(on_disk).write_bytes(b"")
+
+    cache = DirListingCache()
+    found = cache.resolve(tmp_path.joinpath("01 CAFÉ.MP3"))
+    assert found == tmp_path.joinpath(on_disk)
+    assert not cache.exists(tmp_path.joinpath("02 Café.mp3"))
+
+
+def test_validation_can_be_deferred(tmp_path):
+    tmp_path.joinpath("here.mp3").write_bytes(b"")
+    playlist_path = tmp_path.joinpath("list.txt")
+    playlist_path.write_text("here.mp3\ngone.mp3\n\n")
+
+    validated = MediaLibParsers.parse_text_playlist(tmp_path, playlist_path)
+    deferred = MediaLibParsers.parse_text_playlist(tmp_path, playlist_path, validate=False)
+    assert [item.get_song_name() for item in validated.items] == ["here"]
+    assert [item.get_song_name() for item in deferred.items] == ["here", "gone"]
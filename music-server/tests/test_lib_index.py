@@ -0,0 +1,63 @@
+"""
+Check the persistent library index gives the same playlists as a full scan and
+only re-parses what changed.
+"""
+import os
+from pathlib import Path
+
+from musiclib.lib_index import LibIndex
+from musiclib.media_lib import MediaLibParsers, PlaylistCache
+
+
+def make_text_volume(root: Path) -> Path:
+    volume = root.joinpath("TEXTVOL")
+    album = volume.joinpath("Album One")
+    album.mkdir(parents=True)
+    for name in ("one.mp3", "two.mp3"):
+        album.joinpath(name).write_bytes(b"ID3")
+    volume.joinpath("favourites.txt").write_text("# comment\nAlbum One/one.mp3\nAlbum One/two.mp3\n")
+    return volume
+
+
+def test_index_matches_full_scan(tmp_path):
+    volume = make_text_volume(tmp_path)
+    expected = MediaLibParsers.parse_lib([volume])
+
+    index = LibIndex(tmp_path.joinpath("index.sqlite"))
+    first = MediaLibParsers.parse_lib([volume], index=index)
+    second = MediaLibParsers.parse_lib([volume], index=index)
+    index.close()
+
+    assert first == expected
+    assert second == expected
+    assert second.get_playlist_by_id(0).size() == 2
+
+
+def test_index_picks_up_changes(tmp_path):
+    volume = make_text_volume(tmp_path)
+    index = LibIndex(tmp_path.joinpath("index.sqlite"))
+    MediaLibParsers.parse_lib([volume], index=index)
+
+    playlist = volume.joinpath("favourites.txt")
+    playlist.write_text("Album One/two.mp3\n")
+    # Make sure the mtime moves even on file systems with coarse timestamps
+    st = playlist.stat()
+    os.utime(playlist, ns=(st.st_atime_ns, st.st_mtime_ns + 2_000_000_000))
+
+    media_lib = MediaLibParsers.parse_lib([volume], index=index)
+    index.close()
+    items = media_lib.get_playlist_by_id(0).items
+    assert [item.get_song_name() for item in items] == ["two"]
+
+
+def test_index_makes_lazy_playlists(tmp_path):
+    volume = make_text_volume(tmp_path)
+    index = LibIndex(tmp_path.joinpath("index.sqlite"))
+    MediaLibParsers.parse_lib([volume], index=index)
+
+    media_lib = MediaLibParsers.parse_lib([volume], index=index, playlist_cache=PlaylistCache())
+    playlist = media_lib.get_playlist_by_id(0)
+    assert not playlist.is_loaded()
+    assert playlist.size() == 2
+    assert playlist.get_item_by_id(1).get_song_name() == "two"
+    index.close()
@@ -0,0 +1,74 @@
+"""
+Check the library snapshot round trips and is only trusted while the volumes are unchanged
+"""
+import os
+from pathlib import Path
+from typing import List
+
+from musiclib.item_table import ItemTable
+from musiclib.lib_snapshot import LibSnapshot, SnapshotVerifier, warm_start
+from musiclib.media_lib import MediaLib, MediaLibParsers
+from tests.conftest import touch, contents
+
+
+def make_volumes(root: Path) -> List[Path]:
+    lists = root.joinpath("lists")
+    touch(lists.joinpath("Album", "01 Café.mp3"))
+    touch(lists.joinpath("Album", "02 Two.mp3"))
+    touch(lists.joinpath("mine.txt"), "Album/02 Two.mp3\nAlbum/01 Café.mp3\n")
+    songs = root.joinpath("songs")
+    touch(songs.joinpath("Artist", "Album", "a.mp3"))
+    return [lists, songs]
+
+
+def test_round_trip_into_an_empty_table(tmp_path):
+    volumes = make_volumes(tmp_path)
+    media_lib = MediaLibParsers.parse_lib(volumes, workers=1)
+    snapshot_path = tmp_path.joinpath("cache", "snapshot.bin")
+    assert LibSnapshot(snapshot_path).save(media_lib) == 2
+
+    loaded = LibSnapshot(snapshot_path, table=ItemTable()).load()
+    assert list(loaded) == volumes
+    assert contents(MediaLib(playlists=[p for v in loaded.values() for p in v.playlists])) == contents(media_lib)
+    assert all(v.fingerprint.is_current() for v in loaded.values())
+
+
+def test_changed_volumes_are_scanned(tmp_path):
+    volumes = make_volumes(tmp_path)
+    snapshot = LibSnapshot(tmp_path.joinpath("snapshot.bin"))
+    original = MediaLibParsers.parse_lib(volumes, workers=1)
+    snapshot.save(original)
+    scanned = []
+
+    def scan(scan_volumes):
+        scanned.append(scan_volumes)
+        return MediaLibParsers.parse_lib(scan_volumes, workers=1)
+
+    media_lib, from_snapshot = warm_start(volumes, snapshot, scan)
+    assert (from_snapshot, scanned) == (volumes, [])
+    assert contents(media_lib) == contents(original)
+
+    # The playlist is edited, only its volume is read again
+    playlist = volumes[0].joinpath("mine.txt")
+    playlist.write_text("Album/02 Two.mp3\n")
+    st = playlist.stat()
+    os.utime(playlist, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+    media_lib, from_snapshot = warm_start(volumes, snapshot, scan)
+    assert (from_snapshot, scanned) == ([volumes[1]], [[volumes[0]]])
+    assert media_lib.get_playlist_by_id(0).size() == 1
+
+    # A song added deep in a folder doesn't change the fingerprint, the verifier finds it
+    touch(volumes[1].joinpath("Artist", "Album", "b.mp3"))
+    active = media_lib.get_playlist_by_id(1)
+    changes = []
+
+    def run_change(change):
+        changes.append(change)
+        change()
+
+    assert SnapshotVerifier(media_lib, snapshot, from_snapshot, scan, run_change=run_change).verify() == 1
+    # The changed volume is swapped in by whoever owns the library, the player
+    assert len(changes) == 1
+    # Changed in place, the player's active playlist has the new song too
+    assert media_lib.get_playlist_by_id(1) is active and active.size() == 2
+    assert warm_start(volumes, snapshot, scan)[0].get_playlist_by_id(1).size() == 2
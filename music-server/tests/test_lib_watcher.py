@@ -0,0 +1,76 @@
+"""
+Check the library watcher applies changes to the media lib without a full rescan
+"""
+from pathlib import Path
+
+from musiclib.lib_watcher import CREATED, DELETED, MODIFIED, FsEvent, LibWatcher, PollingBackend
+from musiclib.media_lib import MediaLibParsers
+
+
+def make_single_volume(root: Path, songs: int) -> Path:
+    album = root.joinpath("Album")
+    album.mkdir(parents=True)
+    for s in range(songs):
+        album.joinpath(f"{s:02d} Song.mp3").write_bytes(b"ID3")
+    return root
+
+
+def test_new_and_removed_volumes(tmp_path):
+    mounts = tmp_path.joinpath("media")
+    first = make_single_volume(mounts.joinpath("FIRST"), songs=2)
+    media_lib = MediaLibParsers.parse_lib([first])
+    watcher = LibWatcher(media_lib, [first], mounts_root=mounts, poll_seconds=60)
+    watcher.backend = PollingBackend(60)
+
+    second = make_single_volume(mounts.joinpath("SECOND"), songs=3)
+    watcher.apply([FsEvent(kind=CREATED, path=str(second), is_dir=True)])
+    assert [p.volume.name for p in media_lib.playlists] == ["FIRST", "SECOND"]
+    assert media_lib.get_playlist_by_id(1).size() == 3
+
+    watcher.apply([FsEvent(kind=DELETED, path=str(first), is_dir=True)])
+    assert [p.volume.name for p in media_lib.playlists] == ["SECOND"]
+
+
+def test_playlist_and_song_changes_update_in_place(tmp_path):
+    volume = make_single_volume(tmp_path.joinpath("VOL"), songs=3)
+    media_lib = MediaLibParsers.parse_lib([volume])
+    playlist = media_lib.get_playlist_by_id(0)
+    removed = []
+    watcher = LibWatcher(media_lib, [volume], on_items_removed=lambda p, indexes: removed.append(indexes))
+    watcher.backend = PollingBackend(60)
+
+    song = volume.joinpath("Album", "00 Song.mp3")
+    song.unlink()
+    new_song = volume.joinpath("Album", "99 New.mp3")
+    new_song.write_bytes(b"ID3")
+    watcher.apply([FsEvent(kind=DELETED, path=str(song)), FsEvent(kind=CREATED, path=str(new_song))])
+    assert media_lib.get_playlist_by_id(0) is playlist
+    assert [item.get_song_name() for item in playlist.items] == ["01 Song", "02 Song", "99 New"]
+    assert removed == [[0]]
+
+    # A text playlist turns the volume into a text playlist volume
+    text = volume.joinpath("mix.txt")
+    text.write_text("Album/02 Song.mp3\n")
+    watcher.apply([FsEvent(kind=CREATED, path=str(text))])
+    mix = media_lib.get_playlist_by_id(0)
+    assert mix.get_kind() == "Simple Text Playlist"
+    assert mix.size() == 1
+
+    text.write_text("Album/01 Song.mp3\nAlbum/99 New.mp3\n")
+    watcher.apply([FsEvent(kind=MODIFIED, path=str(text))])
+    assert media_lib.get_playlist_by_id(0) is mix
+    assert [item.get_song_name() for item in mix.items] == ["01 Song", "99 New"]
+
+
+def test_polling_backend_reports_changes(tmp_path):
+    volume = make_single_volume(tmp_path.joinpath("VOL"), songs=1)
+    text = volume.joinpath("mix.txt")
+    text.write_text("Album/00 Song.mp3\n")
+    backend = PollingBackend(0)
+    backend.watch_tree(str(volume))
+
+    volume.joinpath("Album", "01 Song.mp3").write_bytes(b"ID3")
+    text.write_text("Album/00 Song.mp3\nAlbum/01 Song.mp3\n")
+    events = backend.read(0)
+    assert FsEvent(kind=CREATED, path=str(volume.joinpath("Album", "01 Song.mp3"))) in events
+    assert FsEvent(kind=MODIFIED, path=str(text)) in events
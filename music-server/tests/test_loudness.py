@@ -0,0 +1,68 @@
+"""
+Check the loudness against the reference tones of ITU-R BS.1770 and that the gains reach the songs
+"""
+import math
+import wave
+from pathlib import Path
+
+import numpy as np
+
+from musiclib.lib_index import LibIndex
+from musiclib.loudness import LoudnessScanner, REFERENCE_LOUDNESS, analyse_batch, integrated_loudness, \
+    segment_energies
+from musiclib.media_lib import MediaLibParsers
+
+
+def sine(rate: int, seconds: float, amplitude: float = 1.0) -> np.ndarray:
+    t = np.arange(int(rate * seconds)) / rate
+    return amplitude * np.sin(2 * math.pi * 997 * t)
+
+
+def test_full_scale_tone():
+    rate = 48000
+    tone = sine(rate, 5)
+    # A full scale 997 Hz tone in one channel is -3.01 LUFS, in both 0 LUFS
+    one = np.stack([tone, np.zeros_like(tone)], axis=1)
+    assert abs(integrated_loudness(segment_energies(one, rate)) + 3.01) < 0.1
+    both = np.stack([tone, tone], axis=1)
+    assert abs(integrated_loudness(segment_energies(both, rate))) < 0.1
+    # 20 dB quieter is 20 LU quieter, silence has no loudness
+    assert abs(integrated_loudness(segment_energies(both / 10, rate)) + 20) < 0.1
+    assert integrated_loudness(segment_energies(np.zeros((rate, 2)), rate)) is None
+
+
+def write_wav(path: Path, samples: np.ndarray, rate: int = 44100) -> None:
+    # Named .mp3 so the walker finds it, the decoder goes by the contents
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes((np.stack([samples, samples], axis=1) * 32767).astype("<i2").tobytes())
+
+
+def test_batches_are_analysed(tmp_path):
+    # What the worker processes run
+    song = tmp_path.joinpath("song.mp3")
+    write_wav(song, sine(44100, 2, 0.5))
+    loud, missing = analyse_batch([str(song), str(tmp_path.joinpath("missing.mp3"))])
+    assert abs(loud + 6.02) < 0.2 and missing is None
+
+
+def test_gains_are_set_and_kept(tmp_path):
+    volume = tmp_path.joinpath("MUSIC")
+    write_wav(volume.joinpath("Album", "loud.mp3"), sine(44100, 2, 0.5))
+    write_wav(volume.joinpath("Album", "quiet.mp3"), sine(44100, 2, 0.05))
+    media_lib = MediaLibParsers.parse_lib([volume], workers=1)
+    index = LibIndex(tmp_path.joinpath("index.sqlite"))
+    assert LoudnessScanner(media_lib, index, workers=1).scan() == 2
+
+    items = {item.src.name: item for item in media_lib.get_playlist_by_id(0).items}
+    # A half scale tone in both channels is about -6 LUFS
+    assert abs(items["loud.mp3"].gain - (REFERENCE_LOUDNESS + 6.02)) < 0.2
+    assert abs(items["quiet.mp3"].gain - items["loud.mp3"].gain - 20) < 0.2
+
+    # Nothing is decoded the second time
+    again = MediaLibParsers.parse_lib([volume], workers=1)
+    assert LoudnessScanner(again, index).scan() == 0
+    assert again.get_playlist_by_id(0).items[0].gain is not None
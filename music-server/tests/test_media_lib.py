@@ -0,0 +1,106 @@
+from pathlib import Path
+from typing import List
+
+from musiclib.item_table import ItemTable
+from musiclib.media_lib import Item, ItemList, MediaLibParsers, PlaylistCache
+
+WPL_TEMPLATE = """<?wpl version="1.0"?>
+<smil>
+    <head>
+        <meta name="Generator" content="Microsoft Windows Media Player -- 12.0.19041.1320"/>
+        <title>{title}</title>
+    </head>
+    <body>
+        <seq>
+{media}
+        </seq>
+    </body>
+</smil>
+"""
+
+
+def make_windows_media_volume(root: Path, playlists: int, songs: int) -> Path:
+    """
+    A volume laid out the way Windows Media Player rips to a USB drive, the WPL files
+    refer to the songs with Windows style paths relative to the Playlists folder
+    """
+    root.joinpath("Playlists").mkdir(parents=True)
+    for p in range(playlists):
+        media: List[str] = []
+        for s in range(songs):
+            album = root.joinpath("Music", f"Artist {p}", f"Album {p}")
+            album.mkdir(parents=True, exist_ok=True)
+            album.joinpath(f"{s:02d} Song.mp3").write_bytes(b"ID3")
+            media.append(f'            <media src="..\\Music\\Artist {p}\\Album {p}\\{s:02d} Song.mp3"/>')
+        root.joinpath("Playlists", f"List {p}.wpl").write_text(
+            WPL_TEMPLATE.format(title=f"List {p}", media="\n".join(media)))
+    return root
+
+
+def test_parse_wpl_playlist(tmp_path):
+    volume = make_windows_media_volume(tmp_path, playlists=1, songs=3)
+    playlist = MediaLibParsers.parse_wpl_playlist(volume, volume.joinpath("Playlists", "List 0.wpl"))
+    assert playlist.get_title() == "List 0"
+    assert playlist.size() == 3
+    item = playlist.get_item_by_id(1)
+    assert item.get_song_name() == "01 Song"
+    assert item.album_name == "Album 0"
+    assert item.src.exists()
+
+
+def test_parallel_scan_keeps_order(tmp_path):
+    volumes = [make_windows_media_volume(tmp_path.joinpath(f"VOL{v}"), playlists=4, songs=2) for v in range(3)]
+    sequential = MediaLibParsers.parse_lib(volumes, workers=1)
+    parallel = MediaLibParsers.parse_lib(volumes, workers=4)
+    assert parallel == sequential
+    assert [(p.volume.name, p.get_title()) for p in parallel.playlists] == \
+           [(f"VOL{v}", f"List {p}") for v in range(3) for p in range(4)]
+
+
+def test_lazy_playlists_load_on_first_use_and_evict(tmp_path):
+    volume = make_windows_media_volume(tmp_path, playlists=3, songs=4)
+    cache = PlaylistCache(max_items=8)
+    media_lib = MediaLibParsers.parse_lib([volume], playlist_cache=cache)
+    playlists = media_lib.playlists
+    assert [p.get_title() for p in playlists] == ["List 0", "List 1", "List 2"]
+    assert not any(p.is_loaded() for p in playlists)
+    assert playlists[0].size() == 4
+
+    # Loading the songs changes the library, so the indexes built from it take them in
+    generation = media_lib.generation
+    assert playlists[0].get_item_by_id(3).get_song_name() == "03 Song"
+    assert media_lib.generation == generation + 1
+    playlists[0].get_item_by_id(2)
+    assert media_lib.generation == generation + 1
+    playlists[1].get_item_by_id(0)
+    assert cache.size() == 8
+    # Touch the first one so the second is the least recently used
+    playlists[0].get_item_by_id(0)
+    playlists[2].get_item_by_id(0)
+    assert [p.is_loaded() for p in playlists] == [True, False, True]
+    assert playlists[1].get_item_by_id(2).get_song_name() == "02 Song"
+
+
+def test_item_list_shares_strings_and_keeps_item_api(tmp_path):
+    table = ItemTable()
+    songs = [Item(src=tmp_path.joinpath("Album", f"{s:02d} Song.mp3"), album_name="Album") for s in range(3)]
+    first = ItemList(songs, table=table)
+    second = ItemList(reversed(songs), table=table)
+    assert len(table.dirs) == 1 and len(table.albums) == 1 and len(table.names) == 3
+    assert first == songs
+    assert first[1] == songs[1]
+    assert first[1:] == songs[1:]
+    assert list(second) == list(reversed(songs))
+    assert len(first + second) == 6
+    assert first[2].get_song_name() == "02 Song"
+
+
+def test_reading_a_volume_again_adds_no_strings(tmp_path):
+    table = ItemTable()
+    songs = [Item(src=tmp_path.joinpath("Album", f"{s:02d} Song.mp3"), album_name="Album") for s in range(3)]
+    ItemList(songs, table=table)
+    before = table.get_info()
+    # As when a stick is taken out and put back, the strings it had are used again
+    again = ItemList(songs[1:], table=table)
+    assert table.get_info() == before == "1 folders, 3 file names, 1 albums, 0 tags and 0 gains"
+    assert again == songs[1:]
@@ -0,0 +1,131 @@
+"""
+Check the player moves between its states on its own thread, whichever thread sends the commands
+"""
+import threading
+import time
+import wave
+from pathlib import Path
+
+import pygame
+
+from client_player.music_player import MusicPlayer, PlayerState, DUCKED_VOLUME
+from messages.music_control import MusicPlayCommand, MusicPauseCommand, MusicUnpauseCommand, MusicStopCommand, \
+    MusicStatusReport, MusicVolumeCommand, MusicNextCommand, MusicPrevCommand
+from musiclib.media_lib import MediaLib, Playlist, Item, ItemList
+
+
+def write_songs(tmp_path: Path, seconds: float = 5) -> MediaLib:
+    items = []
+    for i in range(3):
+        path = tmp_path.joinpath(f"song {i}.wav")
+        with wave.open(str(path), "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(8000)
+            f.writeframes(bytes(int(8000 * seconds) * 2))
+        items.append(Item(src=path, album_name="Album"))
+    return MediaLib(playlists=[Playlist(volume=tmp_path, kind="Single Playlist", title="All", items=items)])
+
+
+def run(player: MusicPlayer, *commands) -> PlayerState:
+    for cmd in commands:
+        player.submit(cmd)
+    player.commands.wait()
+    return player.state
+
+
+def test_state_machine(tmp_path, make_player):
+    player = make_player(write_songs(tmp_path))
+    assert player.state == PlayerState.STOPPED
+    # Nothing to pause or resume yet
+    assert run(player, MusicPauseCommand()) == PlayerState.STOPPED
+    assert run(player, MusicUnpauseCommand()) == PlayerState.STOPPED
+    assert run(player, MusicPlayCommand(payload=1)) == PlayerState.PLAYING
+    assert run(player, MusicUnpauseCommand()) == PlayerState.PLAYING
+    assert run(player, MusicPauseCommand()) == PlayerState.PAUSED
+    assert run(player, MusicUnpauseCommand()) == PlayerState.PLAYING
+
+    # The music is turned down while the report is spoken, and back up once the speech thread is done
+    run(player, MusicVolumeCommand(payload=50))
+    player.speech.wait()
+    assert run(player, MusicStatusReport()) == PlayerState.ANNOUNCING
+    assert abs(pygame.mixer.music.get_volume() - DUCKED_VOLUME) < 0.01
+    player.speech.wait()
+    assert run(player) == PlayerState.PLAYING
+    assert abs(pygame.mixer.music.get_volume() - 0.5) < 0.01
+
+    assert run(player, MusicStopCommand()) == PlayerState.STOPPED
+    assert run(player, MusicPauseCommand()) == PlayerState.STOPPED
+    # A report while stopped has nothing to turn down
+    assert run(player, MusicStatusReport()) == PlayerState.STOPPED
+
+
+def test_concurrent_senders(tmp_path, make_player):
+    player = make_player(write_songs(tmp_path))
+    run(player, MusicPlayCommand(payload=0))
+
+    def send():
+        for _ in range(30):
+            player.submit(MusicNextCommand())
+
+    senders = [threading.Thread(target=send) for _ in range(4)]
+    for sender in senders:
+        sender.start()
+    # The library watcher's callback is run on the player's thread too
+    player.run_change(lambda: None)
+    for sender in senders:
+        sender.join()
+    # However the nexts were folded together they come to 120 songs on
+    assert run(player) == PlayerState.PLAYING
+    assert player.mru_item_index == 120 % 3
+
+
+def test_moves_on_when_a_song_ends(tmp_path, make_player):
+    player = make_player(write_songs(tmp_path, seconds=0.3))
+    run(player, MusicPlayCommand(payload=1))
+    assert player.queued_index == 2
+    # The mixer plays the queued song and the player catches up, wrapping round the playlist
+    played = []
+    deadline = time.monotonic() + 10
+    while len(played) < 2 and time.monotonic() < deadline:
+        time.sleep(0.02)
+        if player.mru_item_index not in played + [1]:
+            played.append(player.mru_item_index)
+    assert played == [2, 0]
+    assert player.queued_index == 1 and player.state == PlayerState.PLAYING
+
+    # Stopping doesn't move on
+    assert run(player, MusicStopCommand()) == PlayerState.STOPPED
+    index = player.mru_item_index
+    time.sleep(0.5)
+    assert run(player) == PlayerState.STOPPED and player.mru_item_index == index
+
+
+def test_playlist_changed_while_playing(tmp_path, make_player):
+    player = make_player(write_songs(tmp_path))
+    run(player, MusicPlayCommand(payload=2))
+    playlist = player.active_list.playlist
+    songs = [item.src for item in playlist.items]
+
+    # The change is made on the player's thread, which finds the song playing where it went
+    player.run_change(lambda: setattr(playlist, "items", ItemList.of(Item(src, "Album") for src in songs[1:])))
+    assert player.mru_item_index == 1 and player.queued_index == 0
+    assert player.state == PlayerState.PLAYING
+
+    # When it has gone the player stays as close to it as the playlist allows
+    player.run_change(lambda: setattr(playlist, "items", ItemList.of([Item(songs[0], "Album")])))
+    assert player.mru_item_index == 0 and player.queued_index == 0
+    player.run_change(lambda: setattr(playlist, "items", ItemList()))
+    assert player.mru_item_index == 0 and player.queued_index is None
+
+
+def test_missing_songs_are_skipped(tmp_path, make_player):
+    # As when the playlist was read without checking its songs
+    player = make_player(write_songs(tmp_path))
+    tmp_path.joinpath("song 1.wav").unlink()
+    run(player, MusicPlayCommand(payload=0))
+    assert player.queued_index == 2
+    assert run(player, MusicNextCommand()) == PlayerState.PLAYING and player.mru_item_index == 2
+    assert player.queued_index == 0
+    assert run(player, MusicPrevCommand()) == PlayerState.PLAYING and player.mru_item_index == 0
+    assert run(player, MusicPlayCommand(payload=1)) == PlayerState.PLAYING and player.mru_item_index == 2
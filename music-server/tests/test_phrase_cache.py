@@ -0,0 +1,71 @@
+"""
+Check phrases are made once per voice, kept within the size limit and played through the mixer
+"""
+import os
+import sys
+import threading
+import time
+import wave
+
+import pygame
+
+from speech.phrase_cache import PhraseCache, PhraseSpeaker
+from speech.presynth import Presynthesizer
+
+# Writes a WAV of silence, a tenth of a second per letter, where flite would write the speech
+WRITE_WAV = "import sys, wave; f = wave.open(sys.argv[2], 'wb'); f.setnchannels(1); f.setsampwidth(2); " \
+            "f.setframerate(16000); f.writeframes(bytes(3200 * len(sys.argv[1]))); f.close()"
+
+
+def fake_flite(made):
+    def command(text, voice, output):
+        made.append((text, voice))
+        return [sys.executable, "-c", WRITE_WAV, text, output]
+    return command
+
+
+def test_phrases_are_made_once_and_evicted(tmp_path):
+    made = []
+    cache = PhraseCache(tmp_path, max_bytes=30000, command=fake_flite(made))
+    stop = cache.render("Stop")
+    assert cache.render("Stop") == stop and made == [("Stop", "slt")]
+    with wave.open(str(stop)) as f:
+        assert f.getnframes() == 1600 * 4
+
+    # Another voice is another file
+    other = PhraseCache(tmp_path, voice="kal", max_bytes=30000, command=fake_flite(made))
+    assert other.render("Stop") != stop
+    # Found again after a restart, the least recently used goes when the cache is full
+    cache = PhraseCache(tmp_path, max_bytes=30000, command=fake_flite(made))
+    assert cache.lookup("Stop") == stop
+    cache.render("Pause")
+    assert cache.total_bytes <= 30000
+    assert cache.lookup("Stop") is not None and not other.folder.joinpath(other.key("Stop")).exists()
+
+
+def test_phrases_play_on_the_mixer(tmp_path):
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    pygame.mixer.init()
+    speaker = PhraseSpeaker(PhraseCache(tmp_path, command=fake_flite([])))
+    speaking = speaker.speak("Hi")
+    assert speaker.channel.get_busy()
+    speaking.stop()
+    speaking.wait()
+    assert not speaker.channel.get_busy()
+
+    # Two seconds of speech, cut short from another thread, wakes whoever waits for it
+    speaking = speaker.speak("A long phrase here")
+    threading.Timer(0.1, speaking.stop).start()
+    start = time.monotonic()
+    speaking.wait()
+    assert time.monotonic() - start < 1.0 and not speaker.channel.get_busy()
+
+
+def test_phrases_made_ahead_of_time(tmp_path):
+    made = []
+    cache = PhraseCache(tmp_path, max_bytes=30000, command=fake_flite(made))
+    cache.render("Stop")
+    presynth = Presynthesizer(cache, cpu_fraction=0.9, fill_fraction=0.8)
+    # Stop is already made, and the cache is too full after the first new phrase
+    assert presynth.run(["Stop", "Pause", "Resume", "Next"]) == 1
+    assert [text for text, _ in made] == ["Stop", "Pause"]
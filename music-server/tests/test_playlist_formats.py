@@ -0,0 +1,73 @@
+"""
+Check the playlist formats in the registry and volumes that mix them
+"""
+from pathlib import Path
+
+from musiclib.media_lib import MediaLibParsers
+from musiclib.playlist_formats import is_playlist
+from tests.conftest import touch
+
+XSPF = """<?xml version="1.0" encoding="UTF-8"?>
+<playlist version="1" xmlns="http://xspf.org/ns/0/">
+  <title>Road Trip</title>
+  <trackList>
+    <track><title>Song A</title><location>file://{volume}/Album/a.mp3</location></track>
+    <track><location>../Album/b%20two.mp3</location></track>
+    <track><location>http://radio.example/stream</location></track>
+  </trackList>
+</playlist>
+"""
+
+
+def make_volume(volume: Path) -> None:
+    touch(volume.joinpath("Album", "a.mp3"))
+    touch(volume.joinpath("Album", "b two.mp3"))
+    touch(volume.joinpath("Album", "café.mp3"))
+
+
+def song_names(playlist):
+    return [Path(item.src).name for item in playlist.items]
+
+
+def test_m3u8_pls_and_xspf(tmp_path):
+    make_volume(tmp_path)
+    lists = tmp_path.joinpath("Lists")
+    touch(lists.joinpath("mix.m3u8"), "﻿#EXTM3U\n#PLAYLIST:Mix\n#EXTINF:10,A\n../Album/a.mp3\n"
+                                      "..\\Album\\café.mp3\n../Album/gone.mp3\n".encode("utf-8"))
+    # Older players write M3U in the Windows code page
+    touch(lists.joinpath("old.m3u"), "../Album/café.mp3\r\n".encode("cp1252"))
+    touch(lists.joinpath("radio.PLS"), b"[playlist]\nFile1=../Album/b two.mp3\nTitle1=B\nNumberOfEntries=1\n")
+    touch(lists.joinpath("trip.xspf"), XSPF.format(volume=tmp_path).encode("utf-8"))
+
+    mix = MediaLibParsers.parse_playlist_file(tmp_path, lists.joinpath("mix.m3u8"))
+    assert (mix.get_title(), mix.get_kind()) == ("Mix", "M3U Playlist")
+    assert song_names(mix) == ["a.mp3", "café.mp3"]
+    assert song_names(MediaLibParsers.parse_playlist_file(tmp_path, lists.joinpath("old.m3u"))) == ["café.mp3"]
+    radio = MediaLibParsers.parse_playlist_file(tmp_path, lists.joinpath("radio.PLS"))
+    assert (radio.get_title(), song_names(radio)) == ("radio", ["b two.mp3"])
+    trip = MediaLibParsers.parse_playlist_file(tmp_path, lists.joinpath("trip.xspf"))
+    assert (trip.get_title(), song_names(trip)) == ("Road Trip", ["a.mp3", "b two.mp3"])
+
+
+def test_volume_mixing_formats(tmp_path):
+    make_volume(tmp_path)
+    touch(tmp_path.joinpath("one.txt"), b"Album/a.mp3\n")
+    touch(tmp_path.joinpath("Lists", "two.m3u"), b"../Album/a.mp3\n../Album/b two.mp3\n")
+    assert is_playlist("two.M3U8") and not is_playlist("a.mp3")
+
+    playlists = MediaLibParsers.parse_volume(tmp_path)
+    assert [(p.get_title(), p.get_kind(), p.size()) for p in playlists] == \
+           [("two", "M3U Playlist", 2), ("one", "Simple Text Playlist", 1)]
+
+
+def test_only_windows_paths_are_converted(tmp_path):
+    make_volume(tmp_path)
+    # Names a Linux file can have
+    touch(tmp_path.joinpath("Album", "a:b.mp3"))
+    touch(tmp_path.joinpath("Album", "c\\d.mp3"))
+    touch(tmp_path.joinpath("list.txt"), "Album/a:b.mp3\nAlbum/c\\d.mp3\nAlbum\\a.mp3\nX:\\Album\\b two.mp3\n"
+                                         "\\\\server\\music\\Album\\café.mp3\n")
+    playlist = MediaLibParsers.parse_playlist_file(tmp_path, tmp_path.joinpath("list.txt"))
+    # Backslashes without a drive letter in front are only separators when the name isn't there as written
+    assert song_names(playlist) == ["a:b.mp3", "c\\d.mp3", "a.mp3", "b two.mp3", "café.mp3"]
+    assert all(Path(item.src).parent == tmp_path.joinpath("Album") for item in playlist.items)
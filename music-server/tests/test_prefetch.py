@@ -0,0 +1,40 @@
+"""
+Check the prefetcher keeps within its size and reads what is asked for in the background
+"""
+from pathlib import Path
+
+from client_player.prefetch import Prefetcher
+
+
+def write(path: Path, size: int) -> Path:
+    path.write_bytes(bytes([len(path.name)]) * size)
+    return path
+
+
+def test_cache_is_bounded(tmp_path):
+    prefetcher = Prefetcher(max_bytes=1000)
+    songs = [write(tmp_path.joinpath(f"{i}.mp3"), 200) for i in range(6)]
+    for song in songs[:5]:
+        assert prefetcher.fetch(song)
+    # Using the first song keeps it, the second is the least recently used
+    assert prefetcher.take(songs[0]) == songs[0].read_bytes()
+    prefetcher.fetch(songs[5])
+    assert prefetcher.total_bytes == 1000
+    assert prefetcher.take(songs[1]) is None
+    assert prefetcher.take(songs[0]) is not None
+
+    # Too big to keep, and missing
+    assert not prefetcher.fetch(write(tmp_path.joinpath("big.mp3"), 300))
+    assert not prefetcher.fetch(tmp_path.joinpath("missing.mp3"))
+    assert prefetcher.total_bytes == 1000
+
+
+def test_prefetch_in_the_background(tmp_path):
+    prefetcher = Prefetcher()
+    prefetcher.start()
+    songs = [write(tmp_path.joinpath(f"{i}.mp3"), 100) for i in range(3)]
+    prefetcher.prefetch(songs[:2])
+    prefetcher.prefetch(songs[2:])
+    prefetcher.wait()
+    # The first request may have been skipped for the newer one
+    assert prefetcher.take(songs[2]) == songs[2].read_bytes()
@@ -0,0 +1,85 @@
+"""
+Check playlists, albums and songs can be found by name
+"""
+from pathlib import Path
+
+from musiclib.media_lib import ItemList, LazyPlaylist, MediaLib, Playlist
+from musiclib.background_index import BackgroundIndex
+from musiclib.search_index import ALBUM, PLAYLIST, SONG, SearchIndex, tokenize
+
+
+def make_lib() -> MediaLib:
+    def playlist(title, songs):
+        items = ItemList()
+        for album, name in songs:
+            items.add(f"/media/pi/VOL/{album}/{name}.mp3", album)
+        return Playlist(volume=Path("/media/pi/VOL"), kind="Simple Text Playlist", title=title, items=items)
+
+    return MediaLib(playlists=[
+        playlist("Road Trip", [("Abbey Road", "Come Together"), ("Abbey Road", "Something")]),
+        playlist("Beyoncé Mix", [("Lemonade", "Formation"), ("Abbey Road", "Something")]),
+    ])
+
+
+def test_tokenize_folds_case_and_accents():
+    assert tokenize("Beyoncé - 01_Crazy in Love!") == ["beyonce", "01", "crazy", "in", "love"]
+
+
+def test_exact_prefix_and_fuzzy_matches():
+    index = SearchIndex(make_lib())
+    hits = index.search("come together")
+    assert [(h.kind, h.playlist_id, h.item_index, h.name) for h in hits] == [(SONG, 0, 0, "Come Together")]
+
+    # A prefix, and the song that is in both playlists is found in the first
+    assert [(h.kind, h.playlist_id, h.item_index) for h in index.search("someth")] == [(SONG, 0, 1)]
+
+    # Misspelt and without the accent
+    assert index.search("beyonse", kinds=(PLAYLIST,))[0].playlist_id == 1
+
+    hits = index.search("abbey road")
+    assert [(h.kind, h.playlist_id) for h in hits] == [(ALBUM, 0), (ALBUM, 1)]
+    assert index.search("road")[0].kind == PLAYLIST
+    assert index.search("nothing like this") == []
+
+
+def test_index_knows_when_it_is_out_of_date():
+    media_lib = make_lib()
+    index = SearchIndex(media_lib)
+    assert index.is_current()
+    media_lib.remove_playlist(media_lib.get_playlist_by_id(0))
+    assert not index.is_current()
+
+
+def test_indexer_searches_the_last_index_while_building():
+    media_lib = make_lib()
+    indexer = BackgroundIndex(media_lib, SearchIndex, "search index")
+    indexer.start()
+    first = indexer.get()
+    assert first.is_current() and indexer.get() is first
+
+    # Until the next index is built the old one is searched, its hits name the playlist they came from
+    road_trip = media_lib.get_playlist_by_id(0)
+    media_lib.remove_playlist(road_trip)
+    assert indexer.get() in (first, indexer.index)
+    hit = first.search("come together")[0]
+    assert (hit.playlist_id, hit.name, hit.playlist) == (0, "Come Together", road_trip)
+    assert media_lib.index_of(road_trip) is None
+    thread = indexer.thread
+    if thread is not None:
+        thread.join()
+    assert indexer.get().is_current() and indexer.get().search("come together") == []
+
+
+def test_songs_of_lazy_playlists_are_found_once_loaded():
+    songs = make_lib().get_playlist_by_id(0).items
+    lazy = LazyPlaylist(volume=Path("/media/pi/VOL"), kind="Simple Text Playlist", title="Later", source=None,
+                        count=len(songs), loader=lambda: songs)
+    media_lib = MediaLib(playlists=[lazy])
+    indexer = BackgroundIndex(media_lib, SearchIndex, "search index")
+    media_lib.listeners.append(indexer.refresh)
+    assert indexer.get().search("come together") == []
+
+    lazy.get_item_by_id(0)
+    if indexer.thread is not None:
+        indexer.thread.join()
+    assert [h.name for h in indexer.get().search("come together")] == ["Come Together"]
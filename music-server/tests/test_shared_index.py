@@ -0,0 +1,58 @@
+"""
+Check the shared index holds the whole library and readers move to a new one only when they ask
+"""
+from pathlib import Path
+
+from musiclib.item_table import ItemTable
+from musiclib.media_lib import MediaLib, MediaLibParsers
+from musiclib.shared_index import SharedIndex, SharedIndexPublisher, publish
+from tests.conftest import touch, contents
+
+
+def make_lib(root: Path) -> MediaLib:
+    lists = root.joinpath("lists")
+    touch(lists.joinpath("Album", "01 Café.mp3"))
+    touch(lists.joinpath("Album", "02 Two.mp3"))
+    touch(lists.joinpath("mine.txt"), "Album/02 Two.mp3\nAlbum/01 Café.mp3\n")
+    songs = root.joinpath("songs")
+    touch(songs.joinpath("Artist", "Album", "a.mp3"))
+    return MediaLibParsers.parse_lib([lists, songs], workers=1)
+
+
+def test_readers_see_the_library(tmp_path):
+    media_lib = make_lib(tmp_path)
+    path = tmp_path.joinpath("cache", "shared.idx")
+    assert publish(media_lib, path) == 1
+
+    shared = SharedIndex.open(path)
+    assert len(shared) == 2
+    playlist = shared.playlist(0)
+    assert (playlist.title, playlist.source, playlist.size) == ("mine", tmp_path.joinpath("lists", "mine.txt"), 2)
+    assert shared.item(playlist, 1).src.name == "01 Café.mp3"
+    assert [item.src.name for item in shared.items(shared.playlist(1))] == ["a.mp3"]
+    assert shared.playlist(1).source is None
+    # Into a table holding other strings, and into an empty one
+    assert contents(shared.to_media_lib()) == contents(media_lib)
+    assert contents(shared.to_media_lib(ItemTable())) == contents(media_lib)
+
+
+def test_updates_replace_the_file(tmp_path):
+    media_lib = make_lib(tmp_path)
+    path = tmp_path.joinpath("shared.idx")
+    publisher = SharedIndexPublisher(media_lib, path)
+    assert publisher.publish_if_changed()
+    assert not publisher.publish_if_changed()
+    reader = SharedIndex.open(path)
+
+    media_lib.remove_playlist(media_lib.get_playlist_by_id(0))
+    assert publisher.publish_if_changed()
+    # The old file stays mapped and whole until the reader moves on
+    assert not reader.is_current()
+    assert len(reader) == 2 and reader.item(reader.playlist(0), 0).src.name == "02 Two.mp3"
+    reader = reader.refreshed()
+    assert (reader.generation, len(reader)) == (2, 1)
+    assert reader.refreshed() is reader
+
+    touch(tmp_path.joinpath("junk.idx"), "not an index")
+    assert SharedIndex.open(tmp_path.joinpath("junk.idx")) is None
+    assert SharedIndex.open(tmp_path.joinpath("missing.idx")) is None
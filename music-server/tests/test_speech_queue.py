@@ -0,0 +1,45 @@
+"""
+Check announcements are spoken by priority and stale ones are replaced or cut short
+"""
+import sys
+import threading
+
+from speech.speech_queue import ProcessSpeaker, SpeechQueue, URGENT
+
+
+def test_priority_and_replacement():
+    spoken = []
+    started = threading.Event()
+
+    def command(text):
+        spoken.append(text)
+        started.set()
+        # The first one would go on long after the others are queued, the rest are quick
+        seconds = 10 if len(spoken) == 1 else 0
+        return [sys.executable, "-c", f"import time; time.sleep({seconds})"]
+
+    speech = SpeechQueue(ProcessSpeaker(command))
+    speech.start()
+    first = speech.say("Set volume 10", topic="volume")
+    assert started.wait(5)
+    for volume in (20, 30, 40):
+        speech.say(f"Set volume {volume}", topic="volume")
+    speech.say("Not found", priority=URGENT)
+    assert speech.metrics().depth == 2
+    speech.wait()
+
+    # The one being spoken was cut short, only the last volume is said, after the urgent one
+    assert first.cancelled
+    assert spoken == ["Set volume 10", "Not found", "Set volume 40"]
+    metrics = speech.metrics()
+    assert (metrics.depth, metrics.spoken, metrics.replaced, metrics.cut_short) == (0, 3, 2, 1)
+    assert metrics.max_depth == 2
+
+
+def test_missing_speaker_is_logged():
+    done = []
+    speech = SpeechQueue(ProcessSpeaker(lambda text: ["no-such-speaker-program"]))
+    speech.start()
+    speech.say("Hello", on_done=lambda: done.append(True)).done.wait(5)
+    speech.wait()
+    assert done == [True] and speech.metrics().spoken == 0
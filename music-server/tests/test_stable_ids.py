@@ -0,0 +1,41 @@
+"""
+Check the stable ids don't depend on where a drive is mounted or what else is in the library
+"""
+from pathlib import Path
+
+from musiclib.media_lib import MediaLibParsers
+from musiclib.stable_ids import StableIdIndex, item_stable_id, playlist_stable_id
+from tests.conftest import touch
+
+
+def make_drive(mounts: Path) -> Path:
+    volume = mounts.joinpath("MUSIC")
+    touch(volume.joinpath("Album", "a.mp3"))
+    touch(volume.joinpath("Album", "b.mp3"))
+    touch(volume.joinpath("mix.txt"), "Album/b.mp3\nAlbum/a.mp3\n")
+    return volume
+
+
+def test_ids_survive_other_mounts_and_drives(tmp_path):
+    first = MediaLibParsers.parse_lib([make_drive(tmp_path.joinpath("mac"))], workers=1)
+    playlist = first.get_playlist_by_id(0)
+    playlist_id, song_id = playlist_stable_id(playlist), item_stable_id(playlist, 1)
+    assert len(song_id) == 10
+
+    # The same drive mounted somewhere else, after another drive
+    other = tmp_path.joinpath("pi", "OTHER")
+    touch(other.joinpath("x.mp3"))
+    second = MediaLibParsers.parse_lib([other, make_drive(tmp_path.joinpath("pi"))], workers=1)
+    ids = StableIdIndex(second)
+    assert ids.find_playlist(playlist_id) == 1
+    assert ids.find_item(song_id.upper()) == (1, 1)
+    assert second.get_playlist_by_id(1).get_item_by_id(1).src.name == "a.mp3"
+    assert ids.find_item("nosuchid00") is None
+
+    drive = second.get_playlist_by_id(1)
+    second.remove_playlist(second.get_playlist_by_id(0))
+    assert not ids.is_current()
+    # Until the index is built again its positions are those of the library it was built from
+    assert ids.get_playlist(ids.find_playlist(playlist_id)) is drive
+    assert second.index_of(drive) == 0
+    assert StableIdIndex(second).find_item(song_id) == (0, 1)
@@ -0,0 +1,65 @@
+"""
+Check the tags are read into the media lib and only read again when a file changes
+"""
+import os
+from pathlib import Path
+
+from mutagen.easyid3 import EasyID3
+
+from musiclib.item_table import ItemTable
+from musiclib.media_lib import ItemList, MediaLib, Playlist
+from musiclib.tags import TagCache, TagScanner
+
+# An MPEG 1 layer 3 frame header, 128 kbit/s at 44.1 kHz, the frame is 417 bytes long
+MP3_FRAME = b"\xff\xfb\x90\x64" + bytes(413)
+
+
+def make_tagged_mp3(path: Path, title: str, artist: str) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(MP3_FRAME * 40)
+    tags = EasyID3()
+    tags["title"] = title
+    tags["artist"] = artist
+    tags.save(str(path))
+    return path
+
+
+def make_lib(paths) -> MediaLib:
+    items = ItemList(table=ItemTable())
+    for path in paths:
+        items.add(str(path), path.parent.stem)
+    return MediaLib(playlists=[Playlist(volume=Path("/"), kind="Single Playlist", title="All Items", items=items)])
+
+
+def test_tags_are_read_and_cached(tmp_path):
+    one = make_tagged_mp3(tmp_path.joinpath("Album", "one.mp3"), "First Song", "The Band")
+    two = make_tagged_mp3(tmp_path.joinpath("Album", "two.mp3"), "Second Song", "The Band")
+    cache = TagCache(tmp_path.joinpath("tags.sqlite"))
+
+    media_lib = make_lib([one, two])
+    assert TagScanner(media_lib, cache=cache, workers=1).scan() == 2
+    item = media_lib.get_playlist_by_id(0).get_item_by_id(1)
+    assert item.get_title() == "Second Song"
+    assert item.get_artist() == "The Band"
+    assert 0.5 < item.get_duration() < 1.5
+
+    # A fresh library gets its tags from the cache, except for the file that changed
+    make_tagged_mp3(two, "New Title", "The Band")
+    st = two.stat()
+    os.utime(two, ns=(st.st_atime_ns, st.st_mtime_ns + 2_000_000_000))
+    media_lib = make_lib([one, two])
+    assert TagScanner(media_lib, cache=cache, workers=2).scan() == 1
+    playlist = media_lib.get_playlist_by_id(0)
+    assert [item.get_title() for item in playlist.items] == ["First Song", "New Title"]
+    cache.close()
+
+
+def test_untagged_files_keep_their_file_names(tmp_path):
+    song = tmp_path.joinpath("Album", "03 Plain.mp3")
+    song.parent.mkdir()
+    song.write_bytes(b"ID3")
+    media_lib = make_lib([song])
+    TagScanner(media_lib, workers=1).scan()
+    item = media_lib.get_playlist_by_id(0).get_item_by_id(0)
+    assert item.get_title() == "03 Plain"
+    assert item.get_artist() is None
@@ -0,0 +1,36 @@
+from pathlib import Path
+
+from musiclib.volume_walker import VolumeWalker, WINDOWS_MEDIA, PLAYLIST_FILES, SINGLE
+from tests.conftest import touch
+
+
+def test_single_playlist_skips_system_folders(tmp_path):
+    touch(tmp_path.joinpath("Album", "b.mp3"))
+    touch(tmp_path.joinpath("Album", "a.mp3"))
+    touch(tmp_path.joinpath("Album", "._a.mp3"))
+    touch(tmp_path.joinpath(".Trashes", "deleted.mp3"))
+    touch(tmp_path.joinpath("System Volume Information", "junk.txt"))
+
+    scan = VolumeWalker().scan(tmp_path)
+    assert scan.kind == SINGLE
+    assert [Path(f.path).name for f in scan.music_files] == ["a.mp3", "b.mp3"]
+
+
+def test_text_playlists_win_over_music(tmp_path):
+    touch(tmp_path.joinpath("Album", "a.mp3"))
+    touch(tmp_path.joinpath("Lists", "mine.txt"), "Album/a.mp3\n")
+
+    scan = VolumeWalker().scan(tmp_path)
+    assert scan.kind == PLAYLIST_FILES
+    assert [Path(f.path).name for f in scan.playlist_files] == ["mine.txt"]
+    assert scan.music_files == []
+
+
+def test_windows_media_short_circuits(tmp_path):
+    touch(tmp_path.joinpath("Playlists", "mix.wpl"))
+    for i in range(5):
+        touch(tmp_path.joinpath(f"Album {i}", "song.mp3"))
+
+    scan = VolumeWalker().scan(tmp_path)
+    assert scan.kind == WINDOWS_MEDIA
+    assert scan.dirs_listed == 1